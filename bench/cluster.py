@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmarks each collector step end to end (subprocess, parsing, submission
+# into a mock stats client) against synthetic clusters of different sizes, or
+# against capture bundles recorded with CAPTURE_DIR, and prints the results as
+# JSON.
+#
+# Usage: python bench/cluster.py [--nodes 10,100,500] [--disks 12,60] [--output results.json]
+#        python bench/cluster.py --replay bundle.capture.json.gz[,...] [--replay-speed 1]
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from swift_health_statsd.capture    import CaptureReplay, load_bundle
+from swift_health_statsd.collector  import CollectorConfig
+from swift_health_statsd.dispersion import SwiftDispersionCollector
+from swift_health_statsd.recon      import SwiftReconCollector
+from synthetic import generate
+
+class CountingStatsClient(object):
+    """ Drop-in replacement for statsd.StatsClient that only counts gauges. """
+    def __init__(self):
+        self.count = 0
+    def pipeline(self):
+        return self
+    def gauge(self, metric, value):
+        self.count += 1
+    def send(self):
+        pass
+
+def measure(collector, step):
+    """ Runs a single step of the collector twice: once to measure time, and
+        once under tracemalloc to measure peak memory (since tracemalloc slows
+        down allocations considerably).
+    """
+    statsd = CountingStatsClient()
+    start = timeit.default_timer()
+    ok = collector.run(statsd, [step])
+    wall = timeit.default_timer() - start
+
+    tracemalloc.start()
+    collector.run(CountingStatsClient(), [step])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "step":               step,
+        "ok":                 ok,
+        "wall_seconds":       wall,
+        "metrics":            statsd.count,
+        "metrics_per_second": statsd.count / wall if wall > 0 else None,
+        "peak_memory_bytes":  peak,
+    }
+
+def benchmark(nodes, disks, batch):
+    directory = tempfile.mkdtemp(prefix="swift-health-statsd-bench-")
+    try:
+        capture_bytes = generate(directory, nodes, disks)
+        config = CollectorConfig(
+            recon_path             = os.path.join(directory, "recon.sh"),
+            dispersion_report_path = os.path.join(directory, "dispersion.sh"),
+            add_hostname_suffix    = True,
+            recon_batch            = batch,
+        )
+        results = []
+        for collector in [SwiftReconCollector(config), SwiftDispersionCollector(config)]:
+            for step in sorted(collector.collector_steps()):
+                results.append(measure(collector, step))
+        return {
+            "nodes":          nodes,
+            "disks_per_node": disks,
+            "recon_batch":    batch,
+            "capture_bytes":  capture_bytes,
+            "steps":          results,
+        }
+    finally:
+        shutil.rmtree(directory)
+
+def benchmark_replay(paths, speed):
+    """ Like benchmark(), but replays the given capture bundles (recorded
+        with the same settings) instead of synthetic captures.
+    """
+    bundles = [ load_bundle(path) for path in paths ]
+    settings = {}
+    for bundle in bundles:
+        settings.update(bundle["settings"])
+    names = set(bundle["collector"] for bundle in bundles)
+    results = []
+    for collector_class in [SwiftReconCollector, SwiftDispersionCollector]:
+        for name in sorted(names):
+            # bundles of clusters from a CLUSTERS_FILE are named like
+            # "<metric prefix>.swift_cluster"
+            metric_prefix, _, _ = name.rpartition(".")
+            config = CollectorConfig(
+                recon_path             = settings.get("recon_path", "swift-recon"),
+                dispersion_report_path = settings.get("dispersion_report_path", "swift-dispersion-report"),
+                recon_batch            = settings.get("recon_batch", False),
+                add_hostname_suffix    = True,
+                metric_prefix          = metric_prefix or None,
+                capture_replay         = CaptureReplay(bundles, speed),
+            )
+            collector = collector_class(config)
+            if collector.full_metric_prefix() != name:
+                continue
+            for step in sorted(collector.collector_steps()):
+                results.append(measure(collector, step))
+    return {
+        "replay":        paths,
+        "replay_speed":  speed,
+        "recon_batch":   settings.get("recon_batch", False),
+        "capture_bytes": sum(len(entry["output"]) for bundle in bundles for entry in bundle["commands"]),
+        "steps":         results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collectors against synthetic clusters.")
+    parser.add_argument("--nodes", default="10,100,500",
+        help="comma-separated list of cluster sizes (default: %(default)s)")
+    parser.add_argument("--disks", default="12,60",
+        help="comma-separated list of disks per node (default: %(default)s)")
+    parser.add_argument("--batch", action="store_true",
+        help="benchmark with SWIFT_RECON_BATCH=true")
+    parser.add_argument("--replay",
+        help="comma-separated list of capture bundles to replay instead of synthetic captures")
+    parser.add_argument("--replay-speed", type=float, default=0,
+        help="replay at this multiple of the recorded speed, or as fast as possible with 0 (default: %(default)s)")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    runs = []
+    if args.replay:
+        print("benchmarking replay of {}...".format(args.replay), file=sys.stderr)
+        runs.append(benchmark_replay(args.replay.split(","), args.replay_speed))
+    else:
+        for nodes in [ int(n) for n in args.nodes.split(",") ]:
+            for disks in [ int(d) for d in args.disks.split(",") ]:
+                print("benchmarking {} nodes with {} disks each...".format(nodes, disks), file=sys.stderr)
+                runs.append(benchmark(nodes, disks, args.batch))
+
+    report = {
+        "timestamp": int(time.time()),
+        "python":    platform.python_version(),
+        "runs":      runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+if __name__ == "__main__":
+    main()
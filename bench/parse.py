@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Micro-benchmark for swift_health_statsd.reprparse: parses the data structures
+# from all "->" lines in test/fixtures/recon_* with ast.literal_eval() and with
+# parse_repr(), and reports the time per line for both.
+#
+# Usage: python bench/parse.py [repetitions]
+
+from __future__ import print_function
+
+import ast
+import glob
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from swift_health_statsd.reprparse import parse_repr
+
+def load_fixture_lines():
+    """ Returns a dict mapping fixture names to the data strings in them. """
+    rx = re.compile(r'^-> https?://[a-zA-Z0-9-.]+\S*\s(.*)')
+    fixtures = {}
+    pattern = os.path.join(os.path.dirname(__file__), "..", "test", "fixtures", "recon_*")
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            lines = [ m.group(1) for m in map(rx.match, f) if m ]
+        # skip lines like "-> http://.../recon/ringmd5 matches."
+        lines = [ line for line in lines if line[:1] in "[{" ]
+        if lines:
+            fixtures[os.path.basename(path)] = lines
+    return fixtures
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    fixtures = load_fixture_lines()
+
+    print("{:<30} {:>7} {:>14} {:>14} {:>8}".format(
+        "fixture", "lines", "literal_eval", "parse_repr", "speedup"))
+    total_slow = total_fast = 0
+    for name, lines in sorted(fixtures.items()):
+        for line in lines:
+            assert parse_repr(line) == ast.literal_eval(line), line
+
+        slow = timeit.timeit(lambda: [ ast.literal_eval(l) for l in lines ], number=repetitions)
+        fast = timeit.timeit(lambda: [ parse_repr(l) for l in lines ], number=repetitions)
+        total_slow += slow
+        total_fast += fast
+        per_line = 1e6 / (repetitions * len(lines))
+        print("{:<30} {:>7} {:>11.1f} us {:>11.1f} us {:>7.1f}x".format(
+            name, len(lines), slow * per_line, fast * per_line, slow / fast))
+
+    print("{:<30} {:>7} {:>11.3f} s  {:>11.3f} s  {:>7.1f}x".format(
+        "total", "", total_slow, total_fast, total_slow / total_fast))
+
+if __name__ == "__main__":
+    main()
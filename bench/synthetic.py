@@ -0,0 +1,204 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Generates synthetic captures of `swift-recon -v` and `swift-dispersion-report
+# -j` output for clusters of arbitrary size, in the same layout as
+# test/fixtures/, so that they can be replayed with test/fixtures/recon.sh and
+# test/fixtures/dispersion.sh.
+
+import json
+import os
+import random
+import shutil
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "..", "test", "fixtures")
+
+PORTS = { "account": 6002, "container": 6001, "object": 6000 }
+
+HEADER = ("=" * 79 + "\n--> Starting reconnaissance on {} hosts\n" + "=" * 79 + "\n")
+FOOTER = "=" * 79 + "\n"
+TIMESTAMP = "[2017-01-10 14:10:43]"
+
+def host_ip(idx):
+    idx += 1
+    return "10.{}.{}.{}".format(idx >> 16, (idx >> 8) & 255, idx & 255)
+
+def device_name(idx):
+    """ Returns sdb, sdc, ..., sdz, sdaa, sdab, ... """
+    idx += 1
+    name = ""
+    while True:
+        name = chr(ord("a") + idx % 26) + name
+        idx = idx // 26 - 1
+        if idx < 0:
+            return "sd" + name
+
+def py2_repr(data):
+    """ Like repr(), but formats strings like Python 2 formats unicode strings,
+        since that's what swift-recon prints.
+    """
+    if isinstance(data, dict):
+        return "{" + ", ".join("{}: {}".format(py2_repr(k), py2_repr(v)) for k, v in data.items()) + "}"
+    if isinstance(data, list):
+        return "[" + ", ".join(py2_repr(v) for v in data) + "]"
+    if isinstance(data, str):
+        return "u" + repr(data)
+    return repr(data)
+
+def _line(host, server_type, endpoint, data):
+    return "-> http://{}:{}/recon/{}: {}\n".format(
+        host, PORTS[server_type], endpoint, py2_repr(data))
+
+def _section(nodes, banner, lines):
+    return HEADER.format(nodes) + "{} {}\n".format(TIMESTAMP, banner) + "".join(lines) + FOOTER
+
+def generate(directory, nodes, disks, seed=42, now=1484057460):
+    """ Writes synthetic captures for a cluster with the given number of
+        storage nodes and disks per node into `directory`, together with the
+        replay scripts. Returns the total size of the captures in bytes.
+    """
+    rnd = random.Random(seed)
+    hosts = [ host_ip(idx) for idx in range(nodes) ]
+    files = {}
+
+    lines = []
+    unmounted_lines = []
+    for host in hosts:
+        # like in real Swift, unmounted disks show up in the disk usage, too
+        unmounted = set(idx for idx in range(disks) if rnd.random() < 0.01)
+        usage = []
+        for idx in range(disks):
+            if idx in unmounted:
+                usage.append({ "device": device_name(idx), "avail": "",
+                               "mounted": False, "used": "", "size": "" })
+                continue
+            size = 5999038128128
+            used = int(size * rnd.uniform(0.05, 0.95))
+            usage.append({ "device": device_name(idx), "avail": size - used,
+                           "mounted": True, "used": used, "size": size })
+        lines.append(_line(host, "object", "diskusage", usage))
+        unmounted_lines.append(_line(host, "object", "unmounted",
+            [ { "device": device_name(idx), "mounted": False } for idx in sorted(unmounted) ]))
+    files["recon_diskusage"] = _section(nodes, "Checking disk usage now", lines)
+    files["recon_unmounted"] = _section(nodes,
+        "Getting unmounted drives from {} hosts...".format(nodes), unmounted_lines)
+
+    lines = [ _line(host, "object", "driveaudit", { "drive_audit_errors": rnd.randint(0, 2) })
+              for host in hosts ]
+    files["recon_driveaudit"] = _section(nodes, "Checking drive-audit errors", lines)
+
+    lines = [ _line(host, "object", "quarantined", {
+                "objects": rnd.randint(0, 5), "accounts": 0, "containers": rnd.randint(0, 1), "policies": {} })
+              for host in hosts ]
+    files["recon_quarantined"] = _section(nodes, "Checking quarantine", lines)
+
+    md5 = HEADER.format(nodes)
+    for banner, endpoint, files_md5 in [
+            ("Checking ring md5sums", "ringmd5", {
+                "/etc/swift/object.ring.gz": "355e381979fee90b50e2ba6eb5774b9a",
+                "/etc/swift/account.ring.gz": "bd50986039bfd3604a4cb2d42170ed25",
+                "/etc/swift/container.ring.gz": "534a76aabd4202a7b7062224d57c1cdd" }),
+            ("Checking swift.conf md5sum", "swiftconfmd5", {
+                "/etc/swift/swift.conf": "4d60a574c57e8cfd37c6eb56cfd92405" })]:
+        md5 += "{} {}\n".format(TIMESTAMP, banner)
+        md5 += "".join(_line(host, "object", endpoint, files_md5) for host in hosts)
+        md5 += "".join("-> http://{}:6000/recon/{} matches.\n".format(host, endpoint) for host in hosts)
+        md5 += "{0}/{0} hosts matched, 0 error[s] while checking hosts.\n".format(nodes)
+        md5 += FOOTER
+    files["recon_md5"] = md5
+
+    for server_type in ["container", "object"]:
+        key = server_type + "_updater_sweep"
+        lines = [ _line(host, server_type, "updater/" + server_type, { key: rnd.uniform(0.1, 20) })
+                  for host in hosts ]
+        files["recon_{}_updater".format(server_type)] = _section(nodes, "Checking updater times", lines)
+
+    for server_type in ["account", "container", "object"]:
+        lines = []
+        for host in hosts:
+            last = now - rnd.uniform(10, 800)
+            duration = rnd.uniform(0.2, 30)
+            data = { "replication_last": last, "replication_time": duration,
+                     "replication_stats": { "attempted": 21844, "failure": 0, "success": 43688 } }
+            if server_type == "object":
+                data["object_replication_last"] = last
+                data["object_replication_time"] = duration
+            lines.append(_line(host, server_type, "replication/" + server_type, data))
+        files["recon_{}_replication".format(server_type)] = _section(nodes, "Checking on replication", lines)
+
+    lines = [ _line(host, "object", "async", { "async_pending": rnd.randint(0, 20) }) for host in hosts ]
+    files["recon_async"] = _section(nodes, "Checking async pendings", lines)
+
+    lines = []
+    for host in hosts:
+        load = rnd.uniform(0.5, 8)
+        lines.append(_line(host, "object", "load", {
+            "1m": round(load, 2), "5m": round(load * 0.9, 2), "15m": round(load * 0.8, 2),
+            "processes": rnd.randint(10000, 15000), "tasks": "{}/1400".format(rnd.randint(1, 10)) }))
+    files["recon_loadstats"] = _section(nodes, "Checking load averages", lines)
+
+    lines = [ _line(host, "object", "sockstat", {
+                "tcp_in_use": rnd.randint(200, 900), "tcp6_in_use": rnd.randint(0, 20),
+                "time_wait": rnd.randint(100, 400), "orphan": rnd.randint(0, 3),
+                "tcp_mem_allocated_bytes": rnd.randint(10**6, 10**7) })
+              for host in hosts ]
+    files["recon_sockstat"] = _section(nodes, "Checking socket usage", lines)
+
+    for server_type in ["account", "container"]:
+        lines = [ _line(host, server_type, "auditor/" + server_type, {
+                    server_type + "_audits_passed": rnd.randint(1000, 50000),
+                    server_type + "_audits_failed": 0,
+                    server_type + "_audits_since": now - rnd.uniform(500, 1500),
+                    server_type + "_auditor_pass_completed": rnd.uniform(40, 300) })
+                  for host in hosts ]
+        files["recon_{}_auditor".format(server_type)] = _section(nodes, "Checking auditor stats", lines)
+
+    lines = []
+    for host in hosts:
+        # parallel auditors report their stats per disk
+        data = {}
+        for kind in ["ALL", "ZBF"]:
+            data["object_auditor_stats_" + kind] = {
+                device_name(idx): { "audit_time": rnd.uniform(100, 3000), "bytes_processed": rnd.randint(10**9, 10**11),
+                                    "errors": 0, "passes": rnd.randint(10000, 500000), "quarantined": rnd.randint(0, 1),
+                                    "start_time": now - rnd.uniform(3000, 8000) }
+                for idx in range(disks) }
+        lines.append(_line(host, "object", "auditor/object", data))
+    files["recon_object_auditor"] = _section(nodes, "Checking auditor stats", lines)
+
+    lines = [ _line(host, "object", "expirer/object", {
+                "object_expiration_pass": rnd.uniform(2, 30), "expired_last_pass": rnd.randint(0, 200) })
+              for host in hosts ]
+    files["recon_object_expirer"] = _section(nodes, "Checking on expirers", lines)
+
+    lines = [ _line(host, "object", "reconstruction/object", {
+                "object_reconstruction_last": now - rnd.uniform(10, 800),
+                "object_reconstruction_time": rnd.uniform(0.5, 20) })
+              for host in hosts ]
+    files["recon_object_reconstruction"] = _section(nodes, "Checking on reconstructors", lines)
+
+    copies = nodes * disks * 3
+    files["dispersion_json"] = "Using storage policy: default \n" + json.dumps({
+        "object":    { "retries": 0, "copies_expected": copies, "pct_found": 100.0, "overlapping": 0, "copies_found": copies },
+        "container": { "retries": 0, "copies_expected": copies, "pct_found": 100.0, "overlapping": 0, "copies_found": copies },
+    }) + "\n"
+
+    total = 0
+    for name, content in files.items():
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(content)
+        total += len(content)
+    for script in ["recon.sh", "dispersion.sh"]:
+        shutil.copy(os.path.join(FIXTURES_DIR, script), os.path.join(directory, script))
+    return total
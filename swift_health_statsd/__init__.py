@@ -12,40 +12,244 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import logging
 import os
+import signal
 import sys
+import threading
 
-from statsd import StatsClient
-
-from swift_health_statsd.collector  import CollectorConfig
+from swift_health_statsd.capture    import CaptureError, CaptureRecorder, CaptureReplay
+from swift_health_statsd.clusters   import Cluster, ClusterConfigError, load_clusters
+from swift_health_statsd.collector  import CollectorConfig, EmissionCache
+from swift_health_statsd.daemon     import Scheduler, parse_intervals
 from swift_health_statsd.dispersion import SwiftDispersionCollector
+from swift_health_statsd.history    import History
+from swift_health_statsd.pool       import WorkerPool
+from swift_health_statsd.profiling  import Profiler
+from swift_health_statsd.prometheus import MetricsSnapshot, PrometheusServer
 from swift_health_statsd.recon      import SwiftReconCollector
+from swift_health_statsd.sender     import QueuedStatsClient, TCPTransport, UDPTransport, UnixTransport
+from swift_health_statsd.ring       import parse_host_list
+
+def getenv_number(key, default, convert=int):
+    """ Like os.getenv(), but converts the value into a number. Exits with a
+        readable error message if the value is not a valid number.
+    """
+    value = os.getenv(key, default)
+    try:
+        return convert(value)
+    except ValueError:
+        logging.error("invalid value for {}: {!r} is not a valid {}".format(
+            key, value, "integer" if convert is int else "number"))
+        sys.exit(1)
+
+def getenv_numbers(key, default):
+    """ Like getenv_number(), but for a comma-separated list of numbers. """
+    value = os.getenv(key, default)
+    try:
+        return [ float(entry) for entry in value.split(",") if entry.strip() ]
+    except ValueError:
+        logging.error("invalid value for {}: {!r} is not a comma-separated list of numbers".format(key, value))
+        sys.exit(1)
 
 def main():
+    parser = argparse.ArgumentParser(description="Submit health data from "
+        "swift-dispersion-report and swift-recon to a statsd endpoint.")
+    parser.add_argument("--daemon", action="store_true",
+        help="keep running and collect metrics periodically (see README.md)")
+    args = parser.parse_args()
+
     log_level = os.getenv("LOG_LEVEL", "warn").upper()
     logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s: %(message)s")
 
     # initialize collector config
+    shard_index = getenv_number("SHARD_INDEX", "0")
+    shard_count = getenv_number("SHARD_COUNT", "1")
+    if not 0 <= shard_index < shard_count:
+        logging.error("invalid value for SHARD_INDEX: must be between 0 and SHARD_COUNT-1 = {}".format(shard_count - 1))
+        sys.exit(1)
     add_hostname_suffix = os.getenv("ADD_HOSTNAME_SUFFIX", "false") == "true"
+    recon_hosts = parse_host_list(os.getenv("SWIFT_RECON_HOSTS", ""))
+    emission_cache = None
+    if os.getenv("SUPPRESS_UNCHANGED", "false") == "true":
+        emission_cache = EmissionCache(
+            tolerance        = getenv_number("SUPPRESS_TOLERANCE", "0", float),
+            refresh_cycles   = getenv_number("FULL_REFRESH_CYCLES", "10"),
+            refresh_interval = getenv_number("FULL_REFRESH_INTERVAL", "3600", float),
+        )
+    history = None
+    history_size = getenv_number("HISTORY_SIZE", "12")
+    if history_size > 0:
+        history = History(history_size, path=os.getenv("HISTORY_FILE", "") or None)
+        history.load()
+    profiler = None
+    if os.getenv("PROFILE_DIR", ""):
+        profiler = Profiler(os.getenv("PROFILE_DIR"),
+            every = getenv_number("PROFILE_EVERY", "1"),
+            top   = getenv_number("PROFILE_TOP", "25"),
+        )
+    capture_recorder = None
+    if os.getenv("CAPTURE_DIR", ""):
+        capture_recorder = CaptureRecorder(os.getenv("CAPTURE_DIR"),
+            every = getenv_number("CAPTURE_EVERY", "1"))
+    capture_replay = None
+    replay_paths = [ path.strip() for path in os.getenv("CAPTURE_REPLAY", "").split(",") if path.strip() ]
+    if replay_paths:
+        try:
+            capture_replay = CaptureReplay.load(replay_paths,
+                speed = getenv_number("CAPTURE_REPLAY_SPEED", "0", float))
+        except CaptureError as e:
+            logging.error(str(e))
+            sys.exit(1)
+    metrics_snapshot = None
+    if os.getenv("PROMETHEUS_PORT", ""):
+        if args.daemon:
+            metrics_snapshot = MetricsSnapshot()
+        else:
+            logging.warning("PROMETHEUS_PORT is ignored without --daemon")
     config = CollectorConfig(
         recon_path             = os.getenv("SWIFT_RECON", "swift-recon"),
         dispersion_report_path = os.getenv("SWIFT_DISPERSION_REPORT",
                                            "swift-dispersion-report"),
         add_hostname_suffix    = add_hostname_suffix,
+        max_workers            = getenv_number("COLLECTOR_CONCURRENCY", "4"),
+        recon_backend          = os.getenv("SWIFT_RECON_BACKEND", "subprocess"),
+        recon_batch            = os.getenv("SWIFT_RECON_BATCH", "false") == "true",
+        recon_hosts            = recon_hosts or None,
+        recon_timeout          = getenv_number("SWIFT_RECON_TIMEOUT", "5", float),
+        recon_command_timeout  = getenv_number("SWIFT_RECON_COMMAND_TIMEOUT", "30", float),
+        recon_host_cooloff     = getenv_number("SWIFT_RECON_HOST_COOLOFF", "300", float),
+        recon_host_budget      = getenv_number("SWIFT_RECON_HOST_BUDGET", "0"),
+        recon_sampled_checks   = set(check.strip() for check in
+            os.getenv("SWIFT_RECON_SAMPLED_CHECKS", "diskusage,replication").split(",") if check.strip()),
+        recon_sample_max_age   = getenv_number("SWIFT_RECON_SAMPLE_MAX_AGE", "3600", float),
+        recon_http_workers     = getenv_number("SWIFT_RECON_HTTP_CONCURRENCY", "16"),
+        recon_http_connections_per_host =
+            getenv_number("SWIFT_RECON_HTTP_CONNECTIONS_PER_HOST", "2"),
+        swift_dir              = os.getenv("SWIFT_DIR", "/etc/swift"),
+        ring_rollups           = os.getenv("RING_ROLLUPS", "false") == "true",
+        emission_cache         = emission_cache,
+        self_metrics_prefix    = os.getenv("SELF_METRICS_PREFIX", ""),
+        metrics_snapshot       = metrics_snapshot,
+        diskusage_per_disk     = os.getenv("DISKUSAGE_PER_DISK", "false") == "true",
+        diskusage_thresholds   = getenv_numbers("DISKUSAGE_THRESHOLDS", "0.8,0.9,0.95"),
+        diskusage_top_k        = getenv_number("DISKUSAGE_TOP_K", "5"),
+        dispersion_timeout     = getenv_number("SWIFT_DISPERSION_TIMEOUT", "30", float),
+        dispersion_cache_path  = os.getenv("DISPERSION_CACHE_FILE", "") or None,
+        dispersion_cache_ttl   = getenv_number("DISPERSION_CACHE_TTL", "900", float),
+        history                = history,
+        shard_index            = shard_index,
+        shard_count            = shard_count,
+        profiler               = profiler,
+        capture_recorder       = capture_recorder,
+        capture_replay         = capture_replay,
     )
 
-    # initialize statsd client
-    statsd = StatsClient(
-        host = os.getenv("STATSD_HOST", "localhost"),
-        port = int(os.getenv("STATSD_PORT", "8125")),
+    # with a clusters file, each cluster gets a copy of the config with its
+    # own settings, and all of them share the statsd client, the history, the
+    # metrics snapshot and a global limit on concurrently running steps
+    clusters_path = os.getenv("CLUSTERS_FILE", "")
+    if clusters_path:
+        try:
+            clusters = load_clusters(clusters_path, config)
+        except ClusterConfigError as e:
+            logging.error("invalid clusters file: {}".format(e))
+            sys.exit(1)
+        max_concurrency = getenv_number("MAX_CONCURRENCY", str(config.max_workers))
+        if max_concurrency > 0:
+            step_slots = threading.BoundedSemaphore(max_concurrency)
+            for cluster in clusters:
+                cluster.config.step_slots = step_slots
+    else:
+        clusters = [ Cluster(None, config) ]
+
+    # initialize statsd client: metrics are queued and sent by a background
+    # thread, so that a slow or broken transport does not hold up collection
+    transport_type = os.getenv("STATSD_TRANSPORT", "udp")
+    statsd_host = os.getenv("STATSD_HOST", "localhost")
+    statsd_port = getenv_number("STATSD_PORT", "8125")
+    if transport_type == "udp":
+        transport = UDPTransport(statsd_host, statsd_port)
+    elif transport_type == "tcp":
+        transport = TCPTransport(statsd_host, statsd_port)
+    elif transport_type == "unix" and os.getenv("STATSD_SOCKET", ""):
+        transport = UnixTransport(os.getenv("STATSD_SOCKET"))
+    elif transport_type == "unix":
+        logging.error("STATSD_SOCKET is required for STATSD_TRANSPORT=unix")
+        sys.exit(1)
+    else:
+        logging.error("invalid value for STATSD_TRANSPORT: {!r}".format(transport_type))
+        sys.exit(1)
+    statsd = QueuedStatsClient(transport,
+        max_queue       = getenv_number("STATSD_QUEUE_SIZE", "100000"),
+        max_packet_size = getenv_number("STATSD_MAX_PACKET_SIZE", "512"),
+        rate            = getenv_number("STATSD_MAX_PACKETS_PER_SECOND", "0", float) or None,
     )
 
-    # run collectors
-    ok = True
-    for collector_class in [SwiftReconCollector, SwiftDispersionCollector]:
-        if not collector_class(config).run(statsd):
-            ok = False
+    collector_classes = [SwiftReconCollector, SwiftDispersionCollector]
+    try:
+        if args.daemon:
+            collectors = [ collector_class(cluster.config)
+                           for cluster in clusters for collector_class in collector_classes ]
+            run_daemon(collectors, statsd, metrics_snapshot)
+            return
+
+        # run collectors (the clusters concurrently, but the collectors of
+        # each cluster one after the other)
+        def run_cluster(cluster):
+            ok = True
+            for collector_class in collector_classes:
+                collector = collector_class(cluster.config)
+                try:
+                    if not collector.run(statsd):
+                        ok = False
+                finally:
+                    collector.close()
+            return ok
+        ok = all(WorkerPool(len(clusters)).map(run_cluster, clusters))
+    finally:
+        if history is not None:
+            history.save()
+        statsd.close(timeout=getenv_number("STATSD_FLUSH_TIMEOUT", "10", float))
 
     if not ok:
         sys.exit(1)
+
+def run_daemon(collectors, statsd, metrics_snapshot):
+    intervals = {
+        SwiftReconCollector:      getenv_number("RECON_INTERVAL", "300", float),
+        SwiftDispersionCollector: getenv_number("DISPERSION_INTERVAL", "900", float),
+    }
+    try:
+        step_intervals = parse_intervals(os.getenv("STEP_INTERVALS", ""))
+    except ValueError:
+        logging.error("invalid value for STEP_INTERVALS: {!r}".format(os.getenv("STEP_INTERVALS")))
+        sys.exit(1)
+
+    scheduler = Scheduler(statsd)
+    for collector in collectors:
+        scheduler.add_collector(collector, intervals[type(collector)], step_intervals)
+
+    known_steps = set(name for collector in collectors for name in collector.collector_steps())
+    for name in sorted(set(step_intervals) - known_steps):
+        logging.warning("STEP_INTERVALS refers to unknown step \"{}\"".format(name))
+
+    server = None
+    if metrics_snapshot is not None:
+        server = PrometheusServer(metrics_snapshot,
+            address = os.getenv("PROMETHEUS_ADDRESS", ""),
+            port    = getenv_number("PROMETHEUS_PORT", "9520"),
+        )
+        server.start()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+        for collector in collectors:
+            collector.close()
@@ -0,0 +1,209 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+from swift_health_statsd.ipc import Result, clock
+
+log = logging.getLogger(__name__)
+
+# version of the capture bundle format
+CAPTURE_VERSION = 1
+
+class CaptureError(Exception):
+    pass
+
+class CaptureRecorder(object):
+    """ Records the output of every command that the collectors run (i.e.
+        `swift-recon` and `swift-dispersion-report`) together with its exit
+        status and latency. At the end of each run of a collector, the
+        commands that finished since its previous run are written into a
+        capture bundle in `directory`: a gzipped JSON file named
+        `<time>.<collector>.run<N>.capture.json.gz`.
+
+        Only every `every`-th run of each collector is recorded.
+    """
+
+    def __init__(self, directory, every=1):
+        self.directory = directory
+        self.every = max(1, int(every))
+        self.__cycles = {}
+        self.__commands = {}
+        self.__lock = threading.Lock()
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def start_cycle(self, collector_name):
+        """ Call this at the start of each run of a collector. Returns whether
+            the commands of this run shall be recorded.
+        """
+        with self.__lock:
+            count = self.__cycles.get(collector_name, 0)
+            self.__cycles[collector_name] = count + 1
+            recorded = count % self.every == 0
+            if recorded:
+                self.__commands.setdefault(collector_name, [])
+            else:
+                self.__commands.pop(collector_name, None)
+            return recorded
+
+    def add(self, collector_name, started, result, output):
+        """ Records one command that was started at `started` (a timestamp),
+            ended as described by the ipc.Result, and printed `output`.
+            Commands that finish while the collector's run is not recorded
+            are ignored.
+        """
+        entry = {
+            "command":    result.command,
+            "started":    started,
+            "duration":   result.duration,
+            "returncode": result.returncode,
+            "timed_out":  result.timed_out,
+            "cancelled":  result.cancelled,
+            "output":     output,
+        }
+        with self.__lock:
+            commands = self.__commands.get(collector_name)
+            if commands is not None:
+                commands.append(entry)
+
+    def finish_cycle(self, collector_name, settings=None):
+        """ Call this at the end of each run of a collector. Writes the
+            bundle, with `settings` (a dict) describing how the commands were
+            run. Returns its path, or None if nothing was written.
+        """
+        with self.__lock:
+            commands = self.__commands.pop(collector_name, None)
+            cycle = self.__cycles.get(collector_name, 1) - 1
+        if commands is None:
+            return None
+        bundle = {
+            "version":   CAPTURE_VERSION,
+            "collector": collector_name,
+            "created":   time.time(),
+            "settings":  settings or {},
+            "commands":  commands,
+        }
+        path = os.path.join(self.directory, "{}.{}.run{}.capture.json.gz".format(
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime(bundle["created"])), collector_name, cycle))
+        try:
+            with gzip.open(path + ".tmp", "wb") as f:
+                f.write(json.dumps(bundle).encode("utf-8"))
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            log.warning("cannot write capture bundle for {}: {}".format(collector_name, e))
+            return None
+        log.info("recorded {} commands to {}".format(len(commands), path))
+        return path
+
+def load_bundle(path):
+    """ Reads a capture bundle written by CaptureRecorder. Raises
+        CaptureError if it cannot be read.
+    """
+    try:
+        with gzip.open(path, "rb") as f:
+            bundle = json.loads(f.read().decode("utf-8"))
+    except (IOError, OSError, ValueError) as e:
+        raise CaptureError("cannot read capture bundle {}: {}".format(path, e))
+    if not isinstance(bundle, dict) or bundle.get("version") != CAPTURE_VERSION:
+        raise CaptureError("{} is not a capture bundle of version {}".format(path, CAPTURE_VERSION))
+    return bundle
+
+class ReplayProcess(object):
+    """ Stands in for an ipc.Process, but returns the recorded output and exit
+        status of a command.
+    """
+
+    def __init__(self, command, timeout, entry, speed):
+        self.command = command
+        self.timeout = timeout
+        self.entry = entry
+        self.speed = speed
+        self.start = clock()
+        self.finished = False
+
+    def __wait(self, fraction):
+        """ At recorded speed, sleeps until `fraction` of the recorded duration
+            (divided by the speed factor) has passed since the start.
+        """
+        if self.speed:
+            remaining = self.start + fraction * self.entry["duration"] / self.speed - clock()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def lines(self):
+        # at recorded speed, the lines come in evenly spread over the
+        # recorded duration
+        lines = self.entry["output"].splitlines(True)
+        for idx, line in enumerate(lines):
+            self.__wait(float(idx + 1) / (len(lines) + 1))
+            yield line
+        self.finished = True
+
+    def finish(self):
+        cancelled = not self.finished
+        if not cancelled:
+            self.__wait(1.0)
+        return Result(self.command, self.timeout, self.entry["returncode"],
+            clock() - self.start, self.entry["timed_out"], cancelled)
+
+class CaptureReplay(object):
+    """ Feeds the commands recorded in capture bundles back into the
+        collectors, instead of running them. Each collector replays the
+        bundles that were recorded for it (i.e. for the same metric prefix).
+        When a command ran several times, its recorded runs are replayed in
+        turn, and over again.
+
+        With `speed` 0, the output is returned as fast as possible. Otherwise,
+        each command takes its recorded latency divided by `speed` (e.g. 1 for
+        the recorded speed, 2 for twice as fast).
+    """
+
+    def __init__(self, bundles, speed=0):
+        self.speed = speed
+        self.__entries = {}
+        self.__calls = {}
+        self.__lock = threading.Lock()
+        for bundle in bundles:
+            for entry in bundle["commands"]:
+                key = (bundle["collector"], entry["command"])
+                self.__entries.setdefault(key, []).append(entry)
+
+    @classmethod
+    def load(cls, paths, speed=0):
+        """ Returns a CaptureReplay for the capture bundles at the given paths. """
+        return cls([ load_bundle(path) for path in paths ], speed)
+
+    def start(self, collector_name, command, timeout=None):
+        """ Like ipc.ProcessRunner.start(), but returns a ReplayProcess. Raises
+            CaptureError if the command was not recorded for this collector.
+        """
+        key = (collector_name, command)
+        with self.__lock:
+            entries = self.__entries.get(key)
+            if not entries:
+                raise CaptureError("no recorded output for \"{}\" of {} (was it recorded with other settings?)"
+                    .format(command, collector_name))
+            call = self.__calls.get(key, 0)
+            self.__calls[key] = call + 1
+        return ReplayProcess(command, timeout, entries[call % len(entries)], self.speed)
@@ -0,0 +1,101 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import json
+import re
+
+from swift_health_statsd.ring import parse_host_list
+
+METRIC_PREFIX_INVALID_RX = re.compile(r"[^a-zA-Z0-9_]")
+
+# json returns unicode strings on Python 2
+STRING_TYPES = (str, type(u""))
+
+# settings that can be given for each cluster in the clusters file, with the
+# CollectorConfig field that they set and how to convert their value; they are
+# named like the environment variables that set the same fields for all
+# clusters
+CLUSTER_SETTINGS = {
+    "swift_recon":             ("recon_path", str),
+    "swift_dispersion_report": ("dispersion_report_path", str),
+    "swift_dir":               ("swift_dir", str),
+    "swift_recon_backend":     ("recon_backend", str),
+    "swift_recon_hosts":       ("recon_hosts", lambda value: parse_host_list(value) or None),
+    "dispersion_cache_file":   ("dispersion_cache_path", lambda value: str(value) or None),
+}
+
+class ClusterConfigError(Exception):
+    pass
+
+class Cluster(object):
+    """ One Swift cluster that is collected by this process. """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+
+def default_metric_prefix(name):
+    """ Derives a metric prefix from a cluster name, e.g. "eu_de_1" from
+        "eu-de-1".
+    """
+    return METRIC_PREFIX_INVALID_RX.sub("_", name)
+
+def parse_clusters(data, base_config):
+    """ Returns a list of Cluster objects for the given clusters file
+        contents (already decoded from JSON). Each cluster gets a copy of
+        `base_config` with the cluster's own settings applied. Raises
+        ClusterConfigError if the contents are invalid.
+    """
+    entries = data.get("clusters") if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ClusterConfigError("expected an object with a non-empty list of \"clusters\"")
+
+    clusters = []
+    prefixes = set()
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("name"):
+            raise ClusterConfigError("each cluster needs a \"name\"")
+        name = entry["name"]
+        config = copy.copy(base_config)
+        config.cluster_name = name
+        config.metric_prefix = entry.get("metric_prefix", default_metric_prefix(name))
+        if config.metric_prefix in prefixes:
+            raise ClusterConfigError("cluster \"{}\" has the same metric prefix as another cluster".format(name))
+        prefixes.add(config.metric_prefix)
+
+        for key, value in entry.items():
+            if key in ("name", "metric_prefix"):
+                continue
+            if key not in CLUSTER_SETTINGS:
+                raise ClusterConfigError("unknown setting \"{}\" for cluster \"{}\"".format(key, name))
+            if not isinstance(value, STRING_TYPES):
+                raise ClusterConfigError("setting \"{}\" for cluster \"{}\" must be a string".format(key, name))
+            field, convert = CLUSTER_SETTINGS[key]
+            setattr(config, field, convert(value))
+
+        # a cache file shared by all clusters would mix up their reports
+        if "dispersion_cache_file" not in entry and config.dispersion_cache_path:
+            config.dispersion_cache_path = "{}.{}".format(config.dispersion_cache_path, config.metric_prefix)
+        clusters.append(Cluster(name, config))
+    return clusters
+
+def load_clusters(path, base_config):
+    """ Like parse_clusters(), but reads the clusters file from `path`. """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        raise ClusterConfigError("cannot read {}: {}".format(path, e))
+    return parse_clusters(data, base_config)
@@ -12,10 +12,73 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import numbers
 import sys
+import threading
+import time
 import traceback
 
+from swift_health_statsd.ipc import default_runner
+from swift_health_statsd.pool import WorkerPool
+from swift_health_statsd.ring import shard_of
+
+# a clock that is not affected by changes to the system time (Python 2 does
+# not have one, so fall back to the wall clock there)
+clock = getattr(time, "monotonic", time.time)
+
+# the counters that are reported for each step when self-instrumentation is
+# enabled (in addition to the timers "wall_time" and "subprocess_time")
+STEP_COUNTERS = [
+    "metrics_submitted",
+    "metrics_skipped",
+    "metrics_unchanged",
+    "output_bytes",
+    "lines_parsed",
+    "parse_failures",
+    "hosts",
+    "hosts_skipped",
+]
+
+class EmissionCache(object):
+    """ Remembers the last value sent for each metric, so that collectors can
+        skip sending values that did not change since then. To make sure
+        that the receiver does not hold on to stale state forever, a value is
+        sent regardless if it was withheld `refresh_cycles - 1` times in a row,
+        or if it was last sent `refresh_interval` seconds ago. This is tracked
+        per metric, so it does not matter how often the step that submits a
+        metric runs compared to the other steps of its collector.
+    """
+
+    def __init__(self, tolerance=0.0, refresh_cycles=None, refresh_interval=None):
+        """ A value counts as unchanged if it differs from the last value
+            sent by at most `tolerance` times the last value.
+        """
+        self.tolerance = tolerance
+        self.refresh_cycles = refresh_cycles
+        self.refresh_interval = refresh_interval
+        # metric -> (last value sent, times withheld since, when it was sent)
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def should_send(self, metric, value):
+        """ Returns whether the given metric value needs to be sent, and if
+            so, remembers it as the last value sent.
+        """
+        now = clock()
+        with self.__lock:
+            entry = self.__values.get(metric)
+            if entry is not None:
+                last, withheld, sent_at = entry
+                refresh = ((self.refresh_cycles and withheld + 1 >= self.refresh_cycles)
+                    or (self.refresh_interval is not None
+                        and now - sent_at >= self.refresh_interval))
+                if not refresh and abs(value - last) <= self.tolerance * abs(last):
+                    self.__values[metric] = (last, withheld + 1, sent_at)
+                    return False
+            self.__values[metric] = (value, 0, now)
+            return True
+
 class CollectorConfig(object):
     """ Helper class for the Collector class that contains its configuration
         options. This is usually initialized from os.getenv(), unless
@@ -28,6 +91,38 @@ class CollectorConfig(object):
             add_hostname_suffix (boolean)
             recon_path          (string)
             dispersion_path     (string)
+            max_workers         (integer)
+            recon_backend       (string, "subprocess" or "http")
+            recon_hosts         (list of (host, port), or None)
+            recon_timeout       (number)
+            recon_http_workers  (integer)
+            recon_http_connections_per_host (integer)
+            recon_batch         (boolean)
+            swift_dir           (string)
+            emission_cache      (EmissionCache, or None to send all values)
+            self_metrics_prefix (string, or None to not report own metrics)
+            metrics_snapshot    (prometheus.MetricsSnapshot, or None)
+            diskusage_per_disk  (boolean)
+            diskusage_thresholds (list of numbers)
+            diskusage_top_k     (integer)
+            dispersion_timeout  (number)
+            dispersion_cache_path (string, or None to disable the cache)
+            dispersion_cache_ttl (number)
+            history             (history.History, or None to not derive rates and trends)
+            shard_index         (integer)
+            shard_count         (integer)
+            recon_command_timeout (number)
+            recon_host_cooloff  (number, 0 to disable the circuit breaker)
+            cluster_name        (string, or None if only one cluster is collected)
+            metric_prefix       (string, or None; prepended to all metric names)
+            step_slots          (threading.Semaphore shared by all collectors, or None)
+            profiler            (profiling.Profiler, or None)
+            recon_host_budget   (integer, 0 to query all hosts in each run)
+            recon_sampled_checks (set of check names, e.g. "diskusage")
+            recon_sample_max_age (number of seconds, 0 to keep sampled data forever)
+            ring_rollups        (boolean)
+            capture_recorder    (capture.CaptureRecorder, or None)
+            capture_replay      (capture.CaptureReplay, or None to run the actual commands)
 
             The semantics of these fields are equivalent to the environment
             variables noted in the README.md
@@ -36,6 +131,39 @@ class CollectorConfig(object):
         self.recon_path = kwargs.get("recon_path", "swift-recon")
         self.dispersion_report_path = kwargs.get("dispersion_report_path",
             "swift-dispersion-report")
+        self.max_workers = kwargs.get("max_workers", 4)
+        self.recon_backend = kwargs.get("recon_backend", "subprocess")
+        self.recon_hosts = kwargs.get("recon_hosts", None)
+        self.recon_timeout = kwargs.get("recon_timeout", 5)
+        self.recon_http_workers = kwargs.get("recon_http_workers", 16)
+        self.recon_http_connections_per_host = kwargs.get(
+            "recon_http_connections_per_host", 2)
+        self.recon_batch = kwargs.get("recon_batch", False)
+        self.swift_dir = kwargs.get("swift_dir", "/etc/swift")
+        self.emission_cache = kwargs.get("emission_cache", None)
+        self.self_metrics_prefix = kwargs.get("self_metrics_prefix", None)
+        self.metrics_snapshot = kwargs.get("metrics_snapshot", None)
+        self.diskusage_per_disk = kwargs.get("diskusage_per_disk", False)
+        self.diskusage_thresholds = kwargs.get("diskusage_thresholds", [0.8, 0.9, 0.95])
+        self.diskusage_top_k = kwargs.get("diskusage_top_k", 5)
+        self.dispersion_timeout = kwargs.get("dispersion_timeout", 30)
+        self.dispersion_cache_path = kwargs.get("dispersion_cache_path", None)
+        self.dispersion_cache_ttl = kwargs.get("dispersion_cache_ttl", 900)
+        self.history = kwargs.get("history", None)
+        self.shard_index = kwargs.get("shard_index", 0)
+        self.shard_count = kwargs.get("shard_count", 1)
+        self.recon_command_timeout = kwargs.get("recon_command_timeout", 30)
+        self.recon_host_cooloff = kwargs.get("recon_host_cooloff", 300)
+        self.cluster_name = kwargs.get("cluster_name", None)
+        self.metric_prefix = kwargs.get("metric_prefix", None)
+        self.step_slots = kwargs.get("step_slots", None)
+        self.profiler = kwargs.get("profiler", None)
+        self.recon_host_budget = kwargs.get("recon_host_budget", 0)
+        self.recon_sampled_checks = kwargs.get("recon_sampled_checks", set(["diskusage", "replication"]))
+        self.recon_sample_max_age = kwargs.get("recon_sample_max_age", 3600)
+        self.ring_rollups = kwargs.get("ring_rollups", False)
+        self.capture_recorder = kwargs.get("capture_recorder", None)
+        self.capture_replay = kwargs.get("capture_replay", None)
 
 class Collector(object):
     """ Subclasses of this implement collection of a certain type of metrics.
@@ -48,6 +176,12 @@ class Collector(object):
         """ Initializer. Takes a CollectorConfig instance. """
         self.config = config
 
+    def prepare(self):
+        """ May be overridden by subclass to reset per-cycle state. Called at
+            the start of each run(), before any step.
+        """
+        pass
+
     def collector_steps(self):
         """ Must be overridden by subclass. Returns a dict mapping step names
         to steps (functions that collect metrics, and submit them by calling
@@ -65,38 +199,235 @@ class Collector(object):
         """
         raise NotImplementedError
 
-    def run(self, statsd):
+    def close(self):
+        """ May be overridden by subclass to release resources (e.g. network
+            connections) that are kept between runs.
+        """
+        pass
+
+    def full_metric_prefix(self):
+        """ Returns metric_name_prefix(), below config.metric_prefix if one
+            is configured (e.g. "eu_de_1.swift_cluster").
+        """
+        if not self.config.metric_prefix:
+            return self.metric_name_prefix()
+        return "{}.{}".format(self.config.metric_prefix, self.metric_name_prefix())
+
+    def run(self, statsd, steps=None):
         """ Collect and return a dict with the values of all gauges. Takes a
-            statsd.StatsClient instance.
+            statsd.StatsClient or sender.QueuedStatsClient instance. Independent steps run concurrently,
+            with at most config.max_workers steps at once. If `steps` is given,
+            only the steps with these names are run. Metrics are sent in
+            batches at the end of each step.
         """
         self.__log = self.logger()
         self.__metric_count = 0
         self.__skipped_count = 0
-        self.__statsd = statsd
+        self.__suppressed_count = 0
+        self.__lock = threading.Lock()
+        # metrics are buffered and sent in packets of multiple metrics: one
+        # buffer per step (since steps run concurrently), plus one for metrics
+        # submitted outside of steps
+        self.__pipeline = statsd.pipeline()
+        self.__step_pipeline = threading.local()
+        # per-step counters for self-instrumentation
+        self.__step_stats = threading.local()
+        # all values submitted by each step, for the metrics snapshot
+        self.__step_samples = threading.local()
+        samples_by_step = {}
+        run_start = clock()
+        profiler = self.config.profiler
+        profiled = profiler is not None and profiler.start_cycle(self.full_metric_prefix())
+        recorder = self.config.capture_recorder
+        recorded = recorder is not None and recorder.start_cycle(self.full_metric_prefix())
+        self.prepare()
 
-        ok = True
-        for name, step in self.collector_steps().items():
+        def run_step(item):
+            name, step = item
+            self.__step_pipeline.value = statsd.pipeline()
+            self.__step_stats.value = dict.fromkeys(STEP_COUNTERS, 0)
+            self.__step_stats.value["subprocess_time"] = 0.0
+            self.__step_samples.value = []
+            start = clock()
+            slots = self.config.step_slots
+            if profiled:
+                step = functools.partial(profiler.run, self.full_metric_prefix(), name, step)
             try:
-                step()
+                # with several clusters, the number of steps running at the
+                # same time is limited across all of their collectors
+                if slots is not None:
+                    with slots:
+                        step()
+                else:
+                    step()
+                # only complete steps replace the values in the snapshot
+                with self.__lock:
+                    samples_by_step[name] = self.__step_samples.value
+                return True
             except:
-                ok = False
-                self.__log.error("collector \"{}\" failed, detailed exception follows".format(name))
-                traceback.print_exc(None, sys.stderr) # logs exception and traceback
+                with self.__lock:
+                    self.__log.error("collector \"{}\" failed, detailed exception follows".format(name))
+                    traceback.print_exc(None, sys.stderr) # logs exception and traceback
+                return False
+            finally:
+                self.__send_step_stats(name, clock() - start)
+                self.__step_pipeline.value.send()
+                self.__step_pipeline.value = None
+                self.__step_stats.value = None
+                self.__step_samples.value = None
+
+        # profiled steps run one after the other anyway
+        pool = WorkerPool(1 if profiled else self.config.max_workers)
+        selected_steps = [ (name, step) for name, step in self.collector_steps().items()
+                           if steps is None or name in steps ]
+        results = pool.map(run_step, selected_steps)
+        ok = all(results)
+        if recorded:
+            # what is needed to replay the bundle with the same commands
+            recorder.finish_cycle(self.full_metric_prefix(), {
+                "recon_path":             self.config.recon_path,
+                "dispersion_report_path": self.config.dispersion_report_path,
+                "recon_batch":            self.config.recon_batch,
+            })
+        if self.config.metrics_snapshot is not None:
+            self.config.metrics_snapshot.update(self.full_metric_prefix(), samples_by_step)
 
-        self.__log.info("Submitted {} {} metrics ({} skipped)"
+        prefix = self.self_metric_prefix()
+        if prefix is not None:
+            self.__pipeline.timing(prefix + "run_duration", 1000 * (clock() - run_start))
+            self.__pipeline.gauge(prefix + "steps_failed", results.count(False))
+            self.__pipeline.gauge(prefix + "metrics_submitted", self.__metric_count)
+            self.__pipeline.gauge(prefix + "metrics_skipped", self.__skipped_count)
+            self.__pipeline.gauge(prefix + "metrics_unchanged", self.__suppressed_count)
+            # the counters of a sender.QueuedStatsClient (shared by all collectors)
+            sender_stats = getattr(statsd, "sender_stats", None)
+            if sender_stats is not None:
+                for name, value in sorted(sender_stats().items()):
+                    self.__pipeline.gauge("{}.sender.{}".format(self.config.self_metrics_prefix, name), value)
+        self.__pipeline.send()
+
+        self.__log.info("Submitted {} {} metrics ({} skipped, {} unchanged)"
             .format(self.__metric_count,
-                    self.metric_name_prefix(),
-                    self.__skipped_count))
+                    self.full_metric_prefix(),
+                    self.__skipped_count,
+                    self.__suppressed_count))
 
         return ok and self.__skipped_count == 0
 
-    def submit(self, metric, value, hostname=None):
-        """ Call this from collect() to submit a metric value. """
+    def self_metric_prefix(self):
+        """ Returns the prefix for the metrics that describe this collector
+            itself (e.g. "swift_health_statsd.swift_cluster."), or None if
+            self-instrumentation is disabled.
+        """
+        if not self.config.self_metrics_prefix:
+            return None
+        return "{}.{}.".format(self.config.self_metrics_prefix, self.full_metric_prefix())
+
+    def __send_step_stats(self, name, wall_time):
+        prefix = self.self_metric_prefix()
+        if prefix is None:
+            return
+        prefix += "step.{}.".format(name)
+        stats = self.__step_stats.value
+        pipeline = self.__step_pipeline.value
+        pipeline.timing(prefix + "wall_time", 1000 * wall_time)
+        pipeline.timing(prefix + "subprocess_time", 1000 * stats["subprocess_time"])
+        for counter in STEP_COUNTERS:
+            pipeline.gauge(prefix + counter, stats[counter])
+
+    def record(self, counter, amount=1):
+        """ Call this from a step to add `amount` to one of the counters in
+            STEP_COUNTERS (or to "subprocess_time", in seconds) for the
+            current step. Does nothing outside of steps.
+        """
+        stats = getattr(self.__step_stats, "value", None)
+        if stats is not None:
+            stats[counter] += amount
+
+    def iter_command_lines(self, command, timeout=None, on_result=None):
+        """ Like ipc.iter_lines(), but records the time spent until the
+            command has exited and the amount of output read in the counters
+            of the current step. If given, `on_result` is called with the
+            ipc.Result once the command has exited. With a capture recorder,
+            the command and its output are recorded; with a capture replay,
+            the recorded output is returned instead of running the command.
+        """
+        started = time.time()
+        if self.config.capture_replay is not None:
+            process = self.config.capture_replay.start(self.full_metric_prefix(), command, timeout)
+        else:
+            process = default_runner().start(command, timeout)
+        recorder = self.config.capture_recorder
+        output = [] if recorder is not None else None
+        try:
+            for line in process.lines():
+                self.record("output_bytes", len(line))
+                if output is not None:
+                    output.append(line)
+                yield line.rstrip("\n")
+        finally:
+            result = process.finish()
+            self.record("subprocess_time", result.duration)
+            if output is not None:
+                recorder.add(self.full_metric_prefix(), started, result, "".join(output))
+            if on_result is not None:
+                on_result(result)
+        result.check()
+
+    def is_designated_shard(self):
+        """ Returns whether this instance reports the cluster-wide metrics
+            (i.e. those not submitted with a hostname). When sharding is
+            enabled, that's the job of the first shard.
+        """
+        return self.config.shard_index == 0
+
+    def owns_host(self, hostname):
+        """ Returns whether this instance reports the per-host metrics of the
+            given host.
+        """
+        if self.config.shard_count <= 1:
+            return True
+        return shard_of(hostname, self.config.shard_count) == self.config.shard_index
+
+    def remember(self, metric, value, hostname=None):
+        """ Call this from a step to add a value to the history of the given
+            metric (per host, if a hostname is given). Returns the
+            history.Series, or None if no history is kept.
+        """
+        if self.config.history is None or value is None:
+            return None
+        key = "{}.{}".format(self.full_metric_prefix(), metric)
+        if hostname is not None:
+            key = "{}.from.{}".format(key, hostname)
+        return self.config.history.add(key, time.time(), value)
+
+    def submit_derived(self, metric, value, hostname=None, series=None):
+        """ Like submit(), but for values derived from the history (e.g.
+            rates): these are not known until enough history is available,
+            so None values are dropped silently instead of being reported as
+            skipped.
+        """
+        if value is not None:
+            self.submit(metric, value, hostname, series)
+
+    def submit(self, metric, value, hostname=None, series=None):
+        """ Call this from collect() to submit a metric value. For receivers
+            that support labels (i.e. the metrics snapshot), `series` may give
+            a (name, labels) tuple if the metric name contains label values
+            such as a disk name. The hostname is always added as a label.
+        """
+        # with sharding, each value is reported by exactly one instance
+        if hostname is None:
+            if not self.is_designated_shard():
+                return
+        elif not self.owns_host(hostname):
+            return
+
         # since StatsD has no concept of labels (like in Prometheus) or
         # dimensions (like in Monasca), we just discard the hostname
         # here and submit the values individually, so that max/min/avg
         # will still work as expected...
-        this_metric = "{}.{}".format(self.metric_name_prefix(), metric)
+        this_metric = "{}.{}".format(self.full_metric_prefix(), metric)
         if hostname is not None and self.config.add_hostname_suffix:
             # ...unless the caller advised us to include the hostname
             # in the label name
@@ -105,10 +436,36 @@ class Collector(object):
         # skip metric if no useful value was provided
         if value is None:
             self.__log.warn("Not sending {0} = None".format(this_metric))
-            self.__skipped_count += 1
+            with self.__lock:
+                self.__skipped_count += 1
+            self.record("metrics_skipped")
             return
 
-        self.__log.debug("Sending {0} = {1}".format(this_metric, value))
         assert isinstance(value, numbers.Real)
-        self.__metric_count += 1
-        self.__statsd.gauge(this_metric, value)
+
+        samples = getattr(self.__step_samples, "value", None)
+        if samples is not None:
+            name, labels = series or (metric, {})
+            if hostname is not None:
+                labels = dict(labels, host=hostname)
+            if self.config.cluster_name is not None:
+                labels = dict(labels, cluster=self.config.cluster_name)
+            samples.append(("{}_{}".format(self.metric_name_prefix(), name), labels, value))
+
+        # skip metric if it did not change since the last time we sent it
+        # (only for metrics that identify a single value: when several hosts
+        # submit values under the same name, the receiver needs all of them)
+        cache = self.config.emission_cache
+        if cache is not None and (hostname is None or self.config.add_hostname_suffix):
+            if not cache.should_send(this_metric, value):
+                with self.__lock:
+                    self.__suppressed_count += 1
+                self.record("metrics_unchanged")
+                return
+
+        self.__log.debug("Sending {0} = {1}".format(this_metric, value))
+        with self.__lock:
+            self.__metric_count += 1
+        self.record("metrics_submitted")
+        pipeline = getattr(self.__step_pipeline, "value", None) or self.__pipeline
+        pipeline.gauge(this_metric, value)
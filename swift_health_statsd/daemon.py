@@ -0,0 +1,142 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+
+from swift_health_statsd.collector import clock
+
+log = logging.getLogger(__name__)
+
+def parse_intervals(value):
+    """ Parses a comma-separated list of "name=seconds" entries into a dict. """
+    intervals = {}
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, seconds = entry.partition("=")
+        intervals[name.strip()] = float(seconds)
+    return intervals
+
+class Job(object):
+    """ A set of steps of one collector that runs every `interval` seconds. """
+
+    def __init__(self, collector, steps, interval):
+        self.collector = collector
+        self.steps = steps
+        self.interval = interval
+        self.next_run = None
+
+    def __str__(self):
+        return "{} ({})".format(self.collector.full_metric_prefix(),
+                                ", ".join(sorted(self.steps)))
+
+class Scheduler(object):
+    """ Runs collectors periodically within a long-running process. Each run
+        happens in its own thread, but runs of the same collector never
+        overlap: the steps of all jobs of a collector that are due at the
+        same time are merged into one run, and jobs that come due while their
+        collector is still busy wait until it is done (ticks that are missed
+        in the meantime are skipped).
+    """
+
+    def __init__(self, statsd):
+        self.statsd = statsd
+        self.jobs = []
+        self.__busy = set()
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        # set whenever a run finishes or stop() is called
+        self.__wakeup = threading.Event()
+
+    def add_collector(self, collector, interval, step_intervals=None):
+        """ Schedules all steps of the given collector to run every `interval`
+            seconds, except for those steps that have their own interval in
+            `step_intervals` (a dict mapping step names to seconds).
+        """
+        by_interval = {}
+        for name in collector.collector_steps():
+            step_interval = (step_intervals or {}).get(name, interval)
+            by_interval.setdefault(step_interval, []).append(name)
+        for step_interval, steps in sorted(by_interval.items()):
+            self.jobs.append(Job(collector, steps, step_interval))
+
+    def run(self):
+        """ Runs the jobs until stop() is called. Returns after all running
+            jobs have finished.
+        """
+        try:
+            now = clock()
+            for job in self.jobs:
+                job.next_run = now
+            while not self.__stopped.is_set():
+                self.__wakeup.clear()
+                now = clock()
+                due = {}
+                for job in self.jobs:
+                    if job.next_run <= now:
+                        due.setdefault(job.collector, []).append(job)
+                for collector, jobs in due.items():
+                    if not self.__start(collector, jobs):
+                        continue # still pending, retried when the collector is free
+                    for job in jobs:
+                        # schedule the next tick, skipping all ticks that have
+                        # been missed in the meantime
+                        missed = int((now - job.next_run) // job.interval)
+                        job.next_run += (missed + 1) * job.interval
+                # wait for the next tick, or for a busy collector to finish
+                waiting = [ job.next_run for job in self.jobs if job.next_run > now ]
+                timeout = max(0, min(waiting) - clock()) if waiting else None
+                self.__wakeup.wait(timeout)
+        finally:
+            with self.__lock:
+                threads = list(self.__threads)
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """ Asks run() to return. May be called from any thread or from a
+            signal handler.
+        """
+        self.__stopped.set()
+        self.__wakeup.set()
+
+    def __start(self, collector, jobs):
+        """ Starts one run with the steps of all the given jobs, unless the
+            collector is busy. Returns whether the run was started.
+        """
+        steps = sorted(set(step for job in jobs for step in job.steps))
+        description = ", ".join(str(job) for job in jobs)
+        with self.__lock:
+            if collector in self.__busy:
+                log.debug("delaying run of {}: previous run still in progress".format(description))
+                return False
+            self.__busy.add(collector)
+            thread = threading.Thread(target=self.__run_job, args=(collector, steps, description))
+            self.__threads.append(thread)
+        thread.start()
+        return True
+
+    def __run_job(self, collector, steps, description):
+        try:
+            collector.run(self.statsd, steps)
+        except:
+            log.exception("run of {} failed".format(description))
+        finally:
+            with self.__lock:
+                self.__busy.discard(collector)
+                self.__threads.remove(threading.current_thread())
+            self.__wakeup.set()
@@ -14,13 +14,27 @@
 
 import json
 import logging
+import os
+import threading
+import time
 
-from swift_health_statsd.ipc import check_output
 from swift_health_statsd.collector import Collector
 
 log = logging.getLogger(__name__)
 
 class SwiftDispersionCollector(Collector):
+    """ Reports the result of `swift-dispersion-report`. Since that report is
+        very expensive, its result can be cached in a file (if
+        config.dispersion_cache_path is set). Runs within the cache TTL only
+        send the cached result. When the cache is stale, the cached result is
+        sent as well, and the report is refreshed in the background for one of
+        the next runs.
+    """
+
+    def __init__(self, config):
+        super(SwiftDispersionCollector, self).__init__(config)
+        self.__refresh_thread = None
+        self.__refresh_lock = threading.Lock()
 
     def metric_name_prefix(self):
         return "swift_dispersion"
@@ -31,19 +45,97 @@ class SwiftDispersionCollector(Collector):
     def collector_steps(self):
         return { "dispersion": self.__collect }
 
-    def __collect(self):
+    def close(self):
+        # do not exit while the cache file is being refreshed
+        with self.__refresh_lock:
+            thread = self.__refresh_thread
+        if thread is not None:
+            thread.join()
+
+    def dispersion_report(self):
+        """ Runs `swift-dispersion-report` and returns its parsed result. """
         cmd = " ".join((self.config.dispersion_report_path, '-j'))
-        out = check_output(cmd, timeout=30)
 
         # swift-dispersion-report on Liberty prints an initial line "Using
-        # storage policy: default", so look for the first line that contains
-        # the actual JSON
-        while "\n" in out and not out.lstrip().startswith('{'):
-            # remove first line
-            out = out.split("\n", 1).pop()
+        # storage policy: default", so skip everything before the first line
+        # that contains the actual JSON
+        json_lines = []
+        for line in self.iter_command_lines(cmd, timeout=self.config.dispersion_timeout):
+            if json_lines or line.lstrip().startswith('{'):
+                json_lines.append(line)
+
+        try:
+            data = json.loads("\n".join(json_lines))
+        except ValueError:
+            self.record("parse_failures")
+            raise
+        self.record("lines_parsed", len(json_lines))
+        return data
+
+    def read_cache(self):
+        """ Returns the cached (timestamp, data), or (None, None) if there is
+            no usable cache file.
+        """
+        try:
+            with open(self.config.dispersion_cache_path) as f:
+                cache = json.load(f)
+            return float(cache["timestamp"]), cache["data"]
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            if os.path.exists(self.config.dispersion_cache_path):
+                log.warning("ignoring unreadable dispersion cache file: {}".format(e))
+            return None, None
+
+    def write_cache(self, timestamp, data):
+        # write into a temporary file first, so that concurrent readers never
+        # see a partial file
+        path = self.config.dispersion_cache_path
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({ "timestamp": timestamp, "data": data }, f)
+        os.rename(tmp_path, path)
+
+    def refresh_cache(self):
+        """ Runs the report and stores its result in the cache file. """
+        timestamp = time.time()
+        data = self.dispersion_report()
+        self.write_cache(timestamp, data)
+        return timestamp, data
+
+    def __refresh_in_background(self):
+        with self.__refresh_lock:
+            if self.__refresh_thread is not None:
+                return
+            self.__refresh_thread = threading.Thread(target=self.__refresh_worker)
+            self.__refresh_thread.start()
+
+    def __refresh_worker(self):
+        try:
+            self.refresh_cache()
+        except:
+            log.exception("refreshing the dispersion cache failed")
+        finally:
+            with self.__refresh_lock:
+                self.__refresh_thread = None
+
+    def __collect(self):
+        # these are cluster-wide metrics only
+        if not self.is_designated_shard():
+            return
+        if not self.config.dispersion_cache_path:
+            self.__submit(self.dispersion_report())
+            return
+
+        timestamp, data = self.read_cache()
+        if data is None:
+            # nothing to send yet, so wait for the report this time
+            timestamp, data = self.refresh_cache()
+        elif time.time() - timestamp >= self.config.dispersion_cache_ttl:
+            self.__refresh_in_background()
 
-        data = json.loads(out)
+        self.__submit(data)
+        self.submit('result_age', max(0, time.time() - timestamp))
 
+    def __submit(self, data):
         for server in ['object', 'container']:
             counts   = data.get(server, {})
             expected = counts.get('copies_expected')
@@ -54,7 +146,12 @@ class SwiftDispersionCollector(Collector):
             else:
                 missing = expected - found
 
-            self.submit(server + '_copies_expected', expected)
-            self.submit(server + '_copies_found',    found)
-            self.submit(server + '_copies_missing',  missing)
-            self.submit(server + '_overlapping', counts.get('overlapping'))
+            labels = {'server_type': server}
+            self.submit(server + '_copies_expected', expected,
+                        series=('copies_expected', labels))
+            self.submit(server + '_copies_found', found,
+                        series=('copies_found', labels))
+            self.submit(server + '_copies_missing', missing,
+                        series=('copies_missing', labels))
+            self.submit(server + '_overlapping', counts.get('overlapping'),
+                        series=('overlapping', labels))
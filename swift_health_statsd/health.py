@@ -0,0 +1,124 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import math
+import threading
+
+from swift_health_statsd.ipc import clock
+
+log = logging.getLogger(__name__)
+
+def percentile(values, p):
+    """ Returns the p-th percentile of the given values (nearest-rank). """
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+class LatencyTracker(object):
+    """ Remembers the last `window` durations of each kind of operation (e.g.
+        each swift-recon command line), and derives timeouts from them: a
+        generous multiple of the 90th percentile, but never more than the
+        configured maximum. Operations that timed out are recorded with
+        their timeout, so that the timeout grows again if the operation
+        became slower.
+    """
+
+    def __init__(self, window=20, factor=3.0, minimum=1.0):
+        self.window = window
+        self.factor = factor
+        self.minimum = minimum
+        self.__durations = {}
+        self.__lock = threading.Lock()
+
+    def record(self, key, duration):
+        with self.__lock:
+            durations = self.__durations.get(key)
+            if durations is None:
+                durations = self.__durations[key] = collections.deque(maxlen=self.window)
+            durations.append(duration)
+
+    def timeout(self, key, maximum):
+        """ Returns the timeout for the given kind of operation. Without any
+            observations, this is `maximum`.
+        """
+        with self.__lock:
+            durations = list(self.__durations.get(key) or [])
+        if not durations:
+            return maximum
+        return min(maximum, max(self.minimum, self.factor * percentile(durations, 90)))
+
+class HostHealth(object):
+    """ A circuit breaker for each storage node. A node that failed or
+        answered slowly is skipped for `cooloff` seconds. After that, it is
+        probed once with a short timeout: if it answers in time, it is used
+        normally again, otherwise it is skipped for twice as long as before
+        (up to 8 times `cooloff`).
+    """
+
+    OK, PROBE, SKIP = "ok", "probe", "skip"
+
+    def __init__(self, cooloff=300, probe_timeout=1.0):
+        self.cooloff = cooloff
+        self.probe_timeout = probe_timeout
+        self.latencies = LatencyTracker(minimum=0.5)
+        self.__hosts = {} # host -> (open_until, current cooloff), for hosts that had problems
+        self.__probing = set()
+        self.__lock = threading.Lock()
+
+    def check(self, host):
+        """ Returns whether the host shall be queried normally (OK), probed
+            with a short timeout (PROBE) or skipped (SKIP).
+        """
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state is None:
+                return self.OK
+            open_until, _ = state
+            # only one request at a time probes the host
+            if clock() < open_until or host in self.__probing:
+                return self.SKIP
+            self.__probing.add(host)
+            return self.PROBE
+
+    def timeout(self, host, maximum):
+        """ Returns the timeout for a normal request to the host. """
+        return self.latencies.timeout(host, maximum)
+
+    def record_success(self, host, latency, slow=False):
+        """ Records that the host answered after `latency` seconds. If the
+            answer was `slow`, the host is treated as if it had failed.
+        """
+        self.latencies.record(host, latency)
+        if slow:
+            self.record_failure(host)
+            return
+        with self.__lock:
+            self.__probing.discard(host)
+            if self.__hosts.pop(host, None) is not None:
+                log.info("storage node {} is healthy again".format(host))
+
+    def record_failure(self, host):
+        with self.__lock:
+            self.__probing.discard(host)
+            _, cooloff = self.__hosts.get(host, (None, None))
+            cooloff = self.cooloff if cooloff is None else min(2 * cooloff, 8 * self.cooloff)
+            self.__hosts[host] = (clock() + cooloff, cooloff)
+        log.warning("skipping storage node {} for {} seconds".format(host, cooloff))
+
+    def unhealthy_hosts(self):
+        """ Returns the hosts that are currently skipped or probed. """
+        with self.__lock:
+            return sorted(self.__hosts)
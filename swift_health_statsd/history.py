@@ -0,0 +1,214 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# file format: header, then one record per series (see History.save())
+FILE_MAGIC = b"SHHS"
+FILE_HEADER = struct.Struct("!4sII")  # magic, capacity, number of series
+RECORD_KEY = struct.Struct("!H")      # length of key, followed by the key itself
+RECORD_HEADER = struct.Struct("!II")  # head, count, followed by 2*capacity doubles
+
+class Series(object):
+    """ The last `capacity` samples of one metric, as (timestamp, value), in
+        two fixed-size arrays that are used as ring buffers.
+    """
+    __slots__ = ("times", "values", "head", "count")
+
+    def __init__(self, capacity):
+        self.times = array.array("d", [0.0]) * capacity
+        self.values = array.array("d", [0.0]) * capacity
+        self.head = 0   # where the next sample goes
+        self.count = 0
+
+    def add(self, timestamp, value):
+        capacity = len(self.times)
+        if self.count > 0:
+            last = (self.head - 1) % capacity
+            # a sample for the same point in time replaces the previous one
+            if timestamp <= self.times[last]:
+                self.times[last], self.values[last] = timestamp, value
+                return
+        self.times[self.head], self.values[self.head] = timestamp, value
+        self.head = (self.head + 1) % capacity
+        self.count = min(self.count + 1, capacity)
+
+    def samples(self):
+        """ Returns the samples as a list of (timestamp, value), oldest first. """
+        capacity = len(self.times)
+        start = (self.head - self.count) % capacity
+        indexes = [ (start + idx) % capacity for idx in range(self.count) ]
+        return [ (self.times[idx], self.values[idx]) for idx in indexes ]
+
+    def last(self):
+        if self.count == 0:
+            return None
+        return self.values[(self.head - 1) % len(self.times)]
+
+    def slope(self):
+        """ Returns the change per second according to a least-squares linear
+            fit through all samples, or None if there are not enough samples.
+        """
+        samples = self.samples()
+        if len(samples) < 2:
+            return None
+        # shift times to the first sample to keep the sums small
+        t0 = samples[0][0]
+        n = float(len(samples))
+        mean_t = sum(t - t0 for t, _ in samples) / n
+        mean_v = sum(v for _, v in samples) / n
+        var_t = sum((t - t0 - mean_t) ** 2 for t, _ in samples)
+        if var_t == 0:
+            return None
+        cov = sum((t - t0 - mean_t) * (v - mean_v) for t, v in samples)
+        return cov / var_t
+
+    def time_to_reach(self, limit):
+        """ Returns in how many seconds the value is expected to grow to
+            `limit` (from the last sample, if the current trend continues), or
+            None if it is not growing.
+        """
+        last = self.last()
+        if last is not None and last >= limit:
+            return 0.0
+        slope = self.slope()
+        if slope is None or slope <= 0:
+            return None
+        return (limit - last) / slope
+
+class History(object):
+    """ Keeps the last `capacity` values of each metric across collector
+        runs, so that rates and trends can be derived from them. Each series
+        takes a fixed amount of memory. If `path` is given, the history can
+        be saved to and loaded from that file between runs.
+    """
+
+    def __init__(self, capacity=12, path=None, max_age=7*86400):
+        self.capacity = max(2, int(capacity))
+        self.path = path
+        self.max_age = max_age # series without new samples for this long are dropped when saving
+        self.__series = {}
+        self.__lock = threading.Lock()
+
+    def add(self, key, timestamp, value):
+        """ Adds a sample to the given series, and returns the Series. """
+        with self.__lock:
+            series = self.__series.get(key)
+            if series is None:
+                series = self.__series[key] = Series(self.capacity)
+            series.add(timestamp, value)
+            return series
+
+    def get(self, key):
+        with self.__lock:
+            return self.__series.get(key)
+
+    def __len__(self):
+        return len(self.__series)
+
+    def load(self):
+        """ Loads the history from self.path, if that file exists. A file
+            that cannot be read is ignored (with a warning).
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            series = self.__read(self.path)
+        except (IOError, OSError, ValueError, struct.error) as e:
+            log.warning("ignoring unreadable history file {}: {}".format(self.path, e))
+            return
+        with self.__lock:
+            self.__series.update(series)
+
+    def __read(self, path):
+        result = {}
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < FILE_HEADER.size:
+                raise ValueError("file is truncated")
+            buf = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                magic, capacity, count = FILE_HEADER.unpack_from(buf, 0)
+                if magic != FILE_MAGIC:
+                    raise ValueError("not a history file")
+                offset = FILE_HEADER.size
+                samples = struct.Struct("!{}d".format(2 * capacity))
+                for _ in range(count):
+                    key_len, = RECORD_KEY.unpack_from(buf, offset)
+                    offset += RECORD_KEY.size
+                    key = buf[offset:offset+key_len].decode("utf-8")
+                    offset += key_len
+                    head, num = RECORD_HEADER.unpack_from(buf, offset)
+                    offset += RECORD_HEADER.size
+                    values = samples.unpack_from(buf, offset)
+                    offset += samples.size
+
+                    # copy the samples in order, so that the capacity of the
+                    # file does not need to match ours
+                    series = Series(self.capacity)
+                    for idx in range(num):
+                        pos = (head - num + idx) % capacity
+                        series.add(values[pos], values[capacity + pos])
+                    result[key] = series
+            finally:
+                buf.close()
+        return result
+
+    def save(self):
+        """ Writes the history into self.path (through a temporary file, so
+            that the file is replaced atomically).
+        """
+        if not self.path:
+            return
+        now = time.time()
+        with self.__lock:
+            for key, series in list(self.__series.items()):
+                if series.count == 0 or \
+                        series.times[(series.head - 1) % self.capacity] < now - self.max_age:
+                    del self.__series[key]
+            records = [ (key.encode("utf-8"), series) for key, series in sorted(self.__series.items()) ]
+
+            samples = struct.Struct("!{}d".format(2 * self.capacity))
+            size = FILE_HEADER.size + sum(
+                RECORD_KEY.size + len(key) + RECORD_HEADER.size + samples.size
+                for key, _ in records)
+
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "w+b") as f:
+                f.truncate(size)
+                buf = mmap.mmap(f.fileno(), size)
+                try:
+                    FILE_HEADER.pack_into(buf, 0, FILE_MAGIC, self.capacity, len(records))
+                    offset = FILE_HEADER.size
+                    for key, series in records:
+                        RECORD_KEY.pack_into(buf, offset, len(key))
+                        offset += RECORD_KEY.size
+                        buf[offset:offset+len(key)] = key
+                        offset += len(key)
+                        RECORD_HEADER.pack_into(buf, offset, series.head, series.count)
+                        offset += RECORD_HEADER.size
+                        samples.pack_into(buf, offset, *(series.times + series.values))
+                        offset += samples.size
+                    buf.flush()
+                finally:
+                    buf.close()
+            os.rename(tmp_path, self.path)
@@ -12,7 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess, threading
+import codecs, errno, os, select, signal, subprocess, sys, threading, time
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+try:
+    import selectors
+except ImportError: # Python 2
+    selectors = None
+
+# a clock that is not affected by changes to the system time
+clock = getattr(time, "monotonic", time.time)
+
+if sys.version_info[0] >= 3:
+    NEW_PROCESS_GROUP = { "start_new_session": True }
+else:
+    NEW_PROCESS_GROUP = { "preexec_fn": os.setsid }
 
 class Timeout(Exception):
     def __init__(self, command, timeout):
@@ -21,35 +39,331 @@ class Timeout(Exception):
     def __str__(self):
         return "Command '{}' aborted after {} seconds".format(self.command, self.timeout)
 
-class CheckOutputHelper(object):
-    def run(self, command, timeout=None):
-        self.process = None
-        self.output = ""
-
-        def worker():
-            self.process = subprocess.Popen(command,
-                stdout=subprocess.PIPE,
-                stderr=None,
-                shell=True,
-                universal_newlines=True,
-            )
-            self.output, _ = self.process.communicate()
-
-        thread = threading.Thread(target=worker)
-        thread.start()
-
-        thread.join(timeout)
-        if thread.is_alive():
-            self.process.terminate()
-            thread.join()
-
-        ret = self.process.returncode
-        if ret == 0:
-            return self.output
-        elif ret == -15: # SIGTERM
-            raise Timeout(command, timeout)
-        else:
-            raise subprocess.CalledProcessError(ret, command, self.output)
+class Result(object):
+    """ Describes how a command run by ProcessRunner ended. """
+
+    def __init__(self, command, timeout, returncode, duration, timed_out, cancelled):
+        self.command = command
+        self.timeout = timeout
+        self.returncode = returncode  # negative signal number if killed by a signal
+        self.duration = duration      # seconds from start until the process was reaped
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    def check(self):
+        """ Raises Timeout or CalledProcessError if the command did not
+            succeed.
+        """
+        if self.timed_out:
+            raise Timeout(self.command, self.timeout)
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.command, "")
+
+class _SelectSelector(object):
+    """ Minimal stand-in for selectors.DefaultSelector on Python 2 (only for
+        watching file descriptors for reading).
+    """
+    def __init__(self):
+        self.fds = {}
+    def register(self, fd, events, data=None):
+        self.fds[fd] = data
+    def unregister(self, fd):
+        del self.fds[fd]
+    def select(self, timeout=None):
+        readable, _, _ = select.select(list(self.fds), [], [], timeout)
+        return [ (_Key(fd, self.fds[fd]), None) for fd in readable ]
+
+class _Key(object):
+    def __init__(self, fd, data):
+        self.fd = fd
+        self.data = data
+
+class Process(object):
+    """ A command supervised by ProcessRunner. Its output lines (including
+        the trailing newline) can be read from lines() while it is running.
+        If the supervisor fails, lines() and wait() raise its error.
+    """
+
+    def __init__(self, runner, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.popen = None
+        self.start_time = None
+        self.deadline = None      # when to send SIGTERM
+        self.kill_deadline = None # when to send SIGKILL
+        self.timed_out = False
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.paused = False       # whether the runner stopped reading the output
+        self.__runner = runner
+        self.__queue = queue.Queue()
+        self.__done = threading.Event()
+        self.__decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.__partial = ""
+
+    def lines(self):
+        """ Yields the lines that the command writes to its standard output
+            until it closes it.
+        """
+        while True:
+            try:
+                line = self.__queue.get_nowait()
+            except queue.Empty:
+                # the runner only pauses while lines are waiting, so when
+                # there are none, it has to be resumed now
+                if self.paused:
+                    self.__runner.resume(self)
+                line = self.__queue.get()
+            if line is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            if self.paused:
+                self.__runner.resume(self)
+            yield line
+
+    def cancel(self):
+        """ Terminates the command (if it is still running). """
+        self.__runner.cancel(self)
+
+    def wait(self):
+        """ Waits for the command to exit, and returns its Result. """
+        self.__done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def finish(self):
+        """ Terminates the command if it is still running, and returns its
+            Result once it has exited.
+        """
+        if not self.__done.is_set():
+            self.cancel()
+        return self.wait()
+
+    def buffered(self):
+        """ Returns how many output lines are waiting to be read. """
+        return self.__queue.qsize()
+
+    ############################################################################
+    # called by the ProcessRunner thread
+
+    def feed(self, data):
+        text = self.__partial + self.__decoder.decode(data, final=not data)
+        lines = text.split("\n")
+        self.__partial = lines.pop()
+        for line in lines:
+            self.__queue.put(line + "\n")
+        if not data and self.__partial:
+            self.__queue.put(self.__partial)
+            self.__partial = ""
+
+    def complete(self, result):
+        self.result = result
+        self.__queue.put(None)
+        self.__done.set()
+
+    def fail(self, error):
+        self.error = error
+        self.__queue.put(None)
+        self.__done.set()
+
+class ProcessRunner(object):
+    """ Runs shell commands and supervises all of them from one thread: their
+        output is read with a selector, and each command is terminated when
+        its timeout expires. Each command runs in its own process group, so
+        that termination also reaches the commands that it spawned (e.g.
+        `kubectl exec` in a wrapper script). Processes that do not exit
+        within `kill_grace` seconds after SIGTERM are killed with SIGKILL.
+
+        The supervisor thread only runs while there are commands to watch.
+
+        When `max_buffered_lines` output lines of a command are waiting to be
+        read, its output is not read any further until the reader has caught
+        up (to half of that), so that a command that writes faster than its
+        output is consumed blocks instead of filling up the memory.
+    """
+
+    def __init__(self, kill_grace=5, max_buffered_lines=10000):
+        self.kill_grace = kill_grace
+        self.max_buffered_lines = max_buffered_lines
+        self.__processes = {}  # by stdout fd
+        self.__exited = []     # processes that closed stdout, but were not reaped yet
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__wakeup_r, self.__wakeup_w = os.pipe()
+        self.__selector = selectors.DefaultSelector() if selectors else _SelectSelector()
+        self.__selector.register(self.__wakeup_r, 1) # 1 == EVENT_READ
+
+    def start(self, command, timeout=None):
+        """ Starts the given shell command and returns a Process. If a timeout
+            (in seconds) is given, the command's process group is terminated
+            after the timeout.
+        """
+        process = Process(self, command, timeout)
+        process.popen = subprocess.Popen(command,
+            stdout=subprocess.PIPE,
+            stderr=None,
+            shell=True,
+            close_fds=True,
+            **NEW_PROCESS_GROUP
+        )
+        process.start_time = clock()
+        if timeout is not None:
+            process.deadline = process.start_time + timeout
+        fd = process.popen.stdout.fileno()
+        with self.__lock:
+            self.__processes[fd] = process
+            self.__selector.register(fd, 1, process)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__supervise)
+                self.__thread.daemon = True
+                self.__thread.start()
+        self.__wakeup()
+        return process
+
+    def cancel(self, process):
+        with self.__lock:
+            if process.result is not None or process.cancelled:
+                return
+            process.cancelled = True
+            process.deadline = clock()
+            # the output may not be read anymore, but the pipe must be drained
+            # until the command has exited
+            self.__resume(process)
+        self.__wakeup()
+
+    def resume(self, process):
+        """ Called by Process.lines() to continue reading the output of a
+            paused process once enough of it has been consumed.
+        """
+        with self.__lock:
+            if process.buffered() > self.max_buffered_lines // 2:
+                return
+            self.__resume(process)
+        self.__wakeup()
+
+    def __resume(self, process):
+        # must be called with self.__lock held
+        if not process.paused:
+            return
+        process.paused = False
+        fd = process.popen.stdout.fileno()
+        if fd in self.__processes:
+            self.__selector.register(fd, 1, process)
+
+    def __wakeup(self):
+        os.write(self.__wakeup_w, b"x")
+
+    def __signal(self, process, signum):
+        try:
+            os.killpg(process.popen.pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def __supervise(self):
+        try:
+            self.__supervise_loop()
+        except Exception as e:
+            # pass the error to everyone who waits for a command, and give up
+            # on the commands (the next start() starts a new thread)
+            with self.__lock:
+                processes = list(self.__processes.values()) + self.__exited
+                for fd, process in list(self.__processes.items()):
+                    if not process.paused:
+                        self.__selector.unregister(fd)
+                self.__processes.clear()
+                del self.__exited[:]
+                self.__thread = None
+            for process in processes:
+                self.__signal(process, signal.SIGKILL)
+                process.popen.stdout.close()
+                process.fail(e)
+
+    def __supervise_loop(self):
+        while True:
+            with self.__lock:
+                processes = list(self.__processes.values()) + self.__exited
+                if not processes:
+                    self.__thread = None
+                    return
+
+            # enforce deadlines
+            now = clock()
+            timeout = None
+            for process in processes:
+                if process.kill_deadline is not None:
+                    if now >= process.kill_deadline:
+                        self.__signal(process, signal.SIGKILL)
+                        process.kill_deadline = None
+                    else:
+                        timeout = min(timeout, process.kill_deadline - now) if timeout is not None \
+                            else process.kill_deadline - now
+                elif process.deadline is not None:
+                    if now >= process.deadline:
+                        if not process.cancelled:
+                            process.timed_out = True
+                        self.__signal(process, signal.SIGTERM)
+                        process.deadline = None
+                        process.kill_deadline = now + self.kill_grace
+                        timeout = 0
+                    else:
+                        timeout = min(timeout, process.deadline - now) if timeout is not None \
+                            else process.deadline - now
+            with self.__lock:
+                if self.__exited:
+                    # poll for exit status of processes that closed stdout
+                    timeout = 0.01 if timeout is None else min(timeout, 0.01)
+
+            for key, _ in self.__selector.select(timeout):
+                if key.fd == self.__wakeup_r:
+                    os.read(self.__wakeup_r, 4096)
+                    continue
+                process = key.data
+                data = os.read(key.fd, 65536)
+                process.feed(data)
+                if data:
+                    # stop reading while too much output is waiting (the
+                    # reader calls resume() once it has caught up)
+                    with self.__lock:
+                        if not process.cancelled and process.buffered() >= self.max_buffered_lines:
+                            self.__selector.unregister(key.fd)
+                            process.paused = True
+                else:
+                    with self.__lock:
+                        self.__selector.unregister(key.fd)
+                        del self.__processes[key.fd]
+                        process.popen.stdout.close()
+                        self.__exited.append(process)
+
+            with self.__lock:
+                exited = list(self.__exited)
+            for process in exited:
+                if process.popen.poll() is None:
+                    continue
+                with self.__lock:
+                    self.__exited.remove(process)
+                process.complete(Result(
+                    command    = process.command,
+                    timeout    = process.timeout,
+                    returncode = process.popen.returncode,
+                    duration   = clock() - process.start_time,
+                    timed_out  = process.timed_out,
+                    cancelled  = process.cancelled,
+                ))
+
+_default_runner = None
+_default_runner_lock = threading.Lock()
+
+def default_runner():
+    """ Returns the ProcessRunner shared by check_output() and iter_lines(). """
+    global _default_runner
+    with _default_runner_lock:
+        if _default_runner is None:
+            _default_runner = ProcessRunner()
+        return _default_runner
 
 def check_output(command, timeout=None):
     """
@@ -57,7 +371,34 @@ def check_output(command, timeout=None):
 
         >>> subprocess.check_output(command, shell=True, universal_newlines=True)
 
-        But if a timeout (in seconds) is given, SIGTERM is sent to the process
-        after the timeout.
+        But if a timeout (in seconds) is given, the command (including all
+        processes that it started) is terminated after the timeout, and
+        Timeout is raised.
+    """
+    process = default_runner().start(command, timeout)
+    output = "".join(process.lines())
+    result = process.wait()
+    if result.returncode != 0 and not result.timed_out:
+        raise subprocess.CalledProcessError(result.returncode, command, output)
+    result.check()
+    return output
+
+def iter_lines(command, timeout=None):
+    """
+        Like check_output(), but yields the lines of the command's standard
+        output (without the trailing newline) as soon as the command writes
+        them, instead of buffering the whole output.
+
+        If a timeout (in seconds) is given, the command is terminated after
+        the timeout, and Timeout is raised once the remaining output has been
+        consumed. If the command fails, CalledProcessError is raised after the
+        last line (its output attribute is empty since nothing was buffered).
+        If the caller stops iterating early, the command is terminated.
     """
-    return CheckOutputHelper().run(command, timeout)
+    process = default_runner().start(command, timeout)
+    try:
+        for line in process.lines():
+            yield line.rstrip("\n")
+    finally:
+        result = process.finish()
+    result.check()
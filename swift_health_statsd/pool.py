@@ -0,0 +1,79 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import threading
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+if sys.version_info[0] >= 3:
+    def reraise(exc_info):
+        """ Re-raises an exception from sys.exc_info() with its traceback. """
+        raise exc_info[1].with_traceback(exc_info[2])
+else:
+    # this is a syntax error on Python 3, so hide it from the parser there
+    exec("def reraise(exc_info):\n"
+         "    raise exc_info[0], exc_info[1], exc_info[2]\n")
+
+class WorkerPool(object):
+    """ A bounded pool of worker threads. Each call to map() runs at most
+        `max_workers` tasks at the same time.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, int(max_workers))
+
+    def map(self, func, items):
+        """ Calls func(item) for each item and returns the list of results in
+            the same order as `items`. If any call raised an exception, the
+            first such exception is re-raised (with its original traceback)
+            once all calls have finished.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+
+        # with one item (or one worker), there is nothing to parallelize
+        if len(items) <= 1 or self.max_workers == 1:
+            return [ func(item) for item in items ]
+
+        pending = queue.Queue()
+        for idx, item in enumerate(items):
+            pending.put((idx, item))
+
+        def worker():
+            while True:
+                try:
+                    idx, item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[idx] = func(item)
+                except:
+                    errors.append(sys.exc_info())
+
+        threads = [ threading.Thread(target=worker)
+                    for _ in range(min(self.max_workers, len(items))) ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            reraise(errors[0])
+        return results
@@ -0,0 +1,119 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cProfile
+import errno
+import logging
+import os
+import pstats
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+log = logging.getLogger(__name__)
+
+class Profiler(object):
+    """ Profiles collector steps with cProfile and (where available)
+        tracemalloc. For each profiled step, a pstats dump (`.prof`) and a text
+        report with the top `top` functions by own time and the top `top`
+        allocation sites (`.txt`) are written into `directory`.
+
+        Only every `every`-th run of each collector is profiled. Since
+        tracemalloc cannot tell the allocations of concurrent steps apart,
+        profiled steps never run at the same time.
+    """
+
+    def __init__(self, directory, every=1, top=25):
+        self.directory = directory
+        self.every = max(1, int(every))
+        self.top = top
+        self.__cycles = {}
+        self.__cycles_lock = threading.Lock()
+        self.__lock = threading.Lock()
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def start_cycle(self, collector_name):
+        """ Call this at the start of each run of a collector. Returns whether
+            the steps of this run shall be profiled.
+        """
+        with self.__cycles_lock:
+            count = self.__cycles.get(collector_name, 0)
+            self.__cycles[collector_name] = count + 1
+        return count % self.every == 0
+
+    def run(self, collector_name, step_name, func):
+        """ Calls func() while profiling it, and writes the reports. Returns
+            what func() returns.
+        """
+        with self.__lock:
+            profile = cProfile.Profile()
+            if tracemalloc is not None:
+                tracemalloc.start()
+            start = time.time()
+            try:
+                return profile.runcall(func)
+            finally:
+                snapshot = peak = None
+                if tracemalloc is not None:
+                    snapshot = tracemalloc.take_snapshot()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                self.__write(collector_name, step_name, start, profile, snapshot, peak)
+
+    def __write(self, collector_name, step_name, start, profile, snapshot, peak):
+        with self.__cycles_lock:
+            cycle = self.__cycles.get(collector_name, 1) - 1
+        basename = os.path.join(self.directory, "{}.{}.run{}.{}".format(
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime(start)), collector_name, cycle, step_name))
+        try:
+            profile.dump_stats(basename + ".prof")
+            with open(basename + ".txt", "w") as f:
+                f.write(self.report(profile, snapshot, peak))
+        except (IOError, OSError) as e:
+            log.warning("cannot write profile for step \"{}\": {}".format(step_name, e))
+            return
+        log.info("wrote profile for step \"{}\" to {}.prof".format(step_name, basename))
+
+    def report(self, profile, snapshot=None, peak=None):
+        """ Returns the text report for one step. """
+        out = StringIO()
+        out.write("# top {} functions by own time\n\n".format(self.top))
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats("tottime").print_stats(self.top)
+
+        out.write("\n# top {} allocation sites\n\n".format(self.top))
+        if snapshot is None:
+            out.write("(tracemalloc is not available)\n")
+            return out.getvalue()
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        out.write("peak traced memory: {} bytes\n".format(peak))
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            out.write("{}\n".format(stat))
+        return out.getvalue()
@@ -0,0 +1,128 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import re
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError: # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRIC_NAME_INVALID_RX = re.compile(r"[^a-zA-Z0-9_:]")
+
+def metric_name(name):
+    """ Turns a statsd-style metric name into a valid Prometheus metric name. """
+    name = METRIC_NAME_INVALID_RX.sub("_", name)
+    if name[:1].isdigit():
+        name = "_" + name
+    return name
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_value(value):
+    if isinstance(value, bool):
+        value = int(value)
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsSnapshot(object):
+    """ Holds the last complete set of values from each collector step, and
+        the Prometheus text exposition of all of them. The text is rendered
+        once whenever a collector run publishes new values, so that scrapes
+        only need to copy a byte string, no matter how often they happen.
+    """
+
+    def __init__(self):
+        # samples[collector][step] = [(name, labels, value), ...]
+        self.__samples = {}
+        self.__rendered = b""
+        self.__lock = threading.Lock()
+
+    def update(self, collector, samples_by_step):
+        """ Replaces the samples of the given steps of the given collector
+            (identified by its metric name prefix). Samples are tuples of
+            (name, labels, value), where `labels` is a dict.
+        """
+        with self.__lock:
+            self.__samples.setdefault(collector, {}).update(samples_by_step)
+            rendered = self.__render()
+            self.__rendered = rendered
+
+    def render(self):
+        """ Returns the last rendered text exposition (as bytes). """
+        return self.__rendered
+
+    def __render(self):
+        families = {}
+        for steps in self.__samples.values():
+            for samples in steps.values():
+                for name, labels, value in samples:
+                    families.setdefault(metric_name(name), []).append((labels, value))
+
+        lines = []
+        for name in sorted(families):
+            lines.append("# TYPE {} gauge".format(name))
+            for labels, value in sorted(families[name], key=lambda s: sorted(s[0].items())):
+                label_str = ",".join("{}=\"{}\"".format(key, escape_label_value(labels[key]))
+                                     for key in sorted(labels))
+                if label_str:
+                    lines.append("{}{{{}}} {}".format(name, label_str, format_value(value)))
+                else:
+                    lines.append("{} {}".format(name, format_value(value)))
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+class PrometheusServer(object):
+    """ Serves the text exposition of a MetricsSnapshot on /metrics. """
+
+    def __init__(self, snapshot, address="", port=9520):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = snapshot.render()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                log.debug("scrape from {}: {}".format(self.client_address[0], format % args))
+
+        class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.httpd = ThreadingHTTPServer((address, port), Handler)
+        self.__thread = None
+
+    def start(self):
+        """ Starts serving in a background thread. """
+        self.__thread = threading.Thread(target=self.httpd.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def shutdown(self):
+        if self.__thread is not None:
+            self.httpd.shutdown()
+            self.__thread.join()
+        self.httpd.server_close()
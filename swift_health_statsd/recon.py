@@ -12,86 +12,534 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import ast
+import collections
+import functools
+import hashlib
 import logging
+import os
 import re
 import subprocess
+import threading
 import time
 
-from swift_health_statsd.ipc import check_output
 from swift_health_statsd.collector import Collector
+from swift_health_statsd.health import HostHealth, LatencyTracker
+from swift_health_statsd.reconhttp import ReconHTTPClient
+from swift_health_statsd.reprparse import parse_repr
+from swift_health_statsd.ring import DEFAULT_PORTS, RingIndexCache
+from swift_health_statsd.sampling import HostSampler
+from swift_health_statsd.stats import Distribution
 
 log = logging.getLogger(__name__)
 
+# maps swift-recon check flags to the recon API endpoints that they query
+RECON_ENDPOINTS = {
+    "async":          "async",
+    "auditor":        "auditor/{server_type}",
+    "diskusage":      "diskusage",
+    "driveaudit":     "driveaudit",
+    "expirer":        "expirer/{server_type}",
+    "loadstats":      "load",
+    "quarantined":    "quarantined",
+    "reconstruction": "reconstruction/{server_type}",
+    "replication":    "replication/{server_type}",
+    "sockstat":       "sockstat",
+    "unmounted":      "unmounted",
+    "updater":        "updater/{server_type}",
+}
+
+# maps the first part of recon API paths back to the checks (the inverse of
+# RECON_ENDPOINTS)
+ENDPOINT_CHECKS = { endpoint.split("/")[0]: check for check, endpoint in RECON_ENDPOINTS.items() }
+
+# in batched mode, these checks are run in one swift-recon call per server type
+BATCHED_CHECKS = {
+    "account":   ["auditor", "replication"],
+    "container": ["auditor", "replication", "updater"],
+    "object":    ["async", "auditor", "diskusage", "driveaudit", "expirer",
+                  "loadstats", "md5", "quarantined", "reconstruction",
+                  "replication", "sockstat", "unmounted", "updater"],
+}
+
+# checks that are fetched from all hosts (instead of only the hosts of this
+# shard) on the shard that reports the cluster-wide totals
+ALL_HOSTS_CHECKS = set(["diskusage"])
+
+# with ring rollups, these checks are also fetched from all hosts, since
+# their per-region and per-zone totals are cluster-wide metrics, too
+ROLLUP_CHECKS = set(["driveaudit", "replication"])
+
+# the banners that swift-recon prints when it starts a check
+RECON_BANNERS = [
+    (re.compile(r'Checking async pendings'),       "async"),
+    (re.compile(r'Checking auditor stats'),        "auditor"),
+    (re.compile(r'Checking on expirers'),          "expirer"),
+    (re.compile(r'Checking load averages'),        "loadstats"),
+    (re.compile(r'Checking on reconstructors'),    "reconstruction"),
+    (re.compile(r'Checking socket usage'),         "sockstat"),
+    (re.compile(r'Checking disk usage'),           "diskusage"),
+    (re.compile(r'Checking drive-audit errors'),   "driveaudit"),
+    (re.compile(r'Checking .* md5sum'),            "md5"),
+    (re.compile(r'Checking quarantine'),           "quarantined"),
+    (re.compile(r'Checking on replication'),       "replication"),
+    (re.compile(r'Getting unmounted drives'),      "unmounted"),
+    (re.compile(r'Checking updater times'),        "updater"),
+]
+
+RECON_URL_RX = re.compile(r'^-> https?://\S+?/recon/([a-z0-9_]+)')
+RECON_DATA_RX = re.compile(r'^-> https?://([a-zA-Z0-9-.]+)\S*\s(.*)')
+DEVICE_NAME_RX = re.compile(r"[^a-zA-Z0-9]+")
+HOST_NAME_RX = re.compile(r"[^a-zA-Z0-9-]+")
+MD5_BANNER_RX = re.compile(r'.* Checking ([\.a-zA-Z0-9_]+) md5sum')
+MD5_SUMMARY_RX = re.compile(r"(\d+)/(\d+) hosts matched, (\d+) error\[s\] "
+                            "while checking hosts")
+
+def split_recon_sections(lines):
+    """ Splits the output of a swift-recon call with multiple check flags into
+        one list of lines per check. Each check's section starts at its banner
+        line, and lines that contain a recon URL are assigned to the check
+        that queries this URL, regardless of where they appear.
+    """
+    sections = {}
+    check = None
+    for line in lines:
+        if line.startswith("====="):
+            check = None
+            continue
+        m = RECON_URL_RX.match(line)
+        if m:
+            endpoint = m.group(1)
+            if endpoint in ("ringmd5", "swiftconfmd5"):
+                check = "md5"
+            elif endpoint in ENDPOINT_CHECKS:
+                check = ENDPOINT_CHECKS[endpoint]
+        else:
+            for rx, banner_check in RECON_BANNERS:
+                if rx.search(line):
+                    check = banner_check
+                    break
+        if check is not None:
+            sections.setdefault(check, []).append(line)
+    return sections
+
+def md5_file(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
 class SwiftReconCollector(Collector):
 
+    def __init__(self, config):
+        super(SwiftReconCollector, self).__init__(config)
+        # how long each swift-recon command line took in the last runs
+        self.__latencies = LatencyTracker(minimum=5.0)
+        if config.recon_backend == "http":
+            self.__http = ReconHTTPClient(
+                timeout                  = config.recon_timeout,
+                max_workers              = config.recon_http_workers,
+                max_connections_per_host = config.recon_http_connections_per_host,
+                health                   = HostHealth(cooloff=config.recon_host_cooloff)
+                                           if config.recon_host_cooloff > 0 else None,
+            )
+        elif config.recon_backend == "subprocess":
+            self.__http = None
+        else:
+            raise ValueError("unknown recon backend: {}".format(config.recon_backend))
+        # one HostSampler per sampled endpoint (only for the HTTP backend)
+        self.__samplers = {}
+        # the storage nodes and their regions and zones, from the rings
+        self.__rings = RingIndexCache(config.swift_dir)
+
     def metric_name_prefix(self):
         return "swift_cluster"
 
     def logger(self):
         return log
 
-    def swift_recon(self, *params):
+    def prepare(self):
+        # results of recon queries and batched swift-recon calls (only valid
+        # for one cycle)
+        self.__once_results = {}
+        self.__once_lock = threading.Lock()
+
+    def __once(self, key, func):
+        """ Returns func(), but calls func only once per cycle for each key,
+            even if multiple steps ask for it concurrently. Exceptions are
+            remembered and raised for every caller.
+        """
+        with self.__once_lock:
+            if key not in self.__once_results:
+                self.__once_results[key] = (threading.Lock(), {})
+            lock, result = self.__once_results[key]
+
+        with lock:
+            if not result:
+                try:
+                    result["value"] = func()
+                except Exception as e:
+                    result["error"] = e
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def swift_recon_lines(self, *params, **kwargs):
+        """ Runs swift-recon with the given parameters, and yields its output
+            line by line while it is still running. The timeout adapts to how
+            long the same command took in previous runs, but never exceeds
+            the `timeout` argument (config.recon_command_timeout by default).
+        """
         cmd = " ".join((self.config.recon_path, " ".join(params)))
-        return check_output(cmd, timeout=30)
+        timeout = self.__latencies.timeout(cmd,
+            kwargs.get("timeout", self.config.recon_command_timeout))
+        def on_result(result):
+            if not result.cancelled:
+                self.__latencies.record(cmd, result.duration)
+        return self.iter_command_lines(cmd, timeout=timeout, on_result=on_result)
 
     def swift_recon_parse(self, *params):
         # call swift-recon in verbose mode
-        output = self.swift_recon("-v", *params)
+        lines = self.swift_recon_lines("-v", *params)
+        return self.parse_recon_lines(lines, params)
 
+    def parse_recon_lines(self, lines, params):
         # look for verbose output containing the raw data structures received
         # from the storage nodes
         result = {}
-        for line in output.splitlines():
-            m = re.match(r'^-> https?://([a-zA-Z0-9-.]+)\S*\s(.*)', line)
+        debug = log.isEnabledFor(logging.DEBUG)
+        for line in lines:
+            if not line.startswith("-> "):
+                continue
+            m = RECON_DATA_RX.match(line)
             if m:
-                log.debug("Output from swift-recon {0}: {1}".format(" ".join(params), line))
+                if debug:
+                    log.debug("Output from swift-recon {0}: {1}".format(" ".join(params), line))
                 hostname, data_str = m.group(1), m.group(2)
                 try:
-                    result[hostname] = ast.literal_eval(data_str)
+                    result[hostname] = parse_repr(data_str)
+                    self.record("lines_parsed")
                 except (ValueError, SyntaxError):
                     log.error("swift-recon {0} erroneous for node {1}: {2}".format(params, hostname, data_str))
+                    self.record("parse_failures")
                     continue
+        self.record("hosts", len(result))
         if not result:
             log.error("swift-recon {0} did not return any usable output!".format(params))
             return {}
         return result
 
+    def swift_recon_batch(self, server_type):
+        """ Runs all checks in BATCHED_CHECKS for the given server type in a
+            single `swift-recon -v` call and returns its output split up by
+            check. Each server type is only queried once per cycle, even if
+            multiple steps ask for it concurrently.
+        """
+        def run_batch():
+            checks = BATCHED_CHECKS[server_type]
+            params = ["-v", server_type] + [ "--" + c for c in checks ]
+            # one sweep per check, so allow as much time as the individual
+            # calls would have had together
+            lines = self.swift_recon_lines(*params,
+                timeout=self.config.recon_command_timeout * len(checks))
+            return split_recon_sections(lines)
+        return self.__once(("batch", server_type), run_batch)
+
+    def fetch(self, check, server_type=None):
+        """ Like recon_data(), but each query runs at most once per cycle, and
+            its result is shared by all steps that consume it. The disk usage
+            (and, with ring rollups, the data that is rolled up) is fetched
+            from all hosts on the shard that reports cluster-wide totals.
+        """
+        all_hosts_checks = ALL_HOSTS_CHECKS
+        if self.config.ring_rollups:
+            all_hosts_checks = all_hosts_checks | ROLLUP_CHECKS
+        all_hosts = check in all_hosts_checks and self.is_designated_shard()
+        return self.__once(("fetch", check, server_type),
+            lambda: self.recon_data(check, server_type, all_hosts))
+
+    def close(self):
+        if self.__http is not None:
+            self.__http.close()
+
+    def recon_hosts(self, server_type, all_hosts=False):
+        """ Returns the list of (host, port) to query with the HTTP backend,
+            either from the configured host list or from the ring index.
+            Configured hosts without an explicit port are queried on the
+            default port of the given server type. With sharding, only the
+            hosts of this shard are returned, unless `all_hosts` is given.
+        """
+        if self.config.recon_hosts:
+            hosts = [ (host, port or DEFAULT_PORTS[server_type])
+                      for host, port in self.config.recon_hosts ]
+        else:
+            hosts = self.__rings.get().hosts(server_type)
+        if all_hosts:
+            return hosts
+        return [ (host, port) for host, port in hosts if self.owns_host(host) ]
+
+    def recon_data(self, check, server_type=None, all_hosts=False):
+        """ Returns a dict mapping hostnames to the data structure that their
+            recon API returned for the given check (e.g. "diskusage"), using
+            either `swift-recon` or the native HTTP client. With sharding and
+            the HTTP backend, only the hosts of this shard are queried, unless
+            `all_hosts` is given. (`swift-recon` always queries all hosts.)
+        """
+        if self.__http is None:
+            if self.config.recon_batch:
+                server_type = server_type or "object"
+                sections = self.swift_recon_batch(server_type)
+                return self.parse_recon_lines(sections.get(check, []),
+                                              (server_type, "--" + check))
+            if server_type is None:
+                return self.swift_recon_parse("--" + check)
+            return self.swift_recon_parse(server_type, "--" + check)
+
+        server_type = server_type or "object"
+        endpoint = RECON_ENDPOINTS[check].format(server_type=server_type)
+        hosts = self.recon_hosts(server_type, all_hosts)
+        if self.config.recon_host_budget > 0 and check in self.config.recon_sampled_checks:
+            return self.__recon_data_sampled(endpoint, hosts)
+        result, _, skipped = self.__http.get(hosts, endpoint)
+        self.record("hosts", len(result))
+        self.__submit_skipped(endpoint, skipped)
+        if hosts and not result:
+            log.error("recon query for {0} did not return any usable output!".format(endpoint))
+        return result
+
+    def __recon_data_sampled(self, endpoint, hosts):
+        """ Like recon_data(), but only polls config.recon_host_budget of the
+            hosts, and uses the last known data for the others. The age of each
+            host's data is reported as a gauge.
+        """
+        sampler = self.__samplers.get(endpoint)
+        if sampler is None:
+            sampler = self.__samplers[endpoint] = HostSampler(self.config.recon_host_budget,
+                max_age=self.config.recon_sample_max_age)
+        polled = sampler.select(hosts)
+        result, _, skipped = self.__http.get(polled, endpoint)
+        sampler.update(polled, result)
+        self.record("hosts", len(result))
+        self.__submit_skipped(endpoint, skipped)
+
+        known = sampler.known(hosts)
+        if hosts and not known:
+            log.error("recon query for {0} did not return any usable output!".format(endpoint))
+        now = time.time()
+        metric = "recon_data_age_seconds." + endpoint.replace("/", "_")
+        for host, (_, timestamp) in known.items():
+            self.submit(metric, now - timestamp, host,
+                series=("recon_data_age_seconds", {"endpoint": endpoint}))
+        return { host: data for host, (data, _) in known.items() }
+
+    def recon_md5(self):
+        """ Returns a dict mapping "ring" and "swiftconf" to a tuple of
+            (matched, checked, errors), i.e. the number of hosts whose copy of
+            these files matches the local copy, the number of hosts checked,
+            and the number of hosts that could not be checked.
+        """
+        result = {}
+        if self.__http is None:
+            if self.config.recon_batch:
+                lines = self.swift_recon_batch("object").get("md5", [])
+            else:
+                lines = self.swift_recon_lines("--md5")
+            kind = 'undef'
+            for line in lines:
+                m = MD5_BANNER_RX.match(line)
+                if m:
+                    kind = m.group(1).replace(".", "")
+                    continue
+                m = MD5_SUMMARY_RX.match(line)
+                if m:
+                    result[kind] = (int(m.group(1)), int(m.group(2)),
+                                    int(m.group(3)))
+            return result
+
+        # same checks as in `swift-recon --md5`
+        swift_dir = self.config.swift_dir
+        hosts = self.recon_hosts("object", all_hosts=True)
+        self.record("hosts", len(hosts))
+
+        ring_sums = {}
+        for name in os.listdir(swift_dir):
+            if name.endswith(".ring.gz"):
+                ring_sums[name] = md5_file(os.path.join(swift_dir, name))
+        # hosts that are skipped because of earlier failures count as errors
+        data, errors, skipped = self.__http.get(hosts, "ringmd5")
+        self.__submit_skipped("ringmd5", skipped)
+        errors += skipped
+        matched = 0
+        for remote_sums in data.values():
+            if all(ring_sums.get(os.path.basename(path)) == remote_sum
+                   for path, remote_sum in remote_sums.items()):
+                matched += 1
+        result['ring'] = (matched, len(hosts), errors)
+
+        conf_sum = md5_file(os.path.join(swift_dir, "swift.conf"))
+        data, errors, skipped = self.__http.get(hosts, "swiftconfmd5")
+        self.__submit_skipped("swiftconfmd5", skipped)
+        errors += skipped
+        matched = 0
+        for remote_sums in data.values():
+            if all(remote_sum == conf_sum for remote_sum in remote_sums.values()):
+                matched += 1
+        result['swiftconf'] = (matched, len(hosts), errors)
+        return result
+
+    def __submit_skipped(self, endpoint, skipped):
+        """ Reports how many storage nodes were not queried because they
+            failed or were slow recently.
+        """
+        if self.__http.health is None:
+            return
+        self.record("hosts_skipped", skipped)
+        self.submit("recon_hosts_skipped." + endpoint.replace("/", "_"), skipped,
+            series=("recon_hosts_skipped", {"endpoint": endpoint}))
+
+    def __submit_rollups(self, metric, values, aggregate=sum):
+        """ Submits the given per-host values, a list of (hostname, device,
+            value) where device is None for values of a whole node, aggregated
+            per region and per zone of the rings. Does nothing unless
+            config.ring_rollups is set.
+        """
+        if not self.config.ring_rollups or not self.is_designated_shard():
+            return
+        index = self.__rings.get()
+        regions = collections.defaultdict(list)
+        zones = collections.defaultdict(list)
+        for hostname, device, value in values:
+            location = index.location(hostname, device)
+            if location is None:
+                log.debug("{} is not in the rings, leaving it out of {} rollups".format(hostname, metric))
+                continue
+            regions[location[0]].append(value)
+            zones[location].append(value)
+        for region, region_values in regions.items():
+            self.submit("{}.by_region.r{}".format(metric, region), aggregate(region_values),
+                series=(metric + "_by_region", {"region": str(region)}))
+        for (region, zone), zone_values in zones.items():
+            self.submit("{}.by_zone.r{}z{}".format(metric, region, zone), aggregate(zone_values),
+                series=(metric + "_by_zone", {"region": str(region), "zone": str(zone)}))
+
+    def step(self, func, *queries):
+        """ Returns a step that fetches the given recon queries, i.e. tuples
+            of (check, server_type), and passes their results to `func`. The
+            queries are available as the step's `queries` attribute. Since
+            fetch() runs each query once per cycle, steps that consume the
+            same data share one sweep over the cluster.
+        """
+        def run_step():
+            func(*[ self.fetch(check, server_type) for check, server_type in queries ])
+        run_step.queries = queries
+        return run_step
+
     def collector_steps(self):
-        return {
-            "driveaudit":     self.__collect_driveaudit,
-            "unmounted":      self.__collect_unmounted,
-            "diskusage":      self.__collect_diskusage,
+        steps = {
+            "driveaudit":     self.step(self.__collect_driveaudit, ("driveaudit", None)),
+            "unmounted":      self.step(self.__collect_unmounted, ("unmounted", None)),
+            "diskusage":      self.step(self.__collect_diskusage, ("diskusage", None)),
             "md5":            self.__collect_md5,
-            "updater_sweeps": self.__collect_updater_sweeps,
-            "replication":    self.__collect_replication,
-            "quarantined":    self.__collect_quarantined,
+            "quarantined":    self.step(self.__collect_quarantined, ("quarantined", None)),
+            "async_pending":  self.step(self.__collect_async_pending, ("async", None)),
+            "load":           self.step(self.__collect_load, ("loadstats", None)),
+            "sockstat":       self.step(self.__collect_sockstat, ("sockstat", None)),
+            "object_auditor": self.step(self.__collect_object_auditor, ("auditor", "object")),
+            "object_expirer": self.step(self.__collect_expirer, ("expirer", "object")),
+            "object_reconstruction": self.step(self.__collect_reconstruction, ("reconstruction", "object")),
         }
+        # one step per server type, so that these sweeps can run concurrently
+        for server_type in ['container', 'object']:
+            steps[server_type + "_updater_sweeps"] = self.step(
+                functools.partial(self.__collect_updater_sweeps, server_type),
+                ("updater", server_type))
+        for server_type in ['account', 'container', 'object']:
+            steps[server_type + "_replication"] = self.step(
+                functools.partial(self.__collect_replication, server_type),
+                ("replication", server_type))
+        for server_type in ['account', 'container']:
+            steps[server_type + "_auditor"] = self.step(
+                functools.partial(self.__collect_auditor, server_type),
+                ("auditor", server_type))
+        return steps
 
     ############################################################################
     # subparts of collect()
 
-    def __collect_diskusage(self):
+    def __collect_diskusage(self, data):
         """ Parser for `swift-recon --diskusage`. """
         total_free = 0
         total_used = 0
         total_size = 0
 
-        data = self.swift_recon_parse("--diskusage")
+        # fill levels of all mounted disks, and which disk each one belongs to
+        used_percent = Distribution()
+        disks = []
+
+        per_disk = self.config.diskusage_per_disk
+        # size and usage of each disk, for the ring rollups
+        rollups = self.config.ring_rollups
+        capacity = []
+        usage = []
         for hostname in data:
+            host_used = 0
+            host_size = 0
             for disk in data[hostname]:
-                if not disk['mounted']:
+                # unmounted disks are listed with `mounted` set to False or,
+                # if the mount check failed, to the error message, and with
+                # empty sizes
+                if disk['mounted'] is not True:
                     continue
                 total_free += disk['avail']
                 total_used += disk['used']
                 total_size += disk['size']
+                host_used += disk['used']
+                host_size += disk['size']
+                if rollups:
+                    capacity.append((hostname, disk['device'], disk['size']))
+                    usage.append((hostname, disk['device'], disk['used']))
 
-                # submit metrics by disk (only used_percent here, which is the
-                # most useful for alerting; otherwise we flood statsd with
-                # hundreds of metrics)
-                device = re.sub(r"[^a-zA-Z0-9]+", "", disk['device'])
-                self.submit('storage_used_percent.disk.' + device,
-                    float(disk['used']) / float(disk['size']), hostname)
+                device = DEVICE_NAME_RX.sub("", disk['device'])
+                value = float(disk['used']) / float(disk['size'])
+                used_percent.add(value)
+                disks.append((hostname, device))
+
+                # submit metrics by disk only on request (only used_percent
+                # here, which is the most useful for alerting; otherwise we
+                # flood statsd with hundreds of metrics)
+                if per_disk:
+                    self.submit('storage_used_percent.disk.' + device,
+                        value, hostname, series=('disk_used_percent', {'disk': device}))
+
+            # forecast when this host is full, if it keeps filling up at the
+            # same rate as over the last runs (not for hosts without mounted
+            # disks, which are "full" right away); this has its own name,
+            # since without the hostname suffix, it would overwrite the
+            # cluster value
+            history = self.remember('storage_used_bytes', host_used, hostname)
+            if history is not None and host_size > 0:
+                self.submit_derived('storage_node_time_to_full_seconds',
+                    history.time_to_reach(host_size), hostname)
+
+        # submit the distribution of fill levels across all disks instead
+        if used_percent:
+            self.submit('disk_used_percent.min',  used_percent.min())
+            self.submit('disk_used_percent.max',  used_percent.max())
+            self.submit('disk_used_percent.mean', used_percent.mean())
+            for p in (50, 90, 99):
+                self.submit('disk_used_percent.p{}'.format(p), used_percent.percentile(p))
+            for threshold in self.config.diskusage_thresholds:
+                self.submit('disks_used_above.' + str(threshold).replace(".", "_"),
+                    used_percent.count_above(threshold),
+                    series=('disks_used_above', {'threshold': str(threshold)}))
+            for idx in used_percent.top(self.config.diskusage_top_k):
+                hostname, device = disks[idx]
+                # always identify the disk in the name, since the fullest
+                # disks are few, but may be on the same host
+                self.submit('disk_used_percent.fullest.{}.{}'.format(
+                        HOST_NAME_RX.sub("_", hostname), device),
+                    used_percent.values[idx],
+                    series=('disk_used_percent_fullest', {'host': hostname, 'disk': device}))
 
         # submit summary metrics
         self.submit('storage_free_bytes',     total_free)
@@ -103,30 +551,29 @@ class SwiftReconCollector(Collector):
             self.submit('storage_used_percent',
                 float(total_used) / float(total_size))
 
+        self.__submit_rollups('storage_capacity_bytes', capacity)
+        self.__submit_rollups('storage_used_bytes', usage)
+
+        history = self.remember('storage_used_bytes', total_used)
+        if history is not None:
+            self.submit_derived('storage_used_bytes_per_second', history.slope())
+            if total_size > 0:
+                self.submit_derived('storage_time_to_full_seconds',
+                    history.time_to_reach(total_size))
+
     def __collect_md5(self):
         """ Parser for `swift-recon --md5`. """
+        # these are cluster-wide metrics only
+        if not self.is_designated_shard():
+            return
         data = {}
-        kind = 'undef'
-
-        for line in self.swift_recon("--md5").splitlines():
-            m = re.match(r'.* Checking ([\.a-zA-Z0-9_]+) md5sum', line)
-            if m:
-                kind = m.group(1).replace(".", "")
-                data[kind] = {}
-                continue
-            pattern = (r"(\d+)/(\d+) hosts matched, (\d+) error\[s\] "
-                       "while checking hosts")
-            m = re.match(pattern, line)
-            if m:
-                data[kind]['matched'] = int(m.group(1))
-                data[kind]['not_matched'] = (int(m.group(2)) -
-                                                 int(m.group(1)))
-                data[kind]['errors'] = int(m.group(3))
-                data[kind]['all'] = (data[kind]['matched'] +
-                                     data[kind]['not_matched'] +
-                                     data[kind]['errors'])
-            else:
-                continue
+        for kind, (matched, checked, errors) in self.recon_md5().items():
+            data[kind] = {
+                'matched':     matched,
+                'not_matched': checked - matched,
+                'errors':      errors,
+                'all':         checked + errors,
+            }
 
         for kind in ['ring', 'swiftconf']:
             values = data.get(kind, {})
@@ -134,55 +581,173 @@ class SwiftReconCollector(Collector):
                 metric = "md5_{}_{}".format(kind, key)
                 self.submit(metric, values.get(key))
 
-    def __collect_updater_sweeps(self):
-        """ Parser for `swift-recon --updater`. """
-        for server_type in ['container', 'object']:
-            data = self.swift_recon_parse(server_type, "--updater")
-            metric = server_type + "s_updater_sweep_time"
-            key = server_type + "_updater_sweep"
-            for hostname in data:
-                self.submit(metric, data[hostname][key], hostname)
-
-    def __collect_replication(self):
-        """ Parser for `swift-recon --replication`. """
-        for server_type in ['account', 'container', 'object']:
-            duration_metric = server_type + "s_replication_duration"
-            age_metric = server_type + "s_replication_age"
+    def __collect_updater_sweeps(self, server_type, data):
+        """ Parser for `swift-recon <server_type> --updater`. """
+        metric = server_type + "s_updater_sweep_time"
+        key = server_type + "_updater_sweep"
+        series = ("updater_sweep_time", {"server_type": server_type})
+        for hostname in data:
+            self.submit(metric, data[hostname][key], hostname, series=series)
 
-            # https://twitter.com/stefanmajewsky/status/654660805607096322
-            if server_type == "object":
-                duration_key, last_key = "object_replication_time", "object_replication_last"
-            else:
-                duration_key, last_key = "replication_time", "replication_last"
-
-            current_timestamp = time.time()
-            data = self.swift_recon_parse(server_type, "--replication")
-            for hostname in data:
-                self.submit(duration_metric,
-                    data[hostname].get(duration_key), hostname)
-                # convert timestamp of last completion into an age
-                if data[hostname][last_key] is None:
-                    continue
-                self.submit(age_metric,
-                    current_timestamp - data[hostname].get(last_key), hostname)
+    def __collect_replication(self, server_type, data):
+        """ Parser for `swift-recon <server_type> --replication`. """
+        duration_metric = server_type + "s_replication_duration"
+        age_metric = server_type + "s_replication_age"
+
+        # https://twitter.com/stefanmajewsky/status/654660805607096322
+        if server_type == "object":
+            duration_key, last_key = "object_replication_time", "object_replication_last"
+        else:
+            duration_key, last_key = "replication_time", "replication_last"
+
+        labels = {"server_type": server_type}
+
+        current_timestamp = time.time()
+        ages = []
+        for hostname in data:
+            self.submit(duration_metric,
+                data[hostname].get(duration_key), hostname,
+                series=("replication_duration", labels))
+            # convert timestamp of last completion into an age
+            if data[hostname][last_key] is None:
+                continue
+            age = current_timestamp - data[hostname].get(last_key)
+            self.submit(age_metric, age, hostname,
+                series=("replication_age", labels))
+            ages.append((hostname, None, age))
+            # the age grows by 1 per second while replication is stuck, and
+            # stays level (on average) while it keeps up
+            history = self.remember(age_metric, age, hostname)
+            if history is not None:
+                self.submit_derived(age_metric + "_trend", history.slope(), hostname,
+                    series=("replication_age_trend", labels))
+        # the oldest replication pass in each region and zone
+        self.__submit_rollups(age_metric, ages, aggregate=max)
 
-    def __collect_quarantined(self):
+    def __collect_quarantined(self, data):
         """ Parser for `swift-recon --quarantined`. """
-        data = self.swift_recon_parse("--quarantined")
         for hostname in data:
             values = data[hostname]
             for key in ['accounts', 'containers', 'objects']:
                 metric = key + "_quarantined"
                 self.submit(metric, values.get(key), hostname)
+                history = self.remember(metric, values.get(key), hostname)
+                if history is not None:
+                    self.submit_derived(metric + "_per_second", history.slope(), hostname)
 
-    def __collect_unmounted(self):
+    def __collect_unmounted(self, data):
         """ Parser for `swift-recon --unmounted`. """
-        data = self.swift_recon_parse("--unmounted")
+        counts = []
         for hostname in data:
             self.submit("drives_unmounted", len(data[hostname]), hostname)
+            # count each drive in its own zone, and every node in its zone
+            # (so that zones without unmounted drives report 0)
+            counts.append((hostname, None, 0))
+            counts.extend((hostname, disk.get('device'), 1) for disk in data[hostname])
+        self.__submit_rollups("drives_unmounted", counts)
 
-    def __collect_driveaudit(self):
+    def __collect_driveaudit(self, data):
         """ Parser for `swift-recon --driveaudit`. """
-        data = self.swift_recon_parse("--driveaudit")
+        counts = []
+        for hostname in data:
+            errors = data[hostname].get('drive_audit_errors')
+            self.submit("drives_audit_errors", errors, hostname)
+            history = self.remember("drives_audit_errors", errors, hostname)
+            if history is not None:
+                self.submit_derived("drives_audit_errors_per_second", history.slope(), hostname)
+            if errors is not None:
+                counts.append((hostname, None, errors))
+        self.__submit_rollups("drives_audit_errors", counts)
+
+    def __collect_async_pending(self, data):
+        """ Parser for `swift-recon --async`. """
         for hostname in data:
-            self.submit("drives_audit_errors", data[hostname].get('drive_audit_errors'), hostname)
+            pending = data[hostname].get('async_pending')
+            self.submit("async_pending", pending, hostname)
+            history = self.remember("async_pending", pending, hostname)
+            if history is not None:
+                self.submit_derived("async_pending_per_second", history.slope(), hostname)
+
+    def __collect_load(self, data):
+        """ Parser for `swift-recon --loadstats`. """
+        for hostname in data:
+            values = data[hostname]
+            for period in ['1m', '5m', '15m']:
+                self.submit("load_average." + period, values.get(period), hostname,
+                    series=("load_average", {"period": period}))
+            # "tasks" is "<running>/<total>", like in /proc/loadavg
+            tasks = values.get('tasks')
+            if tasks:
+                running, total = tasks.split("/")
+                self.submit("tasks_running", int(running), hostname)
+                self.submit("tasks_total", int(total), hostname)
+
+    def __collect_sockstat(self, data):
+        """ Parser for `swift-recon --sockstat`. """
+        for hostname in data:
+            for key, value in data[hostname].items():
+                # tcp6_in_use is missing on nodes without IPv6
+                if value is not None:
+                    self.submit("sockstat_" + key, value, hostname)
+
+    def __collect_auditor(self, server_type, data):
+        """ Parser for `swift-recon <server_type> --auditor` (account and
+            container servers).
+        """
+        labels = {"server_type": server_type}
+        for hostname in data:
+            values = data[hostname]
+            self.submit(server_type + "s_audits_passed",
+                values.get(server_type + "_audits_passed"), hostname,
+                series=("audits_passed", labels))
+            self.submit(server_type + "s_audits_failed",
+                values.get(server_type + "_audits_failed"), hostname,
+                series=("audits_failed", labels))
+            # the duration of the last completed pass; None until there was one
+            duration = values.get(server_type + "_auditor_pass_completed")
+            if duration is not None:
+                self.submit(server_type + "s_auditor_pass_duration", duration, hostname,
+                    series=("auditor_pass_duration", labels))
+
+    def __collect_object_auditor(self, data):
+        """ Parser for `swift-recon object --auditor`. Object auditors that
+            run in parallel report their stats per disk, which are added up
+            (just like `swift-recon` does).
+        """
+        for hostname in data:
+            for kind in ['ALL', 'ZBF']:
+                stats = data[hostname].get('object_auditor_stats_' + kind)
+                if not stats:
+                    continue
+                if 'passes' not in stats and 'audit_time' not in stats:
+                    per_disk = [ value for value in stats.values() if isinstance(value, dict) ]
+                else:
+                    per_disk = [ stats ]
+                for key in ['audit_time', 'bytes_processed', 'errors', 'passes', 'quarantined']:
+                    values = [ disk.get(key) for disk in per_disk if disk.get(key) is not None ]
+                    if not values:
+                        continue
+                    self.submit("objects_auditor_{}.{}".format(key, kind.lower()), sum(values), hostname,
+                        series=("objects_auditor_" + key, {"auditor": kind.lower()}))
+
+    def __collect_expirer(self, data):
+        """ Parser for `swift-recon object --expirer`. """
+        for hostname in data:
+            values = data[hostname]
+            if values.get('object_expiration_pass') is None:
+                continue # the expirer does not run on this node
+            self.submit("objects_expiration_pass_duration", values['object_expiration_pass'], hostname)
+            self.submit("objects_expired_last_pass", values.get('expired_last_pass'), hostname)
+
+    def __collect_reconstruction(self, data):
+        """ Parser for `swift-recon object --reconstruction`. """
+        current_timestamp = time.time()
+        for hostname in data:
+            values = data[hostname]
+            # None on nodes without erasure-coded policies
+            if values.get('object_reconstruction_last') is None:
+                continue
+            self.submit("objects_reconstruction_duration",
+                values.get('object_reconstruction_time'), hostname)
+            self.submit("objects_reconstruction_age",
+                current_timestamp - values['object_reconstruction_last'], hostname)
@@ -0,0 +1,168 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import socket
+import threading
+
+try:
+    import http.client as httplib
+except ImportError: # Python 2
+    import httplib
+
+from swift_health_statsd.health import HostHealth
+from swift_health_statsd.ipc import clock
+from swift_health_statsd.pool import WorkerPool
+
+log = logging.getLogger(__name__)
+
+class ReconHTTPClient(object):
+    """ Queries the /recon/<endpoint> API of the storage nodes directly, i.e.
+        without going through `swift-recon`. Connections are kept alive and
+        reused across requests (and across collection cycles, if the client
+        object is reused). At most `max_connections_per_host` connections to
+        each node are open at the same time, no matter how many collector
+        steps use this client concurrently; further requests to the same node
+        wait for a connection to become free.
+
+        If `health` (a HostHealth instance) is given, nodes that failed or
+        answered slowly are skipped or probed according to it, and the timeout
+        for each node adapts to its observed latency (up to `timeout`).
+    """
+
+    def __init__(self, timeout=5, max_workers=16, max_connections_per_host=2, health=None):
+        self.timeout = timeout
+        self.health = health
+        self.max_connections_per_host = max(1, int(max_connections_per_host))
+        self.__pool = WorkerPool(max_workers)
+        self.__idle = {}
+        self.__slots = {}
+        self.__lock = threading.Lock()
+
+    def __acquire(self, host, port):
+        with self.__lock:
+            slots = self.__slots.get((host, port))
+            if slots is None:
+                slots = threading.BoundedSemaphore(self.max_connections_per_host)
+                self.__slots[(host, port)] = slots
+        slots.acquire()
+        with self.__lock:
+            idle = self.__idle.get((host, port))
+            if idle:
+                return idle.pop(), True
+        return httplib.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def __release(self, host, port, conn):
+        """ Gives back the connection slot taken by __acquire(). If `conn` is
+            not None, it is kept for reuse by later requests.
+        """
+        with self.__lock:
+            if conn is not None:
+                self.__idle.setdefault((host, port), []).append(conn)
+            slots = self.__slots[(host, port)]
+        slots.release()
+
+    def get_one(self, host, port, endpoint, timeout=None):
+        """ Queries /recon/<endpoint> on a single storage node and returns the
+            decoded JSON response. Raises on any error.
+        """
+        path = "/recon/" + endpoint
+        timeout = self.timeout if timeout is None else timeout
+        conn, reused = self.__acquire(host, port)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        try:
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                # a kept-alive connection may have been closed by the server
+                # in the meantime; retry once on a fresh connection
+                conn.close()
+                if not reused:
+                    raise
+                conn = httplib.HTTPConnection(host, port, timeout=timeout)
+                conn.request("GET", path)
+                response = conn.getresponse()
+            body = response.read()
+        except:
+            conn.close()
+            self.__release(host, port, None)
+            raise
+
+        if response.will_close:
+            conn.close()
+            self.__release(host, port, None)
+        else:
+            self.__release(host, port, conn)
+
+        if response.status != 200:
+            raise httplib.HTTPException("GET http://{}:{}{} returned {}".format(
+                host, port, path, response.status))
+        return json.loads(body.decode("utf-8"))
+
+    def get(self, hosts, endpoint):
+        """ Queries /recon/<endpoint> on all the given (host, port) pairs
+            concurrently. Returns a tuple of a dict mapping each host that
+            answered to its decoded response, the number of hosts that could
+            not be queried, and the number of hosts that were skipped because
+            of their health.
+        """
+        def fetch(host_port):
+            host, port = host_port
+            health = self.health
+            timeout = self.timeout
+            if health is not None:
+                state = health.check(host)
+                if state == HostHealth.SKIP:
+                    return host, "skipped", None
+                if state == HostHealth.PROBE:
+                    timeout = min(timeout, health.probe_timeout)
+                else:
+                    timeout = health.timeout(host, timeout)
+            start = clock()
+            try:
+                data = self.get_one(host, port, endpoint, timeout)
+            except Exception as e:
+                log.error("recon request for {} failed on {}:{}: {}".format(
+                    endpoint, host, port, e))
+                if health is not None:
+                    health.record_failure(host)
+                return host, "failed", None
+            if health is not None:
+                latency = clock() - start
+                health.record_success(host, latency, slow=latency > self.timeout / 2.0)
+            return host, "ok", data
+
+        result = {}
+        errors = 0
+        skipped = 0
+        for host, status, data in self.__pool.map(fetch, hosts):
+            if status == "ok":
+                result[host] = data
+            elif status == "failed":
+                errors += 1
+            else:
+                skipped += 1
+        return result, errors, skipped
+
+    def close(self):
+        """ Closes all idle connections. """
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
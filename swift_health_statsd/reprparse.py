@@ -0,0 +1,64 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ast
+import json
+
+def _reject_constant(name):
+    # json.loads() accepts NaN and Infinity, but ast.literal_eval() does not
+    raise ValueError("unexpected constant: " + name)
+
+_decoder = json.JSONDecoder(parse_constant=_reject_constant)
+
+def parse_repr_fast(text):
+    """ Parses the Python repr of a data structure made from dicts, lists,
+        (unicode) strings, numbers, True, False and None, like swift-recon
+        prints them. Raises ValueError if `text` is outside of the subset that
+        can be handled here.
+
+        Instead of walking the string in Python, this rewrites the repr into
+        JSON with a few str.split()/str.replace() calls and hands it to the
+        C-accelerated JSON decoder. This only works if no string contains a
+        quote or a backslash, which is true for almost everything that the
+        recon API returns.
+    """
+    if '"' in text or '\\' in text or '\0' in text:
+        raise ValueError("string literals with escapes are not supported")
+
+    # since there are no escaped quotes, every single quote delimits a string
+    # literal: even-numbered parts are outside of strings, odd-numbered parts
+    # are string contents
+    parts = text.split("'")
+    if len(parts) % 2 == 0:
+        raise ValueError("unbalanced quotes")
+
+    # rewrite everything outside of strings in one go: "\0" marks where the
+    # string literals are (so that a "u" before it is the u'' prefix)
+    outside = "\0".join(parts[0::2])
+    outside = (outside.replace("u\0", "\0")
+                      .replace("True", "true")
+                      .replace("False", "false")
+                      .replace("None", "null"))
+    parts[0::2] = outside.split("\0")
+    return _decoder.decode('"'.join(parts))
+
+def parse_repr(text):
+    """ Equivalent to ast.literal_eval(text), but much faster for the output
+        of swift-recon. Falls back to ast.literal_eval() for anything that
+        parse_repr_fast() cannot handle.
+    """
+    try:
+        return parse_repr_fast(text)
+    except ValueError:
+        return ast.literal_eval(text)
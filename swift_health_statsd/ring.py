@@ -0,0 +1,168 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import errno
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+
+def ring_path(swift_dir, server_type):
+    """ Returns the path of the ring file for the given server type. """
+    return os.path.join(swift_dir, server_type + ".ring.gz")
+
+def load_ring_devices(path):
+    """ Reads a Swift ring file and returns its list of devices (as dicts with
+        at least the keys "ip", "port" and "device"). Removed devices are
+        skipped.
+
+        Only the serialization format version 1 (the one written by all Swift
+        releases since 1.8) is parsed natively. For other formats, we try to
+        use Swift's own RingData class, if it is installed.
+    """
+    with gzip.open(path, "rb") as f:
+        magic = f.read(4)
+        if magic == b"R1NG":
+            version, = struct.unpack("!H", f.read(2))
+            if version == 1:
+                json_len, = struct.unpack("!I", f.read(4))
+                devs = json.loads(f.read(json_len).decode("utf-8"))["devs"]
+                return [ dev for dev in devs if dev is not None ]
+
+    try:
+        from swift.common.ring import RingData
+    except ImportError:
+        raise ValueError("cannot read ring file {}: unsupported format "
+                         "(and Swift is not installed)".format(path))
+    return [ dev for dev in RingData.load(path).devs if dev is not None ]
+
+def ring_hosts(swift_dir, server_type):
+    """ Returns a sorted list of (ip, port) for all storage servers of the
+        given type, like `swift-recon` discovers them.
+    """
+    devs = load_ring_devices(ring_path(swift_dir, server_type))
+    return sorted(set((dev["ip"], dev["port"]) for dev in devs))
+
+class RingIndex(object):
+    """ What the collectors need to know from the rings, without keeping the
+        rings themselves in memory: the (ip, port) of the storage servers of
+        each server type, and the (region, zone) of each storage node and
+        device.
+    """
+
+    def __init__(self, rings):
+        """ Takes a dict mapping server types to their ring's list of devices
+            (as returned by load_ring_devices()).
+        """
+        self.__hosts = {}
+        self.__host_locations = {}
+        self.__device_locations = {}
+        zones = collections.defaultdict(collections.Counter)
+        for server_type, devs in rings.items():
+            self.__hosts[server_type] = sorted(set((dev["ip"], dev["port"]) for dev in devs))
+            for dev in devs:
+                # rings from before Swift 1.9 have no regions
+                location = (dev.get("region", 1), dev["zone"])
+                self.__device_locations[(dev["ip"], dev["device"])] = location
+                zones[dev["ip"]][location] += 1
+        # a node whose devices are in several zones belongs to the zone of
+        # most of them
+        for ip, counts in zones.items():
+            self.__host_locations[ip] = counts.most_common(1)[0][0]
+
+    def hosts(self, server_type):
+        """ Returns a sorted list of (ip, port) for all storage servers of the
+            given type, like `swift-recon` discovers them.
+        """
+        if server_type not in self.__hosts:
+            raise ValueError("no ring for {} servers".format(server_type))
+        return self.__hosts[server_type]
+
+    def location(self, ip, device=None):
+        """ Returns the (region, zone) of the given storage node or, if given,
+            of one of its devices. Returns None for nodes and devices that are
+            not in any ring.
+        """
+        if device is not None and (ip, device) in self.__device_locations:
+            return self.__device_locations[(ip, device)]
+        return self.__host_locations.get(ip)
+
+class RingIndexCache(object):
+    """ Holds the RingIndex for the rings in `swift_dir`, and rebuilds it only
+        when the modification time of one of the ring files has changed.
+        Missing ring files are left out of the index.
+    """
+
+    def __init__(self, swift_dir, server_types=("account", "container", "object")):
+        self.swift_dir = swift_dir
+        self.server_types = server_types
+        self.builds = 0
+        self.__mtimes = None
+        self.__index = None
+        self.__lock = threading.Lock()
+
+    def get(self):
+        """ Returns the current RingIndex. """
+        mtimes = {}
+        for server_type in self.server_types:
+            try:
+                mtimes[server_type] = os.stat(ring_path(self.swift_dir, server_type)).st_mtime
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        with self.__lock:
+            if self.__index is None or mtimes != self.__mtimes:
+                self.__index = RingIndex({ server_type: load_ring_devices(ring_path(self.swift_dir, server_type))
+                                           for server_type in mtimes })
+                self.__mtimes = mtimes
+                self.builds += 1
+            return self.__index
+
+def shard_of(host, shard_count):
+    """ Returns which of `shard_count` shards is responsible for the given
+        host, by rendezvous hashing: each shard scores each host, and the
+        host goes to the shard with the highest score. When shards are added
+        or removed, only the hosts of these shards move.
+    """
+    def score(shard):
+        key = "{}:{}".format(shard, host).encode("utf-8")
+        return hashlib.md5(key).hexdigest()
+    return max(range(shard_count), key=score)
+
+# the ports that the storage servers listen on in a default Swift setup
+DEFAULT_PORTS = {
+    "account":   6002,
+    "container": 6001,
+    "object":    6000,
+}
+
+def parse_host_list(value, default_port=None):
+    """ Parses a comma-separated list of "host" or "host:port" entries into a
+        list of (host, port). For entries without a port, the port is
+        `default_port`.
+    """
+    hosts = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(":")
+        if host and port.isdigit():
+            hosts.append((host, int(port)))
+        else:
+            hosts.append((entry, default_port))
+    return hosts
@@ -0,0 +1,125 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numbers
+import threading
+import time
+
+def data_change(old, new):
+    """ Returns how much a recon response changed, as the largest relative
+        change of any number in it (capped at 1). Responses with a different
+        structure count as completely changed.
+    """
+    if isinstance(old, bool) or isinstance(new, bool):
+        return 0.0 if old == new else 1.0
+    if isinstance(old, numbers.Real) and isinstance(new, numbers.Real):
+        if old == new:
+            return 0.0
+        return min(1.0, abs(new - old) / max(abs(old), abs(new)))
+    if isinstance(old, dict) and isinstance(new, dict):
+        if set(old) != set(new):
+            return 1.0
+        return max([ data_change(old[key], new[key]) for key in old ] or [0.0])
+    if isinstance(old, list) and isinstance(new, list):
+        if len(old) != len(new):
+            return 1.0
+        return max([ data_change(a, b) for a, b in zip(old, new) ] or [0.0])
+    return 0.0 if old == new else 1.0
+
+class HostState(object):
+    __slots__ = ("data", "timestamp", "last_poll", "change", "failed")
+
+    def __init__(self):
+        self.data = None
+        self.timestamp = None  # when `data` was received
+        self.last_poll = None  # cycle of the last poll
+        self.change = 0.0      # data_change() at the last successful poll
+        self.failed = False    # whether the last poll failed
+
+class HostSampler(object):
+    """ Polls only `budget` of the storage nodes in each cycle for one recon
+        endpoint, and remembers the last response of every node, so that the
+        remaining nodes are accounted for with their last known data.
+
+        The nodes are chosen round-robin (the one polled longest ago first),
+        but nodes that were never polled go first, and nodes whose data
+        changed more at their last poll come around sooner: their waiting time
+        counts up to `1 + volatility_weight` times as much. Nodes that failed
+        at their last poll count as if their data had changed completely.
+
+        Data older than `max_age` seconds (if given) is dropped, so that a node
+        that keeps failing is not accounted for with stale data forever.
+    """
+
+    def __init__(self, budget, volatility_weight=4.0, max_age=None):
+        self.budget = max(1, int(budget))
+        self.volatility_weight = volatility_weight
+        self.max_age = max_age
+        self.__cycle = 0
+        self.__hosts = {}
+        self.__lock = threading.Lock()
+
+    def select(self, hosts):
+        """ Starts a new cycle and returns which of the given (host, port)
+            pairs to poll in it.
+        """
+        with self.__lock:
+            self.__cycle += 1
+            def priority(host_port):
+                state = self.__hosts.get(host_port[0])
+                if state is None:
+                    return float("inf")
+                change = 1.0 if state.failed else state.change
+                waited = self.__cycle - state.last_poll
+                return waited * (1.0 + self.volatility_weight * change)
+            # sorted() is stable, so ties keep the order of the ring
+            return sorted(hosts, key=priority, reverse=True)[:self.budget]
+
+    def update(self, polled, result):
+        """ Records the responses (a dict mapping hosts to data) of the polled
+            (host, port) pairs.
+        """
+        now = time.time()
+        with self.__lock:
+            for host, _ in polled:
+                state = self.__hosts.get(host)
+                if state is None:
+                    state = self.__hosts[host] = HostState()
+                state.last_poll = self.__cycle
+                state.failed = host not in result
+                if state.failed:
+                    continue
+                data = result[host]
+                state.change = 0.0 if state.data is None else data_change(state.data, data)
+                state.data = data
+                state.timestamp = now
+
+    def known(self, hosts):
+        """ Returns a dict mapping each of the given (host, port) pairs' hosts
+            to a tuple of its last known data and when that was received.
+            Hosts that never answered, or whose data is older than max_age,
+            are left out.
+        """
+        now = time.time()
+        with self.__lock:
+            result = {}
+            for host, _ in hosts:
+                state = self.__hosts.get(host)
+                if state is None or state.data is None:
+                    continue
+                if self.max_age and now - state.timestamp > self.max_age:
+                    state.data = None
+                    continue
+                result[host] = (state.data, state.timestamp)
+            return result
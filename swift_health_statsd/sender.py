@@ -0,0 +1,275 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import socket
+import threading
+
+from swift_health_statsd.ipc import clock
+
+log = logging.getLogger(__name__)
+
+class UDPTransport(object):
+    """ Sends each packet as one datagram. Packets that cannot be sent are
+        lost, just like with statsd.StatsClient.
+    """
+    stream = False
+
+    def __init__(self, host="localhost", port=8125):
+        family, _, _, _, self.addr = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0]
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+
+    def send(self, data):
+        self.sock.sendto(data, self.addr)
+
+    def close(self):
+        self.sock.close()
+
+class StreamTransport(object):
+    """ Base class for transports that send newline-terminated packets over a
+        persistent connection, which is opened on the first send() and
+        reopened on the next send() after a failure.
+    """
+    stream = True
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        self.sock = None
+
+    def connect(self):
+        """ Must be overridden by subclass to return a connected socket. """
+        raise NotImplementedError
+
+    def send(self, data):
+        if self.sock is None:
+            self.sock = self.connect()
+        try:
+            self.sock.sendall(data + b"\n")
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+class TCPTransport(StreamTransport):
+    def __init__(self, host="localhost", port=8125, timeout=5):
+        super(TCPTransport, self).__init__(timeout)
+        self.host = host
+        self.port = port
+
+    def connect(self):
+        return socket.create_connection((self.host, self.port), self.timeout)
+
+class UnixTransport(StreamTransport):
+    def __init__(self, path, timeout=5):
+        super(UnixTransport, self).__init__(timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+class QueuedPipeline(object):
+    """ Like statsd.Pipeline: collects metrics until send() is called, and
+        then puts all of them into the client's queue at once.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lines = []
+
+    def gauge(self, stat, value):
+        self.lines.extend(format_gauge(stat, value))
+
+    def timing(self, stat, delta):
+        self.lines.append(format_timing(stat, delta))
+
+    def send(self):
+        lines, self.lines = self.lines, []
+        self.client.enqueue(lines)
+
+def format_gauge(stat, value):
+    """ Returns the statsd lines that set the given gauge. Since a leading
+        minus sign would be read as a relative change, negative values are set
+        by resetting the gauge to zero first.
+    """
+    if value < 0:
+        return [ "{}:0|g".format(stat), "{}:{}|g".format(stat, value) ]
+    return [ "{}:{}|g".format(stat, value) ]
+
+def format_timing(stat, delta):
+    return "{}:{:0.6f}|ms".format(stat, delta)
+
+class QueuedStatsClient(object):
+    """ A replacement for statsd.StatsClient that decouples the collectors
+        from the network: metrics are only put into a queue of at most
+        `max_queue` metrics, and a background thread packs them into packets
+        of at most `max_packet_size` bytes and sends them through `transport`
+        (at most `rate` packets per second, if given).
+
+        Metrics that do not fit into the queue, and packets that cannot be
+        sent over UDP, are dropped and counted. Stream transports are retried
+        (with growing pauses) until they work again, while the queue fills
+        up.
+    """
+
+    def __init__(self, transport, max_queue=100000, max_packet_size=512, rate=None):
+        self.transport = transport
+        self.max_queue = max_queue
+        self.max_packet_size = max_packet_size
+        self.rate = rate
+        self.dropped = 0          # metrics lost because the queue was full or a packet could not be sent
+        self.packets_sent = 0
+        self.send_errors = 0
+        self.__queue = collections.deque()
+        self.__cond = threading.Condition()
+        self.__sending = False    # whether the sender holds metrics that were taken from the queue
+        self.__closing = False
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def gauge(self, stat, value):
+        self.enqueue(format_gauge(stat, value))
+
+    def timing(self, stat, delta):
+        self.enqueue([ format_timing(stat, delta) ])
+
+    def pipeline(self):
+        return QueuedPipeline(self)
+
+    def enqueue(self, lines):
+        if not lines:
+            return
+        with self.__cond:
+            room = max(0, self.max_queue - len(self.__queue))
+            if self.__closing:
+                room = 0
+            self.__queue.extend(lines[:room])
+            self.dropped += max(0, len(lines) - room)
+            self.__cond.notify_all()
+
+    def sender_stats(self):
+        """ Returns the counters that describe the sender, as a dict. """
+        with self.__cond:
+            return {
+                "metrics_dropped": self.dropped,
+                "metrics_queued":  len(self.__queue),
+                "packets_sent":    self.packets_sent,
+                "send_errors":     self.send_errors,
+            }
+
+    def flush(self, timeout=None):
+        """ Waits until all queued metrics have been sent (or dropped), or
+            until the timeout (in seconds) expires. Returns whether the queue
+            is empty.
+        """
+        deadline = None if timeout is None else clock() + timeout
+        with self.__cond:
+            while self.__queue or self.__sending:
+                remaining = None if deadline is None else deadline - clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__cond.wait(remaining)
+            return True
+
+    def close(self, timeout=10):
+        """ Sends the remaining metrics (waiting at most `timeout` seconds),
+            and stops the sender. Metrics that could not be sent until then
+            are counted as dropped.
+        """
+        self.flush(timeout)
+        with self.__cond:
+            self.__closing = True
+            self.dropped += len(self.__queue)
+            self.__queue.clear()
+            self.__cond.notify_all()
+        self.__thread.join(timeout)
+        self.transport.close()
+        if self.dropped:
+            log.warning("{} metrics could not be sent".format(self.dropped))
+
+    def __next_packet(self):
+        """ Takes as many metrics from the queue as fit into one packet. Blocks
+            until there is at least one. Returns None when closing.
+        """
+        with self.__cond:
+            while not self.__queue and not self.__closing:
+                self.__cond.wait()
+            if not self.__queue:
+                return None
+            lines = [ self.__queue.popleft() ]
+            size = len(lines[0])
+            while self.__queue and size + 1 + len(self.__queue[0]) < self.max_packet_size:
+                size += 1 + len(self.__queue[0])
+                lines.append(self.__queue.popleft())
+            self.__sending = True
+            return lines
+
+    def __run(self):
+        next_send = clock()
+        retry_delay = 0.1
+        while True:
+            lines = self.__next_packet()
+            if lines is None:
+                return
+            data = "\n".join(lines).encode("utf-8")
+
+            while True:
+                # pace the packets
+                if self.rate:
+                    self.__pause(next_send - clock())
+                    next_send = max(next_send, clock()) + 1.0 / self.rate
+                try:
+                    self.transport.send(data)
+                    sent, retry_delay = True, 0.1
+                except socket.error as e:
+                    log.debug("cannot send metrics: {}".format(e))
+                    sent = False
+                with self.__cond:
+                    if sent:
+                        self.packets_sent += 1
+                    else:
+                        self.send_errors += 1
+                    # datagrams are lost anyway; streams are retried until
+                    # they work or until the client is closed
+                    give_up = not sent and (not self.transport.stream or self.__closing)
+                    if give_up:
+                        self.dropped += len(lines)
+                    if sent or give_up:
+                        self.__sending = False
+                        self.__cond.notify_all()
+                        break
+                self.__pause(retry_delay)
+                retry_delay = min(2 * retry_delay, 10.0)
+
+    def __pause(self, seconds):
+        """ Sleeps for the given time, unless the client is closed. """
+        deadline = clock() + seconds
+        with self.__cond:
+            while not self.__closing:
+                remaining = deadline - clock()
+                if remaining <= 0:
+                    return
+                self.__cond.wait(remaining)
@@ -0,0 +1,71 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import bisect
+import heapq
+import math
+
+class Distribution(object):
+    """ Summarizes a large number of values (e.g. the fill level of every disk
+        in the cluster) without keeping a Python object for each of them: the
+        values are stored in a flat array of doubles, and sorted once when the
+        first summary is requested.
+    """
+
+    def __init__(self):
+        self.values = array.array("d")
+        self.__sorted = None
+
+    def add(self, value):
+        self.values.append(value)
+        self.__sorted = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def sorted_values(self):
+        if self.__sorted is None:
+            self.__sorted = array.array("d", sorted(self.values))
+        return self.__sorted
+
+    def min(self):
+        return self.sorted_values()[0] if self.values else None
+
+    def max(self):
+        return self.sorted_values()[-1] if self.values else None
+
+    def mean(self):
+        return math.fsum(self.values) / len(self.values) if self.values else None
+
+    def percentile(self, p):
+        """ Returns the p-th percentile (0 < p <= 100) by the nearest-rank
+            method, i.e. always one of the values.
+        """
+        if not self.values:
+            return None
+        values = self.sorted_values()
+        rank = int(math.ceil(p / 100.0 * len(values)))
+        return values[max(rank, 1) - 1]
+
+    def count_above(self, threshold):
+        """ Returns how many values are strictly greater than `threshold`. """
+        values = self.sorted_values()
+        return len(values) - bisect.bisect_right(values, threshold)
+
+    def top(self, k):
+        """ Returns the indexes (in insertion order) of the `k` largest
+            values, largest first.
+        """
+        return heapq.nlargest(k, range(len(self.values)), key=self.values.__getitem__)
@@ -6,10 +6,11 @@ cd "$(dirname $0)"
 # replays the output captures from this directory when suitable command-line
 # arguments are given.
 
-FILEPATH="recon"
+SERVER_TYPE=""
+CHECKS=()
 VERBOSE=0
 
-# parse args and derive fixture name; e.g. "swift-recon object --replication"
+# parse args and derive fixture names; e.g. "swift-recon object --replication"
 # comes from test/fixtures/recon_object_replication
 for ARG in "$@"; do
     case "${ARG}" in
@@ -17,21 +18,34 @@ for ARG in "$@"; do
             VERBOSE=1
             ;;
         --*)
-            FILEPATH="${FILEPATH}_${ARG#--}"
+            CHECKS+=("${ARG#--}")
             ;;
         *)
-            FILEPATH="${FILEPATH}_${ARG}"
+            SERVER_TYPE="${ARG}"
             ;;
     esac
 done
 
-if [ ! -f "${FILEPATH}" ]; then
-    echo "cannot replay \"swift-recon $@\": capture file \"test/fixtures/${FILEPATH}\" not found" >&2
-    exit 1
-fi
+# when multiple checks are given, replay the captures for each check one after
+# the other; captures without a server type are for the default type "object"
+FILEPATHS=()
+for CHECK in "${CHECKS[@]}"; do
+    FILEPATH="recon_${CHECK}"
+    if [ -n "${SERVER_TYPE}" ]; then
+        FILEPATH="recon_${SERVER_TYPE}_${CHECK}"
+        if [ ! -f "${FILEPATH}" -a "${SERVER_TYPE}" = object ]; then
+            FILEPATH="recon_${CHECK}"
+        fi
+    fi
+    if [ ! -f "${FILEPATH}" ]; then
+        echo "cannot replay \"swift-recon $@\": capture file \"test/fixtures/${FILEPATH}\" not found" >&2
+        exit 1
+    fi
+    FILEPATHS+=("${FILEPATH}")
+done
 
 if [ "${VERBOSE}" -eq 1 ]; then
-    cat "${FILEPATH}"
+    cat "${FILEPATHS[@]}"
 else
-    grep -v '^->' "${FILEPATH}"
+    cat "${FILEPATHS[@]}" | grep -v '^->'
 fi
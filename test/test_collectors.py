@@ -12,11 +12,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from swift_health_statsd.collector  import CollectorConfig
-from swift_health_statsd.recon      import SwiftReconCollector
+from swift_health_statsd.collector  import Collector, CollectorConfig, EmissionCache
+from swift_health_statsd.recon      import SwiftReconCollector, md5_file
 from swift_health_statsd.dispersion import SwiftDispersionCollector
+from swift_health_statsd.ipc        import Process, ProcessRunner, Timeout, iter_lines
+from swift_health_statsd.prometheus import MetricsSnapshot, PrometheusServer
+from swift_health_statsd.stats      import Distribution
+from swift_health_statsd.history    import History, Series
+from swift_health_statsd.ring       import RingIndex, RingIndexCache, shard_of
+from swift_health_statsd.health     import HostHealth, LatencyTracker
+from swift_health_statsd.capture    import CaptureRecorder, CaptureReplay, load_bundle
+from swift_health_statsd.clusters   import ClusterConfigError, parse_clusters
+from swift_health_statsd.pool       import WorkerPool
+from swift_health_statsd.profiling  import Profiler
+from swift_health_statsd.sender     import QueuedStatsClient, TCPTransport, UDPTransport, UnixTransport
+from swift_health_statsd.sampling   import HostSampler, data_change
 
-import re, time
+import ast, functools, glob, gzip, json, logging, os, re, shutil, signal, socket, struct, subprocess, sys, threading, time, timeit
+
+from statsd import StatsClient
+
+import pytest
+
+try:
+    from urllib.request import urlopen
+except ImportError: # Python 2
+    from urllib2 import urlopen
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError: # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
 
 def expected_gauges_dispersion():
     return {
@@ -32,6 +60,35 @@ def expected_gauges_dispersion():
 
 def expected_gauges_recon():
     return {
+        # from test/fixtures/recon_account_auditor
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.1": 207.558781,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.2": 121.879518,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.3": 282.788084,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.4": 43.95778,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.5": 93.355259,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.6": 123.375414,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.7": 140.264346,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.8": 49.708581,
+        "swift_cluster.accounts_auditor_pass_duration.from.10.0.0.9": 90.742109,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.1": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.2": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.3": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.4": 2,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.5": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.6": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.7": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.8": 0,
+        "swift_cluster.accounts_audits_failed.from.10.0.0.9": 0,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.1": 43410,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.2": 30205,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.3": 44820,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.4": 24295,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.5": 4863,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.6": 49389,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.7": 33539,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.8": 37008,
+        "swift_cluster.accounts_audits_passed.from.10.0.0.9": 29214,
+
         # from test/fixtures/recon_account_replication
         "swift_cluster.accounts_replication_age.from.10.0.0.1": 32.4190309047699,
         "swift_cluster.accounts_replication_age.from.10.0.0.2": 30.34965205192566,
@@ -52,6 +109,46 @@ def expected_gauges_recon():
         "swift_cluster.accounts_replication_duration.from.10.0.0.8": 0.4204409122467041,
         "swift_cluster.accounts_replication_duration.from.10.0.0.9": 1.8770229816436768,
 
+        # from test/fixtures/recon_async
+        "swift_cluster.async_pending.from.10.0.0.1": 0,
+        "swift_cluster.async_pending.from.10.0.0.2": 0,
+        "swift_cluster.async_pending.from.10.0.0.3": 3,
+        "swift_cluster.async_pending.from.10.0.0.4": 0,
+        "swift_cluster.async_pending.from.10.0.0.5": 0,
+        "swift_cluster.async_pending.from.10.0.0.6": 12,
+        "swift_cluster.async_pending.from.10.0.0.7": 0,
+        "swift_cluster.async_pending.from.10.0.0.8": 1,
+        "swift_cluster.async_pending.from.10.0.0.9": 0,
+
+        # from test/fixtures/recon_container_auditor
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.1": 77.667464,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.2": 62.879433,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.3": 131.494485,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.4": 102.397388,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.5": 159.492516,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.6": 224.537577,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.7": 236.191152,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.8": 123.789883,
+        "swift_cluster.containers_auditor_pass_duration.from.10.0.0.9": 149.641617,
+        "swift_cluster.containers_audits_failed.from.10.0.0.1": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.2": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.3": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.4": 2,
+        "swift_cluster.containers_audits_failed.from.10.0.0.5": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.6": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.7": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.8": 0,
+        "swift_cluster.containers_audits_failed.from.10.0.0.9": 0,
+        "swift_cluster.containers_audits_passed.from.10.0.0.1": 10915,
+        "swift_cluster.containers_audits_passed.from.10.0.0.2": 32782,
+        "swift_cluster.containers_audits_passed.from.10.0.0.3": 19476,
+        "swift_cluster.containers_audits_passed.from.10.0.0.4": 25199,
+        "swift_cluster.containers_audits_passed.from.10.0.0.5": 9224,
+        "swift_cluster.containers_audits_passed.from.10.0.0.6": 41474,
+        "swift_cluster.containers_audits_passed.from.10.0.0.7": 30926,
+        "swift_cluster.containers_audits_passed.from.10.0.0.8": 45602,
+        "swift_cluster.containers_audits_passed.from.10.0.0.9": 27147,
+
         # from test/fixtures/recon_container_replication
         "swift_cluster.containers_replication_age.from.10.0.0.1": 36.81415796279907,
         "swift_cluster.containers_replication_age.from.10.0.0.2": 37.084654092788696,
@@ -88,6 +185,20 @@ def expected_gauges_recon():
         "swift_cluster.storage_free_bytes": 634467918188544,
         "swift_cluster.storage_used_bytes": 124471551447040,
         "swift_cluster.storage_used_percent": 0.16400721852930755,
+        "swift_cluster.disk_used_percent.min": 0.0021019227144764407,
+        "swift_cluster.disk_used_percent.max": 0.17681494071033643,
+        "swift_cluster.disk_used_percent.mean": 0.15580700217754617,
+        "swift_cluster.disk_used_percent.p50": 0.1639091173415892,
+        "swift_cluster.disk_used_percent.p90": 0.1691927066362435,
+        "swift_cluster.disk_used_percent.p99": 0.17580292311179277,
+        "swift_cluster.disks_used_above.0_8": 0,
+        "swift_cluster.disks_used_above.0_9": 0,
+        "swift_cluster.disks_used_above.0_95": 0,
+        "swift_cluster.disk_used_percent.fullest.10_0_0_8.sdg": 0.17681494071033643,
+        "swift_cluster.disk_used_percent.fullest.10_0_0_3.sdc": 0.17580292311179277,
+        "swift_cluster.disk_used_percent.fullest.10_0_0_1.sdk": 0.17398631734946188,
+        "swift_cluster.disk_used_percent.fullest.10_0_0_9.sdh": 0.1735354693504604,
+        "swift_cluster.disk_used_percent.fullest.10_0_0_9.sdf": 0.17349581985817186,
         "swift_cluster.storage_used_percent.disk.rhelswift.from.10.0.0.1": 0.0036639646368384726,
         "swift_cluster.storage_used_percent.disk.rhelswift.from.10.0.0.2": 0.002902993018119125,
         "swift_cluster.storage_used_percent.disk.rhelswift.from.10.0.0.3": 0.0947263676702022,
@@ -118,6 +229,53 @@ def expected_gauges_recon():
         "swift_cluster.drives_audit_errors.from.10.0.0.8": 0,
         "swift_cluster.drives_audit_errors.from.10.0.0.9": 0,
 
+        # from test/fixtures/recon_loadstats
+        "swift_cluster.load_average.15m.from.10.0.0.1": 2.59,
+        "swift_cluster.load_average.15m.from.10.0.0.2": 0.62,
+        "swift_cluster.load_average.15m.from.10.0.0.3": 1.84,
+        "swift_cluster.load_average.15m.from.10.0.0.4": 5.36,
+        "swift_cluster.load_average.15m.from.10.0.0.5": 4.17,
+        "swift_cluster.load_average.15m.from.10.0.0.6": 6.26,
+        "swift_cluster.load_average.15m.from.10.0.0.7": 2.14,
+        "swift_cluster.load_average.15m.from.10.0.0.8": 3.82,
+        "swift_cluster.load_average.15m.from.10.0.0.9": 3.89,
+        "swift_cluster.load_average.1m.from.10.0.0.1": 3.24,
+        "swift_cluster.load_average.1m.from.10.0.0.2": 0.78,
+        "swift_cluster.load_average.1m.from.10.0.0.3": 2.3,
+        "swift_cluster.load_average.1m.from.10.0.0.4": 6.7,
+        "swift_cluster.load_average.1m.from.10.0.0.5": 5.21,
+        "swift_cluster.load_average.1m.from.10.0.0.6": 7.82,
+        "swift_cluster.load_average.1m.from.10.0.0.7": 2.67,
+        "swift_cluster.load_average.1m.from.10.0.0.8": 4.78,
+        "swift_cluster.load_average.1m.from.10.0.0.9": 4.86,
+        "swift_cluster.load_average.5m.from.10.0.0.1": 2.92,
+        "swift_cluster.load_average.5m.from.10.0.0.2": 0.7,
+        "swift_cluster.load_average.5m.from.10.0.0.3": 2.07,
+        "swift_cluster.load_average.5m.from.10.0.0.4": 6.03,
+        "swift_cluster.load_average.5m.from.10.0.0.5": 4.69,
+        "swift_cluster.load_average.5m.from.10.0.0.6": 7.04,
+        "swift_cluster.load_average.5m.from.10.0.0.7": 2.4,
+        "swift_cluster.load_average.5m.from.10.0.0.8": 4.3,
+        "swift_cluster.load_average.5m.from.10.0.0.9": 4.37,
+        "swift_cluster.tasks_running.from.10.0.0.1": 9,
+        "swift_cluster.tasks_running.from.10.0.0.2": 7,
+        "swift_cluster.tasks_running.from.10.0.0.3": 7,
+        "swift_cluster.tasks_running.from.10.0.0.4": 4,
+        "swift_cluster.tasks_running.from.10.0.0.5": 7,
+        "swift_cluster.tasks_running.from.10.0.0.6": 9,
+        "swift_cluster.tasks_running.from.10.0.0.7": 9,
+        "swift_cluster.tasks_running.from.10.0.0.8": 3,
+        "swift_cluster.tasks_running.from.10.0.0.9": 6,
+        "swift_cluster.tasks_total.from.10.0.0.1": 1454,
+        "swift_cluster.tasks_total.from.10.0.0.2": 1417,
+        "swift_cluster.tasks_total.from.10.0.0.3": 1415,
+        "swift_cluster.tasks_total.from.10.0.0.4": 1561,
+        "swift_cluster.tasks_total.from.10.0.0.5": 1412,
+        "swift_cluster.tasks_total.from.10.0.0.6": 1434,
+        "swift_cluster.tasks_total.from.10.0.0.7": 1430,
+        "swift_cluster.tasks_total.from.10.0.0.8": 1426,
+        "swift_cluster.tasks_total.from.10.0.0.9": 1424,
+
         # from test/fixtures/recon_md5
         "swift_cluster.md5_ring_all": 9,
         "swift_cluster.md5_ring_errors": 0,
@@ -128,6 +286,136 @@ def expected_gauges_recon():
         "swift_cluster.md5_swiftconf_matched": 9,
         "swift_cluster.md5_swiftconf_not_matched": 0,
 
+        # from test/fixtures/recon_object_auditor
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.1": 1086.155591,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.2": 530.796407,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.3": 396.344089,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.4": 2751.02277,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.5": 2359.259185,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.6": 184.042437,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.7": 757.852898,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.8": 345.857611,
+        "swift_cluster.objects_auditor_audit_time.all.from.10.0.0.9": 3190.145325,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.1": 2851.9514,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.2": 2561.917087,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.3": 695.123519,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.4": 857.234072,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.5": 2473.165536,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.6": 2873.893721,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.7": 2710.89418,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.8": 2275.407334,
+        "swift_cluster.objects_auditor_audit_time.zbf.from.10.0.0.9": 3840.2528629999997,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.1": 14110712413,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.2": 84096405361,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.3": 66561631642,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.4": 72975675946,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.5": 88315246274,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.6": 66624602939,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.7": 44794519517,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.8": 16722095673,
+        "swift_cluster.objects_auditor_bytes_processed.all.from.10.0.0.9": 78796939211,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.1": 3635981472,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.2": 67425918935,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.3": 73808375565,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.4": 48962080326,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.5": 27743642469,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.6": 52488231404,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.7": 4609643115,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.8": 57601319807,
+        "swift_cluster.objects_auditor_bytes_processed.zbf.from.10.0.0.9": 166734166546,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.1": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.2": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.3": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.4": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.5": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.6": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.7": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.8": 0,
+        "swift_cluster.objects_auditor_errors.all.from.10.0.0.9": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.1": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.2": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.3": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.4": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.5": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.6": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.7": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.8": 0,
+        "swift_cluster.objects_auditor_errors.zbf.from.10.0.0.9": 0,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.1": 10122,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.2": 200926,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.3": 444558,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.4": 166284,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.5": 126938,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.6": 145882,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.7": 117150,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.8": 486985,
+        "swift_cluster.objects_auditor_passes.all.from.10.0.0.9": 329433,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.1": 46865,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.2": 263668,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.3": 199662,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.4": 414717,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.5": 281391,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.6": 201174,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.7": 261382,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.8": 423734,
+        "swift_cluster.objects_auditor_passes.zbf.from.10.0.0.9": 165310,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.1": 0,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.2": 1,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.3": 0,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.4": 0,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.5": 0,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.6": 0,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.7": 1,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.8": 1,
+        "swift_cluster.objects_auditor_quarantined.all.from.10.0.0.9": 1,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.1": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.2": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.3": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.4": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.5": 1,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.6": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.7": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.8": 0,
+        "swift_cluster.objects_auditor_quarantined.zbf.from.10.0.0.9": 1,
+
+        # from test/fixtures/recon_object_expirer
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.1": 8.859703,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.2": 22.934026,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.3": 7.855007,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.4": 25.04243,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.5": 27.30951,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.6": 26.94135,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.7": 17.542128,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.8": 12.676785,
+        "swift_cluster.objects_expiration_pass_duration.from.10.0.0.9": 4.009821,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.1": 61,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.2": 83,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.3": 107,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.4": 15,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.5": 90,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.6": 169,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.7": 132,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.8": 128,
+        "swift_cluster.objects_expired_last_pass.from.10.0.0.9": 38,
+
+        # from test/fixtures/recon_object_reconstruction
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.1": 403.37641191482544,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.2": 411.865355014801,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.3": 187.06745409965515,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.4": 267.0051939487457,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.6": 383.4775478839874,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.7": 420.9018909931183,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.8": 448.8536970615387,
+        "swift_cluster.objects_reconstruction_age.from.10.0.0.9": 434.65246510505676,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.1": 12.572474,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.2": 1.704228,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.3": 10.849164,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.4": 15.641557,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.6": 1.322878,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.7": 9.317431,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.8": 17.933236,
+        "swift_cluster.objects_reconstruction_duration.from.10.0.0.9": 6.849466,
+
         # from test/fixtures/recon_object_replication
         "swift_cluster.objects_replication_age.from.10.0.0.1": 216.76890206336975,
         "swift_cluster.objects_replication_age.from.10.0.0.2": 222.42571806907654,
@@ -188,6 +476,53 @@ def expected_gauges_recon():
         "swift_cluster.objects_quarantined.from.10.0.0.8": 0,
         "swift_cluster.objects_quarantined.from.10.0.0.9": 0,
 
+        # from test/fixtures/recon_sockstat
+        "swift_cluster.sockstat_orphan.from.10.0.0.1": 3,
+        "swift_cluster.sockstat_orphan.from.10.0.0.2": 1,
+        "swift_cluster.sockstat_orphan.from.10.0.0.3": 0,
+        "swift_cluster.sockstat_orphan.from.10.0.0.4": 2,
+        "swift_cluster.sockstat_orphan.from.10.0.0.5": 0,
+        "swift_cluster.sockstat_orphan.from.10.0.0.6": 2,
+        "swift_cluster.sockstat_orphan.from.10.0.0.7": 0,
+        "swift_cluster.sockstat_orphan.from.10.0.0.8": 2,
+        "swift_cluster.sockstat_orphan.from.10.0.0.9": 3,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.1": 14,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.2": 5,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.3": 9,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.4": 14,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.5": 16,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.6": 15,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.7": 17,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.8": 11,
+        "swift_cluster.sockstat_tcp6_in_use.from.10.0.0.9": 2,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.1": 521,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.2": 506,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.3": 449,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.4": 706,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.5": 823,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.6": 368,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.7": 240,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.8": 521,
+        "swift_cluster.sockstat_tcp_in_use.from.10.0.0.9": 708,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.1": 5320704,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.2": 7069696,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.3": 5226496,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.4": 6524928,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.5": 1396736,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.6": 1683456,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.7": 6819840,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.8": 6238208,
+        "swift_cluster.sockstat_tcp_mem_allocated_bytes.from.10.0.0.9": 983040,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.1": 397,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.2": 185,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.3": 357,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.4": 268,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.5": 147,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.6": 214,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.7": 215,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.8": 293,
+        "swift_cluster.sockstat_time_wait.from.10.0.0.9": 304,
+
         # from test/fixtures/recon_unmounted
         "swift_cluster.drives_unmounted.from.10.0.0.1": 0,
         "swift_cluster.drives_unmounted.from.10.0.0.2": 0,
@@ -206,10 +541,40 @@ class MockStatsClient(object):
     """
     def __init__(self):
         self.gauges = {}
+        self.timings = {}
 
     def gauge(self, metric, value):
         self.gauges[metric] = value
 
+    def timing(self, metric, value):
+        self.timings[metric] = value
+
+    def pipeline(self):
+        return MockPipeline(self)
+
+class MockPipeline(object):
+    """ Drop-in replacement for statsd.Pipeline that forwards all gauge values
+        to a MockStatsClient when it is sent.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.gauges = []
+        self.timings = []
+
+    def gauge(self, metric, value):
+        self.gauges.append((metric, value))
+
+    def timing(self, metric, value):
+        self.timings.append((metric, value))
+
+    def send(self):
+        for metric, value in self.gauges:
+            self.client.gauge(metric, value)
+        for metric, value in self.timings:
+            self.client.timing(metric, value)
+        self.gauges = []
+        self.timings = []
+
 def mock_time(timestamp):
     """ Replaces time.time() with a function that always returns the given
         timestamp.
@@ -221,29 +586,1029 @@ def shared_test_setup():
         recon_path             = "./test/fixtures/recon.sh",
         dispersion_report_path = "./test/fixtures/dispersion.sh",
         add_hostname_suffix    = True,
+        diskusage_per_disk     = True,
     )
     statsd = MockStatsClient()
     mock_time(1484057460)
     return config, statsd
 
+def filter_disk_gauges(gauges):
+    """ You can't believe how many individual diskusage metrics there are. I
+        keep those for disks named rhel-swift and sdb, and remove those for
+        disks named sdc through sdo.
+    """
+    rx = re.compile(r"\.disk\.sd[c-o]\.")
+    return { key: value for key, value in gauges.items() if rx.search(key) is None }
+
+class FakeReconServer(object):
+    """ Stands in for the recon API of the storage nodes 10.0.0.1 through
+        10.0.0.9 from the test/fixtures/recon_* captures, by serving their data
+        as JSON on 127.0.0.1 through 127.0.0.9. The md5 checks are answered
+        with the md5sums of the files in `swift_dir` at the time of the request.
+    """
+
+    def __init__(self, swift_dir):
+        # collect responses from the fixtures, e.g. responses["127.0.0.1"]["/recon/diskusage"]
+        self.responses = {}
+        for path in glob.glob("test/fixtures/recon_*"):
+            with open(path) as f:
+                for line in f:
+                    m = re.match(r'^-> https?://([0-9.]+):\d+(/recon/\S+): (.+)', line)
+                    if m:
+                        host = m.group(1).replace("10.0.0.", "127.0.0.")
+                        self.responses.setdefault(host, {})[m.group(2)] = ast.literal_eval(m.group(3))
+
+        self.swift_dir = swift_dir
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with server.lock:
+                    server.connections += 1
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                host = self.connection.getsockname()[0]
+                body = json.dumps(server.response(host, self.path)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+
+        # keep-alive connections block a handler each, so we need threads
+        class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.servers = [ ThreadingHTTPServer((host, 0), Handler) for host in sorted(self.responses) ]
+        for httpd in self.servers:
+            thread = threading.Thread(target=httpd.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+    def response(self, host, path):
+        if path == "/recon/ringmd5":
+            return {
+                os.path.join("/etc/swift", os.path.basename(ring)): md5_file(ring)
+                for ring in glob.glob(os.path.join(self.swift_dir, "*.ring.gz"))
+            }
+        if path == "/recon/swiftconfmd5":
+            conf = os.path.join(self.swift_dir, "swift.conf")
+            return { "/etc/swift/swift.conf": md5_file(conf) }
+        return self.responses[host][path]
+
+    def hosts(self):
+        return [ httpd.server_address for httpd in self.servers ]
+
+    def shutdown(self):
+        for httpd in self.servers:
+            if httpd.socket.fileno() >= 0:
+                httpd.shutdown()
+                httpd.server_close()
+
+def process_running(pid):
+    """ Returns whether the given process exists and is not a zombie (killed
+        orphans stay zombies in containers whose init does not reap them).
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except IOError:
+        return False
+
+def write_ring(path, hosts, locations=None):
+    """ Writes a minimal ring file (format version 1) containing one device
+        for each of the given (host, port), in the (region, zone) that
+        `locations` gives for the host (or in region 1, zone 1).
+    """
+    locations = locations or {}
+    devs = [ { "id": idx, "ip": host, "port": port, "device": "sdb",
+               "region": locations.get(host, (1, 1))[0], "zone": locations.get(host, (1, 1))[1] }
+             for idx, (host, port) in enumerate(hosts) ]
+    json_text = json.dumps({ "devs": devs, "part_shift": 32, "replica_count": 0 }).encode("ascii")
+    with gzip.open(path, "wb") as f:
+        f.write(b"R1NG" + struct.pack("!H", 1) + struct.pack("!I", len(json_text)) + json_text)
+
 ### unit test entrypoints (found by the "test_" name prefix)
 
 def test_recon():
     config, statsd = shared_test_setup()
     SwiftReconCollector(config).run(statsd)
+    assert filter_disk_gauges(statsd.gauges) == expected_gauges_recon()
 
-    # You can't believe how many individual diskusage metrics there are. I keep
-    # those for disks named rhel-swift and sdb, and remove those for disks
-    # named sdc through sdo.
-    rx = re.compile(r"\.disk\.sd[c-o]\.")
-    gauges = {}
-    for key in statsd.gauges:
-        if rx.search(key) is None:
-            gauges[key] = statsd.gauges[key]
+def test_recon_batched():
+    config, statsd = shared_test_setup()
+    config.recon_batch = True
 
-    assert gauges == expected_gauges_recon()
+    calls = []
+    class CountingReconCollector(SwiftReconCollector):
+        def swift_recon_lines(self, *params, **kwargs):
+            calls.append(params)
+            return SwiftReconCollector.swift_recon_lines(self, *params, **kwargs)
+
+    assert CountingReconCollector(config).run(statsd)
+    assert filter_disk_gauges(statsd.gauges) == expected_gauges_recon()
+    # one call per server type
+    assert sorted(params[1] for params in calls) == ["account", "container", "object"]
+    # ...which also covers the auditor, async, load, sockstat, expirer and
+    # reconstruction checks
+    object_params = [ params for params in calls if params[1] == "object" ][0]
+    assert all(check in object_params for check in ["--async", "--auditor", "--loadstats",
+        "--sockstat", "--expirer", "--reconstruction"])
+
+def test_recon_shared_fetch():
+    config, statsd = shared_test_setup()
+
+    calls = []
+    class CountingReconCollector(SwiftReconCollector):
+        def swift_recon_lines(self, *params, **kwargs):
+            calls.append(params)
+            return SwiftReconCollector.swift_recon_lines(self, *params, **kwargs)
+
+        def collector_steps(self):
+            steps = SwiftReconCollector.collector_steps(self)
+            # a second consumer of the diskusage data
+            steps["diskusage_copy"] = self.step(lambda data: shared.append(data), ("diskusage", None))
+            return steps
+
+    shared = []
+    collector = CountingReconCollector(config)
+    steps = collector.collector_steps()
+    assert steps["unmounted"].queries == (("unmounted", None),)
+    assert steps["diskusage_copy"].queries == steps["diskusage"].queries == (("diskusage", None),)
+
+    assert collector.run(statsd)
+    assert filter_disk_gauges(statsd.gauges) == expected_gauges_recon()
+    # both diskusage consumers share one call
+    checks = [ params[-1] for params in calls ]
+    assert checks.count("--diskusage") == 1
+    assert checks.count("--unmounted") == 1
+    assert len(shared) == 1 and len(shared[0]) == 9
+    assert len(checks) == len(set(params for params in calls))
+
+def test_recon_diskusage_unmounted():
+    config, statsd = shared_test_setup()
+
+    # swift-recon lists unmounted disks with empty sizes, and with the error
+    # message instead of False if the mount check failed
+    usage = { "10.0.0.1": [
+        { "device": "sda", "mounted": True, "avail": 60, "used": 40, "size": 100 },
+        { "device": "sdb", "mounted": False, "avail": "", "used": "", "size": "" },
+        { "device": "sdc", "mounted": "[Errno 5] Input/output error", "avail": "", "used": "", "size": "" },
+    ] }
+    class FakeReconCollector(SwiftReconCollector):
+        def fetch(self, check, server_type=None):
+            return usage
+
+    assert FakeReconCollector(config).run(statsd, steps=["diskusage"])
+    assert statsd.gauges["swift_cluster.storage_used_bytes"] == 40
+    assert statsd.gauges["swift_cluster.storage_capacity_bytes"] == 100
+
+# FakeReconServer needs 127.0.0.2 etc. to be routed to the loopback device
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="needs all of 127.0.0.0/8 on the loopback device")
+def test_recon_http(tmpdir):
+    config, statsd = shared_test_setup()
+    swift_dir = str(tmpdir)
+    with open(os.path.join(swift_dir, "swift.conf"), "w") as f:
+        f.write("[swift-hash]\n")
+    server = FakeReconServer(swift_dir)
+    try:
+        for server_type in ["account", "container", "object"]:
+            write_ring(os.path.join(swift_dir, server_type + ".ring.gz"), server.hosts())
+
+        config.recon_backend = "http"
+        config.swift_dir = swift_dir
+        collector = SwiftReconCollector(config)
+        assert collector.run(statsd)
+
+        expected = { key.replace(".from.10.0.0.", ".from.127.0.0.").replace(".10_0_0_", ".127_0_0_"): value
+                     for key, value in expected_gauges_recon().items() }
+        skipped = { key: statsd.gauges.pop(key) for key in list(statsd.gauges)
+                    if key.startswith("swift_cluster.recon_hosts_skipped.") }
+        assert filter_disk_gauges(statsd.gauges) == expected
+        assert len(skipped) == 19 and set(skipped.values()) == {0}
+
+        # connections are kept alive across requests and across runs, and
+        # never exceed the per-host limit
+        requests = server.requests
+        collector.run(statsd)
+        collector.close()
+        assert server.requests == 2 * requests
+        assert server.connections <= len(server.servers) * config.recon_http_connections_per_host
+
+        # a node that is down is only tried until the first failure, and
+        # skipped by the other steps
+        server.servers[0].shutdown()
+        server.servers[0].server_close()
+        config.max_workers = 1
+        statsd = MockStatsClient()
+        collector = SwiftReconCollector(config)
+        collector.run(statsd)
+        collector.close()
+        skipped = sum(value for key, value in statsd.gauges.items()
+                      if key.startswith("swift_cluster.recon_hosts_skipped."))
+        assert skipped == 18
+        assert statsd.gauges["swift_cluster.md5_ring_errors"] == 1
+        assert not any(key.endswith(".from.127.0.0.1") for key in statsd.gauges)
+    finally:
+        server.shutdown()
+
+def test_ring_rollups(tmpdir):
+    config, statsd = shared_test_setup()
+    swift_dir = str(tmpdir)
+    hosts = [ ("10.0.0.{}".format(idx), 6000) for idx in range(1, 10) ]
+    # three nodes each in r1z1, r1z2 and r2z1
+    locations = { host: (1 + idx // 6, 1 + (idx // 3) % 2) for idx, (host, _) in enumerate(hosts) }
+    for server_type in ["account", "container", "object"]:
+        write_ring(os.path.join(swift_dir, server_type + ".ring.gz"), hosts, locations)
+    config.swift_dir = swift_dir
+    config.ring_rollups = True
+    collector = SwiftReconCollector(config)
+    assert collector.run(statsd)
+
+    expected = expected_gauges_recon()
+    def per_host(metric, zone_hosts):
+        return [ expected["swift_cluster.{}.from.10.0.0.{}".format(metric, idx)] for idx in zone_hosts ]
+    zones = { "r1z1": [1, 2, 3], "r1z2": [4, 5, 6], "r2z1": [7, 8, 9] }
+    for zone, zone_hosts in zones.items():
+        prefix = "swift_cluster.{{}}.by_zone.{}".format(zone)
+        assert statsd.gauges[prefix.format("drives_unmounted")] == sum(per_host("drives_unmounted", zone_hosts))
+        assert statsd.gauges[prefix.format("drives_audit_errors")] == sum(per_host("drives_audit_errors", zone_hosts))
+        assert statsd.gauges[prefix.format("objects_replication_age")] == max(per_host("objects_replication_age", zone_hosts))
+    assert statsd.gauges["swift_cluster.drives_unmounted.by_region.r2"] == 1
+    for metric in ["storage_capacity_bytes", "storage_used_bytes"]:
+        by_zone = sum(statsd.gauges["swift_cluster.{}.by_zone.{}".format(metric, zone)] for zone in zones)
+        by_region = sum(statsd.gauges["swift_cluster.{}.by_region.r{}".format(metric, region)] for region in [1, 2])
+        assert by_zone == by_region == expected["swift_cluster." + metric]
+
+    # the index is only rebuilt when a ring file changes
+    cache = RingIndexCache(swift_dir)
+    index = cache.get()
+    assert index.hosts("object") == hosts
+    assert cache.get() is index and cache.builds == 1
+    ring = os.path.join(swift_dir, "object.ring.gz")
+    os.utime(ring, (time.time(), os.stat(ring).st_mtime + 10))
+    assert cache.get() is not index and cache.builds == 2
+
+    # devices may be in another zone than most of their node
+    index = RingIndex({ "object": [
+        { "ip": "10.0.0.1", "port": 6000, "device": "sdb", "region": 1, "zone": 1 },
+        { "ip": "10.0.0.1", "port": 6000, "device": "sdc", "region": 1, "zone": 1 },
+        { "ip": "10.0.0.1", "port": 6000, "device": "sdd", "region": 1, "zone": 2 },
+    ] })
+    assert index.location("10.0.0.1") == index.location("10.0.0.1", "sdx") == (1, 1)
+    assert index.location("10.0.0.1", "sdd") == (1, 2)
+    assert index.location("10.0.0.2") is None
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="needs all of 127.0.0.0/8 on the loopback device")
+def test_recon_host_sampling(tmpdir):
+    config, statsd = shared_test_setup()
+    swift_dir = str(tmpdir)
+    server = FakeReconServer(swift_dir)
+    requests = []
+    response = server.response
+    def counting_response(host, path):
+        requests.append(path)
+        return response(host, path)
+    server.response = counting_response
+    try:
+        for server_type in ["account", "container", "object"]:
+            write_ring(os.path.join(swift_dir, server_type + ".ring.gz"), server.hosts())
+        config.recon_backend = "http"
+        config.swift_dir = swift_dir
+        config.recon_host_budget = 4
+        config.recon_sampled_checks = set(["diskusage"])
+        collector = SwiftReconCollector(config)
+
+        # each run polls 4 of the 9 nodes, so after 3 runs, all nodes are known
+        for _ in range(3):
+            del requests[:]
+            collector.run(statsd, ["diskusage", "driveaudit"])
+            assert requests.count("/recon/diskusage") == 4
+            assert requests.count("/recon/driveaudit") == 9
+        collector.close()
+        for key in ["storage_capacity_bytes", "storage_used_bytes", "disk_used_percent.p50"]:
+            assert statsd.gauges["swift_cluster." + key] == expected_gauges_recon()["swift_cluster." + key]
+        ages = { key: value for key, value in statsd.gauges.items()
+                 if key.startswith("swift_cluster.recon_data_age_seconds.diskusage.from.") }
+        assert len(ages) == 9
+    finally:
+        server.shutdown()
+
+def test_host_sampler():
+    assert data_change({ "a": [1, 2.0], "b": True }, { "a": [1, 2.0], "b": True }) == 0
+    assert data_change({ "a": [1, 2.0] }, { "a": [1, 2.5] }) == 0.2
+    assert data_change({ "a": [1, 2] }, { "a": [1] }) == data_change({ "a": 1 }, { "b": 1 }) == 1
+
+    hosts = [ ("host{}".format(idx), 6000) for idx in range(6) ]
+    data = lambda value: { host: { "value": value } for host, _ in hosts }
+    sampler = HostSampler(budget=2)
+    # round-robin while nothing changes
+    polled = []
+    for _ in range(3):
+        selected = sampler.select(hosts)
+        sampler.update(selected, data(1))
+        polled.extend(selected)
+    assert polled == hosts
+    assert sampler.known(hosts) == { host: ({ "value": 1 }, time.time()) for host, _ in hosts }
+
+    # a node whose data changed or that failed comes around sooner
+    selected = sampler.select(hosts)
+    assert selected == hosts[:2]
+    sampler.update(selected, { "host0": { "value": 4 } })
+    assert sampler.select(hosts) == [hosts[1], hosts[0]]
+
+    # data older than max_age is dropped
+    sampler = HostSampler(budget=2, max_age=60)
+    mock_time(1484057460)
+    sampler.update(hosts[:2], data(1))
+    mock_time(1484057490)
+    sampler.update(hosts[1:2], data(2))
+    mock_time(1484057530)
+    assert sampler.known(hosts) == { "host1": ({ "value": 2 }, 1484057490) }
 
 def test_dispersion():
     config, statsd = shared_test_setup()
     SwiftDispersionCollector(config).run(statsd)
     assert statsd.gauges == expected_gauges_dispersion()
+
+def test_concurrent_steps():
+    config, statsd = shared_test_setup()
+    config.max_workers = 2
+
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    class DummyCollector(Collector):
+        def metric_name_prefix(self):
+            return "dummy"
+        def logger(self):
+            return logging.getLogger(__name__)
+        def collector_steps(self):
+            steps = { "broken": self.broken, "unset": self.unset }
+            for idx in range(4):
+                steps["step{}".format(idx)] = functools.partial(self.step, idx)
+            return steps
+        def step(self, idx):
+            with lock:
+                running.append(idx)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(idx)
+            self.submit("step{}".format(idx), idx)
+        def broken(self):
+            raise ValueError("step failed")
+        def unset(self):
+            self.submit("unset", None)
+
+    # the failing step and the skipped metric must both fail the run, but
+    # all other steps still submit their metrics
+    assert not DummyCollector(config).run(statsd)
+    assert statsd.gauges == { "dummy.step{}".format(idx): idx for idx in range(4) }
+    assert max(peak) == 2
+
+def test_iter_lines():
+    # lines arrive while the command is still running
+    lines = iter_lines("echo first; sleep 0.5; echo second", timeout=5)
+    start = timeit.default_timer()
+    assert next(lines) == "first"
+    assert timeit.default_timer() - start < 0.4
+    assert list(lines) == ["second"]
+
+    # the timeout also terminates the processes started by the command
+    lines = iter_lines("sleep 5 & echo $!; sleep 5", timeout=0.2)
+    start = timeit.default_timer()
+    pid = int(next(lines))
+    with pytest.raises(Timeout):
+        list(lines)
+    assert timeit.default_timer() - start < 1
+    time.sleep(0.1)
+    assert not process_running(pid)
+    with pytest.raises(subprocess.CalledProcessError):
+        list(iter_lines("echo first; exit 3"))
+
+def test_process_runner():
+    runner = ProcessRunner(kill_grace=0.2)
+    processes = [ runner.start("echo {0}; sleep 0.{0}; printf last".format(idx), timeout=5)
+                  for idx in range(1, 4) ]
+    processes.append(runner.start("exit 3"))
+    # commands that ignore SIGTERM are killed after the grace period
+    processes.append(runner.start("trap '' TERM; sleep 5", timeout=0.1))
+
+    for idx, process in enumerate(processes[:3]):
+        assert list(process.lines()) == ["{}\n".format(idx + 1), "last"]
+        result = process.wait()
+        assert result.returncode == 0 and not result.timed_out
+        assert result.duration >= 0.1 * (idx + 1)
+    assert processes[3].wait().returncode == 3
+    result = processes[4].wait()
+    assert result.timed_out and result.returncode == -signal.SIGKILL
+    assert result.duration < 1
+    with pytest.raises(Timeout):
+        result.check()
+
+    # a cancelled command is terminated right away
+    process = runner.start("sleep 5")
+    process.cancel()
+    result = process.wait()
+    assert result.cancelled and result.returncode == -signal.SIGTERM
+    assert result.duration < 1
+
+def test_process_runner_backpressure():
+    runner = ProcessRunner(kill_grace=0.2, max_buffered_lines=100)
+    # the output is not read any further while the reader is behind...
+    process = runner.start("seq 1 200000")
+    lines = process.lines()
+    assert next(lines) == "1\n"
+    time.sleep(0.3)
+    assert process.paused and process.buffered() < 200000
+    assert process.result is None
+    # ...but once it catches up, everything arrives
+    assert sum(1 for _ in lines) == 199999
+    assert process.wait().returncode == 0
+
+    # a paused command can still be cancelled
+    process = runner.start("seq 1 200000; sleep 5")
+    time.sleep(0.3)
+    assert process.paused
+    result = process.finish()
+    assert result.cancelled and result.duration < 1
+
+def test_process_runner_failure(monkeypatch):
+    # when the supervisor thread fails, the waiters get its error instead of
+    # waiting forever
+    runner = ProcessRunner()
+    def broken_feed(self, data):
+        raise RuntimeError("broken")
+    monkeypatch.setattr(Process, "feed", broken_feed)
+    process = runner.start("echo hello; sleep 5")
+    with pytest.raises(RuntimeError):
+        list(process.lines())
+    with pytest.raises(RuntimeError):
+        process.wait()
+    monkeypatch.undo()
+    # the next command gets a new supervisor thread
+    assert list(runner.start("echo again").lines()) == ["again\n"]
+
+def test_packet_coalescing():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.setblocking(False)
+    statsd = StatsClient(*listener.getsockname(), maxudpsize=100)
+
+    packets = []
+    def receive_packets():
+        """ Collects all packets received so far. Returns how many there were. """
+        count = len(packets)
+        while True:
+            try:
+                packets.append(listener.recv(65536).decode("ascii"))
+            except socket.error:
+                return len(packets) - count
+
+    class ManyMetricsCollector(Collector):
+        def metric_name_prefix(self):
+            return "many"
+        def logger(self):
+            return logging.getLogger(__name__)
+        def collector_steps(self):
+            return { "first": self.step, "second": self.step }
+        def step(self):
+            receive_packets()
+            for idx in range(20):
+                self.submit("metric{}".format(idx), idx)
+            # nothing is sent before the end of the step
+            time.sleep(0.05)
+            assert receive_packets() == 0
+
+    config = CollectorConfig(max_workers=1)
+    assert ManyMetricsCollector(config).run(statsd)
+    time.sleep(0.05)
+    receive_packets()
+    listener.close()
+
+    assert all(len(packet) < 100 for packet in packets)
+    lines = [ line for packet in packets for line in packet.split("\n") ]
+    assert len(lines) == 40
+    assert sorted(set(lines)) == sorted("many.metric{}:{}|g".format(idx, idx) for idx in range(20))
+    # each packet contains several metrics
+    assert len(packets) < 15
+
+class StreamListener(object):
+    """ Accepts connections on a listening stream socket, and collects the
+        lines received on all of them.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.lines = []
+        self.connections = 0
+        thread = threading.Thread(target=self.accept)
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self.receive, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def receive(self, conn):
+        data = b""
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        conn.close()
+        self.lines.extend(data.decode("ascii").splitlines())
+
+def test_queued_sender(tmpdir):
+    # UDP: metrics from pipelines are packed into packets
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.settimeout(1)
+    statsd = QueuedStatsClient(UDPTransport(*listener.getsockname()), max_packet_size=100)
+    pipeline = statsd.pipeline()
+    for idx in range(20):
+        pipeline.gauge("metric{}".format(idx), idx)
+    pipeline.gauge("negative", -1.5)
+    pipeline.timing("duration", 12.5)
+    assert statsd.sender_stats()["metrics_queued"] == 0
+    pipeline.send()
+    assert statsd.flush(5)
+    statsd.close()
+    packets = [ listener.recv(65536).decode("ascii") for _ in range(statsd.packets_sent) ]
+    listener.close()
+    assert all(len(packet) < 100 for packet in packets) and len(packets) < 10
+    lines = [ line for packet in packets for line in packet.split("\n") ]
+    assert lines == [ "metric{}:{}|g".format(idx, idx) for idx in range(20) ] + \
+        [ "negative:0|g", "negative:-1.5|g", "duration:12.500000|ms" ]
+
+    # TCP: metrics wait in the queue until the receiver is reachable, and
+    # the connection is reopened when it breaks
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    address = listener.getsockname()
+    listener.close()
+    statsd = QueuedStatsClient(TCPTransport(*address))
+    statsd.gauge("early", 1)
+    time.sleep(0.2)
+    assert statsd.sender_stats()["send_errors"] > 0
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(address)
+    listener.listen(5)
+    receiver = StreamListener(listener)
+    assert statsd.flush(5)
+    statsd.transport.sock.shutdown(socket.SHUT_RDWR) # break the connection
+    statsd.gauge("late", 2)
+    statsd.close()
+    listener.close()
+    time.sleep(0.1)
+    assert statsd.dropped == 0
+    assert receiver.lines[0] == "early:1|g"
+    assert "late:2|g" in receiver.lines and receiver.connections == 2
+
+    # Unix socket, with pacing
+    path = str(tmpdir.join("statsd.sock"))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(5)
+    receiver = StreamListener(listener)
+    statsd = QueuedStatsClient(UnixTransport(path), max_packet_size=10, rate=20)
+    start = timeit.default_timer()
+    for idx in range(5):
+        statsd.gauge("m{}".format(idx), idx)
+    statsd.close()
+    assert timeit.default_timer() - start >= 0.2
+    time.sleep(0.1)
+    listener.close()
+    assert receiver.lines == [ "m{}:{}|g".format(idx, idx) for idx in range(5) ]
+    assert statsd.packets_sent == 5
+
+    # metrics that do not fit into the queue or are not sent before closing
+    # are dropped
+    statsd = QueuedStatsClient(UnixTransport(str(tmpdir.join("missing.sock"))), max_queue=5)
+    for idx in range(10):
+        statsd.gauge("m{}".format(idx), idx)
+    assert statsd.sender_stats()["metrics_dropped"] >= 5
+    statsd.close(timeout=0.2)
+    assert statsd.sender_stats() == { "metrics_dropped": 10, "metrics_queued": 0,
+                                      "packets_sent": 0, "send_errors": statsd.send_errors }
+
+def test_emission_cache():
+    config, statsd = shared_test_setup()
+    config.emission_cache = EmissionCache(tolerance=0.01, refresh_cycles=3)
+    collector = SwiftReconCollector(config)
+
+    # the first run sends everything
+    assert collector.run(statsd)
+    assert filter_disk_gauges(statsd.gauges) == expected_gauges_recon()
+
+    # the second run does not send anything since nothing changed (not even
+    # the replication and reconstruction ages, since time.time() is mocked)...
+    statsd.gauges = {}
+    mock_time(1484057460.05)  # ...or only by less than the tolerance
+    assert collector.run(statsd)
+    assert statsd.gauges == {}
+
+    # values that changed by more than the tolerance are sent
+    mock_time(1484057560)
+    assert collector.run(statsd)
+    changed = set(statsd.gauges)
+    assert sorted(set(re.sub(r"\.from\..*", "", key) for key in changed)) == [
+        "swift_cluster.accounts_replication_age",
+        "swift_cluster.containers_replication_age",
+        "swift_cluster.objects_reconstruction_age",
+        "swift_cluster.objects_replication_age",
+    ]
+
+    # every value is sent anyway after it was withheld twice in a row, i.e.
+    # all except those that were sent in the previous run
+    statsd.gauges = {}
+    assert collector.run(statsd)
+    assert not changed & set(statsd.gauges)
+    assert len(statsd.gauges) + len(changed) > len(expected_gauges_recon())
+
+def test_emission_cache_per_metric():
+    cache = EmissionCache(refresh_cycles=3, refresh_interval=60)
+    # a metric that is submitted more often than others is refreshed on its
+    # own schedule
+    assert [ cache.should_send("fast", 1) for _ in range(7) ] == \
+        [True, False, False, True, False, False, True]
+    assert [ cache.should_send("slow", 1) for _ in range(2) ] == [True, False]
+    # or when it was last sent too long ago
+    cache = EmissionCache(refresh_interval=0)
+    assert cache.should_send("metric", 1) and cache.should_send("metric", 1)
+
+def test_self_metrics():
+    config, statsd = shared_test_setup()
+    config.self_metrics_prefix = "self"
+    assert SwiftReconCollector(config).run(statsd)
+
+    prefix = "self.swift_cluster."
+    own = { key[len(prefix):]: value for key, value in statsd.gauges.items() if key.startswith(prefix) }
+    metrics = [ key for key in statsd.gauges if not key.startswith(prefix) ]
+    assert filter_disk_gauges({ key: statsd.gauges[key] for key in metrics }) == expected_gauges_recon()
+
+    assert own["metrics_submitted"] == len(metrics)
+    assert own["metrics_skipped"] == own["steps_failed"] == 0
+    assert own["step.driveaudit.hosts"] == own["step.driveaudit.lines_parsed"] == 9
+    assert own["step.driveaudit.metrics_submitted"] == 9
+    assert own["step.md5.metrics_submitted"] == 8
+    assert own["step.diskusage.output_bytes"] == os.path.getsize("test/fixtures/recon_diskusage")
+    assert sum(value for key, value in own.items() if key.endswith(".parse_failures")) == 0
+
+    assert statsd.timings[prefix + "run_duration"] > 0
+    assert 0 < statsd.timings[prefix + "step.driveaudit.subprocess_time"] \
+             <= statsd.timings[prefix + "step.driveaudit.wall_time"]
+
+def test_prometheus_snapshot():
+    config, statsd = shared_test_setup()
+    config.metrics_snapshot = MetricsSnapshot()
+    server = PrometheusServer(config.metrics_snapshot, address="127.0.0.1", port=0)
+    server.start()
+    url = "http://127.0.0.1:{}/metrics".format(server.httpd.server_address[1])
+    try:
+        assert urlopen(url).read() == b""
+
+        assert SwiftReconCollector(config).run(statsd)
+        assert SwiftDispersionCollector(config).run(statsd)
+        text = urlopen(url).read().decode("utf-8")
+    finally:
+        server.shutdown()
+
+    lines = text.splitlines()
+    assert 'swift_cluster_replication_age{host="10.0.0.1",server_type="account"} 32.4190309047699' in lines
+    assert 'swift_cluster_disk_used_percent{disk="sdb",host="10.0.0.1"} 0.16902825113072267' in lines
+    assert 'swift_cluster_drives_unmounted{host="10.0.0.7"} 1' in lines
+    assert 'swift_dispersion_copies_found{server_type="object"} 1965' in lines
+    assert "# TYPE swift_cluster_storage_used_bytes gauge" in lines
+    # one sample for each statsd metric
+    samples = [ line for line in lines if not line.startswith("#") ]
+    assert len(samples) == len(statsd.gauges)
+
+    # a failed step keeps the values from its last complete run
+    config.recon_path = "false"
+    SwiftReconCollector(config).run(statsd, ["driveaudit"])
+    assert config.metrics_snapshot.render().decode("utf-8") == text
+
+def test_diskusage_summary():
+    config, statsd = shared_test_setup()
+    SwiftReconCollector(config).run(statsd, ["diskusage"])
+    per_disk = { key: value for key, value in statsd.gauges.items() if ".disk." in key }
+    assert len(per_disk) == 135
+
+    # without per-disk metrics, only the summary is sent
+    config.diskusage_per_disk = False
+    config.diskusage_thresholds = [0.17, 0.175]
+    config.diskusage_top_k = 2
+    statsd = MockStatsClient()
+    SwiftReconCollector(config).run(statsd, ["diskusage"])
+    assert not any(".disk." in key for key in statsd.gauges)
+    values = sorted(per_disk.values())
+    assert statsd.gauges["swift_cluster.disk_used_percent.min"] == values[0]
+    assert statsd.gauges["swift_cluster.disk_used_percent.max"] == values[-1]
+    assert statsd.gauges["swift_cluster.disk_used_percent.p50"] == values[67]
+    assert statsd.gauges["swift_cluster.disks_used_above.0_17"] == len([ v for v in values if v > 0.17 ])
+    assert statsd.gauges["swift_cluster.disks_used_above.0_175"] == 2
+    assert sorted(key for key in statsd.gauges if ".fullest." in key) == [
+        "swift_cluster.disk_used_percent.fullest.10_0_0_3.sdc",
+        "swift_cluster.disk_used_percent.fullest.10_0_0_8.sdg",
+    ]
+
+def test_distribution():
+    dist = Distribution()
+    assert dist.min() is None and dist.percentile(50) is None
+    for value in [5, 1, 4, 2, 3, 10, 9, 8, 7, 6]:
+        dist.add(value)
+    assert (dist.min(), dist.max(), dist.mean()) == (1, 10, 5.5)
+    assert [ dist.percentile(p) for p in (1, 10, 50, 90, 99, 100) ] == [1, 1, 5, 9, 10, 10]
+    assert dist.count_above(7) == 3
+    assert dist.count_above(7.5) == 3
+    assert [ dist.values[idx] for idx in dist.top(3) ] == [10, 9, 8]
+
+def test_dispersion_cache(tmpdir):
+    config, statsd = shared_test_setup()
+    config.dispersion_cache_path = str(tmpdir.join("dispersion.json"))
+    config.dispersion_cache_ttl = 60
+    expected = expected_gauges_dispersion()
+
+    # without a cache file, the first run waits for the report
+    collector = SwiftDispersionCollector(config)
+    assert collector.run(statsd)
+    assert statsd.gauges == dict(expected, **{ "swift_dispersion.result_age": 0 })
+
+    # within the TTL, the report is not run at all
+    config.dispersion_report_path = "false"
+    mock_time(1484057490)
+    assert collector.run(statsd)
+    assert statsd.gauges == dict(expected, **{ "swift_dispersion.result_age": 30 })
+
+    # when the cache is stale, the cached result is sent, and the report
+    # runs in the background
+    config.dispersion_report_path = "sleep 0.5; ./test/fixtures/dispersion.sh"
+    mock_time(1484057560)
+    start = timeit.default_timer()
+    assert collector.run(statsd)
+    assert timeit.default_timer() - start < 0.4
+    assert statsd.gauges == dict(expected, **{ "swift_dispersion.result_age": 100 })
+    collector.close()
+    with open(config.dispersion_cache_path) as f:
+        assert json.load(f)["timestamp"] == 1484057560
+
+def test_history_series():
+    series = Series(4)
+    assert series.slope() is None and series.time_to_reach(100) is None
+    for t in range(10):
+        series.add(1000 + 10 * t, 2 * t)
+    # only the last 4 samples are kept
+    assert series.samples() == [(1060, 12), (1070, 14), (1080, 16), (1090, 18)]
+    assert abs(series.slope() - 0.2) < 1e-9
+    assert abs(series.time_to_reach(28) - 50) < 1e-6
+    assert series.time_to_reach(10) == 0
+    # a sample for the same time replaces the last one
+    series.add(1090, 20)
+    assert series.last() == 20 and series.count == 4
+
+def test_history(tmpdir):
+    config, statsd = shared_test_setup()
+    path = str(tmpdir.join("history"))
+    config.history = History(12, path=path)
+    steps = ["diskusage", "quarantined", "account_replication"]
+
+    # the first run has nothing to derive rates from
+    assert SwiftReconCollector(config).run(statsd, steps)
+    assert not any(key.endswith(("_per_second", "_trend", "_to_full_seconds")) for key in statsd.gauges)
+    config.history.save()
+
+    # the second run (in a new process, so to speak) does
+    config.history = History(6, path=path)
+    config.history.load()
+    assert len(config.history) > 0
+    mock_time(1484057560)
+    statsd = MockStatsClient()
+    assert SwiftReconCollector(config).run(statsd, steps)
+    assert statsd.gauges["swift_cluster.storage_used_bytes_per_second"] == 0
+    assert statsd.gauges["swift_cluster.objects_quarantined_per_second.from.10.0.0.1"] == 0
+    # the replication has not finished since the last run, so its age grows
+    # by one second per second
+    assert abs(statsd.gauges["swift_cluster.accounts_replication_age_trend.from.10.0.0.1"] - 1) < 1e-9
+    # the cluster is not filling up
+    assert "swift_cluster.storage_time_to_full_seconds" not in statsd.gauges
+
+def test_history_time_to_full():
+    config, statsd = shared_test_setup()
+    config.history = History(12)
+    config.add_hostname_suffix = False
+
+    # one node fills up by 10 bytes per 100 seconds, the other one has no
+    # mounted disks
+    usage = {}
+    class FakeReconCollector(SwiftReconCollector):
+        def fetch(self, check, server_type=None):
+            return usage
+
+    for t, used in ((1484057460, 40), (1484057560, 50)):
+        mock_time(t)
+        usage = {
+            "10.0.0.1": [ { "device": "sda", "mounted": True, "avail": 100 - used, "used": used, "size": 100 } ],
+            "10.0.0.2": [ { "device": "sda", "mounted": False, "avail": "", "used": "", "size": "" } ],
+        }
+        statsd = MockStatsClient()
+        assert FakeReconCollector(config).run(statsd, steps=["diskusage"])
+
+    # without the hostname suffix, the per-node value does not clobber the
+    # cluster value (even though the empty node would be "full" right away)
+    assert abs(statsd.gauges["swift_cluster.storage_time_to_full_seconds"] - 500) < 1e-6
+    assert abs(statsd.gauges["swift_cluster.storage_node_time_to_full_seconds"] - 500) < 1e-6
+
+def test_sharding():
+    config, statsd = shared_test_setup()
+    SwiftReconCollector(config).run(statsd)
+    SwiftDispersionCollector(config).run(statsd)
+    expected = statsd.gauges
+
+    # each metric is sent by exactly one shard
+    config.shard_count = 3
+    merged = {}
+    for idx in range(3):
+        config.shard_index = idx
+        statsd = MockStatsClient()
+        assert SwiftReconCollector(config).run(statsd)
+        assert SwiftDispersionCollector(config).run(statsd)
+        assert not set(merged) & set(statsd.gauges)
+        merged.update(statsd.gauges)
+        if idx > 0:
+            assert "swift_cluster.storage_capacity_bytes" not in statsd.gauges
+            assert not any(key.startswith("swift_dispersion.") for key in statsd.gauges)
+    assert merged == expected
+
+def test_clusters():
+    config, statsd = shared_test_setup()
+    config.metrics_snapshot = MetricsSnapshot()
+    class TrackingSlots(object):
+        """ A semaphore with one slot that remembers the most steps running at once. """
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.running = self.max_running = 0
+        def __enter__(self):
+            self.lock.acquire()
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        def __exit__(self, *args):
+            self.running -= 1
+            self.lock.release()
+    config.step_slots = TrackingSlots()
+    clusters = parse_clusters({ "clusters": [
+        { "name": "eu-de-1" },
+        { "name": "eu-de-2", "metric_prefix": "second", "swift_recon": "./test/fixtures/recon.sh -v" },
+    ] }, config)
+    assert [ cluster.config.metric_prefix for cluster in clusters ] == ["eu_de_1", "second"]
+    assert clusters[1].config.recon_path == "./test/fixtures/recon.sh -v"
+    assert config.metric_prefix is None and config.recon_path == "./test/fixtures/recon.sh"
+
+    # all clusters share the step slots, so no two steps run at once
+    pool = WorkerPool(len(clusters))
+    assert all(pool.map(lambda cluster: SwiftReconCollector(cluster.config).run(statsd), clusters))
+    assert config.step_slots.max_running == 1
+
+    expected = filter_disk_gauges(expected_gauges_recon())
+    for prefix in ["eu_de_1.", "second."]:
+        gauges = { key[len(prefix):]: value for key, value in statsd.gauges.items() if key.startswith(prefix) }
+        assert filter_disk_gauges(gauges) == expected
+    lines = config.metrics_snapshot.render().decode("utf-8").splitlines()
+    assert 'swift_cluster_drives_unmounted{cluster="eu-de-2",host="10.0.0.7"} 1' in lines
+
+    for data in [ {}, { "clusters": [{ "swift_recon": "x" }] },
+                  { "clusters": [{ "name": "a" }, { "name": "b", "metric_prefix": "a" }] },
+                  { "clusters": [{ "name": "a", "swift_dirr": "/etc/swift" }] },
+                  { "clusters": [{ "name": "a", "swift_dir": 42 }] } ]:
+        with pytest.raises(ClusterConfigError):
+            parse_clusters(data, config)
+
+def test_profiling(tmpdir):
+    config, statsd = shared_test_setup()
+    config.profiler = Profiler(str(tmpdir.join("profiles")), every=2, top=5)
+
+    # only every second run is profiled
+    collector = SwiftReconCollector(config)
+    for _ in range(3):
+        assert collector.run(statsd)
+        assert filter_disk_gauges(statsd.gauges) == expected_gauges_recon()
+    files = sorted(os.listdir(str(tmpdir.join("profiles"))))
+    steps = collector.collector_steps()
+    assert len(files) == 2 * 2 * len(steps)
+    assert all(re.match(r"^\d{8}T\d{6}\.swift_cluster\.run[02]\.\w+\.(prof|txt)$", name) for name in files)
+
+    with open(str(tmpdir.join("profiles", files[1]))) as f:
+        report = f.read()
+    assert "# top 5 functions by own time" in report
+    if sys.version_info[0] >= 3:
+        assert "peak traced memory" in report
+
+def test_capture_replay(tmpdir):
+    config, statsd = shared_test_setup()
+    # record from a copy of the fixtures, which is gone when replaying
+    fixtures = str(tmpdir.join("fixtures"))
+    shutil.copytree("test/fixtures", fixtures)
+    config.recon_path = os.path.join(fixtures, "recon.sh")
+    config.dispersion_report_path = os.path.join(fixtures, "dispersion.sh")
+    config.recon_batch = True
+    config.capture_recorder = CaptureRecorder(str(tmpdir.join("captures")))
+    assert SwiftReconCollector(config).run(statsd)
+    assert SwiftDispersionCollector(config).run(statsd)
+    shutil.rmtree(fixtures)
+
+    paths = sorted(glob.glob(str(tmpdir.join("captures", "*.capture.json.gz"))))
+    assert [ os.path.basename(path).split(".")[1] for path in paths ] == ["swift_cluster", "swift_dispersion"]
+    bundle = load_bundle(paths[0])
+    assert bundle["settings"]["recon_batch"] is True
+    # one batched call per server type, with its latency
+    assert len(bundle["commands"]) == 3
+    assert all(entry["returncode"] == 0 and entry["duration"] > 0 for entry in bundle["commands"])
+
+    config.capture_recorder = None
+    config.capture_replay = CaptureReplay.load(paths)
+    statsd = MockStatsClient()
+    assert SwiftReconCollector(config).run(statsd)
+    assert filter_disk_gauges(statsd.gauges) == expected_gauges_recon()
+    statsd = MockStatsClient()
+    assert SwiftDispersionCollector(config).run(statsd)
+    assert statsd.gauges == expected_gauges_dispersion()
+
+    # commands that were not recorded fail
+    config.recon_batch = False
+    assert not SwiftReconCollector(config).run(MockStatsClient(), ["driveaudit"])
+
+    # at recorded speed, each command takes as long as it did (here: divided
+    # by 2), and failures are replayed, too
+    entry = { "command": "swift-recon -v --driveaudit", "started": 0, "duration": 0.4,
+              "returncode": 1, "timed_out": False, "cancelled": False, "output": "" }
+    config.capture_replay = CaptureReplay([{ "collector": "swift_cluster", "commands": [entry] }], speed=2)
+    config.recon_path = "swift-recon"
+    start = timeit.default_timer()
+    assert not SwiftReconCollector(config).run(MockStatsClient(), ["driveaudit"])
+    assert timeit.default_timer() - start >= 0.2
+
+def test_shard_of():
+    hosts = [ "10.0.{}.{}".format(idx // 256, idx % 256) for idx in range(1000) ]
+    shards = { host: shard_of(host, 4) for host in hosts }
+    counts = [ list(shards.values()).count(idx) for idx in range(4) ]
+    assert min(counts) > 200
+    # adding a shard only moves hosts to the new shard
+    for host in hosts:
+        assert shard_of(host, 5) in (shards[host], 4)
+
+def test_host_health():
+    health = HostHealth(cooloff=0.2, probe_timeout=0.1)
+    assert health.check("a") == HostHealth.OK
+    health.record_success("a", 0.01)
+    health.record_failure("b")
+    assert health.check("a") == HostHealth.OK
+    assert health.check("b") == HostHealth.SKIP
+    assert health.unhealthy_hosts() == ["b"]
+
+    # after the cool-off, one request probes the host...
+    time.sleep(0.25)
+    assert health.check("b") == HostHealth.PROBE
+    assert health.check("b") == HostHealth.SKIP
+    # ...and if that fails, the host is skipped for twice as long
+    health.record_failure("b")
+    time.sleep(0.25)
+    assert health.check("b") == HostHealth.SKIP
+    time.sleep(0.2)
+    assert health.check("b") == HostHealth.PROBE
+    health.record_success("b", 0.05)
+    assert health.check("b") == HostHealth.OK
+
+    # slow answers count as failures
+    health.record_success("a", 3, slow=True)
+    assert health.check("a") == HostHealth.SKIP
+
+def test_latency_tracker():
+    tracker = LatencyTracker(factor=3, minimum=1)
+    assert tracker.timeout("cmd", 30) == 30
+    for duration in [2, 2, 2, 2, 2, 2, 2, 2, 2, 4]:
+        tracker.record("cmd", duration)
+    assert tracker.timeout("cmd", 30) == 6
+    assert tracker.timeout("cmd", 5) == 5
+    tracker.record("fast", 0.01)
+    assert tracker.timeout("fast", 30) == 1
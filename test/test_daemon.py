@@ -0,0 +1,95 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from swift_health_statsd.collector import Collector, CollectorConfig
+from swift_health_statsd.daemon    import Scheduler, parse_intervals
+
+import logging, threading, time
+
+class SlowCollector(Collector):
+    """ A collector with a fast and a slow step, which records when its runs
+        start and end.
+    """
+    def __init__(self, config):
+        super(SlowCollector, self).__init__(config)
+        self.runs = []
+    def metric_name_prefix(self):
+        return "slow"
+    def logger(self):
+        return logging.getLogger(__name__)
+    def collector_steps(self):
+        return { "fast": self.fast, "slow": self.slow }
+    def run(self, statsd, steps=None):
+        self.runs.append(("start", sorted(steps)))
+        result = Collector.run(self, statsd, steps)
+        self.runs.append(("end", sorted(steps)))
+        return result
+    def fast(self):
+        pass
+    def slow(self):
+        time.sleep(0.25)
+
+class NullStatsClient(object):
+    def pipeline(self):
+        return self
+    def gauge(self, metric, value):
+        pass
+    def send(self):
+        pass
+
+def test_parse_intervals():
+    assert parse_intervals("") == {}
+    assert parse_intervals("unmounted=60, driveaudit=30.5") == { "unmounted": 60, "driveaudit": 30.5 }
+
+def test_scheduler():
+    collector = SlowCollector(CollectorConfig())
+    scheduler = Scheduler(NullStatsClient())
+    scheduler.add_collector(collector, 0.1, { "slow": 0.5 })
+    assert sorted(job.interval for job in scheduler.jobs) == [0.1, 0.5]
+
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.9)
+    scheduler.stop()
+    thread.join()
+
+    # runs of the same collector never overlap
+    for idx, (event, _) in enumerate(collector.runs):
+        assert event == ("start" if idx % 2 == 0 else "end")
+    starts = [ steps for event, steps in collector.runs if event == "start" ]
+    # the slow step is due at t=0 and t=0.5, when the fast step is due, too:
+    # both run together instead of one of them being skipped
+    assert sum(1 for steps in starts if "slow" in steps) == 2
+    assert starts[0] == ["fast", "slow"]
+    # the fast step is due 9 times; ticks where the slow step is running are
+    # caught up once it is done (instead of piling up runs for later)
+    assert 4 <= sum(1 for steps in starts if "fast" in steps) <= 9
+
+def test_scheduler_multiple_interval():
+    # the default interval is a multiple of the step interval, so both jobs
+    # are due at the same ticks
+    collector = SlowCollector(CollectorConfig())
+    collector.slow = lambda: None
+    scheduler = Scheduler(NullStatsClient())
+    scheduler.add_collector(collector, 0.2, { "fast": 0.05 })
+
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(1.05)
+    scheduler.stop()
+    thread.join()
+
+    starts = [ steps for event, steps in collector.runs if event == "start" ]
+    assert 5 <= starts.count(["fast", "slow"]) <= 7
+    assert len(starts) >= 15 and all("fast" in steps for steps in starts)
@@ -0,0 +1,48 @@
+# Copyright 2017 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from swift_health_statsd.reprparse import parse_repr, parse_repr_fast
+
+import ast, glob, re
+
+import pytest
+
+def test_parse_repr_fixtures():
+    rx = re.compile(r'^-> https?://[a-zA-Z0-9-.]+\S*\s([\[{].*)')
+    count = 0
+    for path in glob.glob("test/fixtures/recon_*"):
+        with open(path) as f:
+            for line in f:
+                m = rx.match(line)
+                if m:
+                    # all of these must be handled by the fast path
+                    assert parse_repr_fast(m.group(1)) == ast.literal_eval(m.group(1))
+                    count += 1
+    assert count > 0
+
+def test_parse_repr_fallback():
+    for text in [
+        "{u'device': u'sdb', u'mounted': False, u'size': None, u'x': True}",
+        "[1, -2.5, 1e-05, u'None', u'True', u'u', u'']",
+        "{u'quote': u\"it's\"}",           # double quotes
+        "{u'path': u'C:\\\\swift'}",       # backslash escapes
+        "{1: u'a', 2: (3, 4)}",            # non-string keys, tuples
+        "[1, 2,]",                         # trailing comma
+    ]:
+        assert parse_repr(text) == ast.literal_eval(text)
+
+    # things that literal_eval rejects must still be rejected
+    for text in ["[NaN]", "[Infinity]", "{u'a': nothing}", "u'unterminated"]:
+        with pytest.raises((ValueError, SyntaxError)):
+            parse_repr(text)